@@ -1,6 +1,10 @@
 """
     Subclass of Configparser for sectionless configuration files.
     Implements slicing as additional get/set methods.
+
+    Parsed files are cached process-wide, keyed by path and validated
+    against inode, mtime and size, so repeated loads of an unchanged
+    file skip parsing.
 """
 
 __author__ = "William Dizon"
@@ -8,7 +12,40 @@ __license__ = "GNU GPL v3.0"
 __version__ = "0.6.0"
 __email__ = "wdchromium@gmail.com"
 
+import os
 import ConfigParser
+from threading import Lock
+
+_parse_cache = {}
+_parse_cache_lock = Lock()
+_parse_cache_counts = {'hits': 0, 'misses': 0}
+
+def _signature(filepath):
+    """Returns (st_ino, mtime in ns, st_size) of a file, or None"""
+    try:
+        st = os.stat(filepath)
+    except (OSError, TypeError):
+        return None
+    return (st.st_ino, int(st.st_mtime * 1e9), st.st_size)
+
+def cache_info():
+    """Returns hit/miss counters and the size of the parse cache"""
+    with _parse_cache_lock:
+        hits, misses = _parse_cache_counts['hits'], _parse_cache_counts['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': float(hits) / (hits + misses) if hits + misses else None,
+            'entries': len(_parse_cache),
+            }
+
+def invalidate(filepath=None):
+    """Drops the cached parse of one file, or of every file"""
+    with _parse_cache_lock:
+        if filepath is None:
+            _parse_cache.clear()
+        else:
+            _parse_cache.pop(os.path.abspath(filepath), None)
 
 class config_file_sectionless(object):
     def __init__(self, filepath):
@@ -34,6 +71,21 @@ class config_file(ConfigParser.SafeConfigParser):
     def __init__(self, filepath=None):
         ConfigParser.SafeConfigParser.__init__(self, allow_no_value=True)
         self.filepath = filepath
+        self._shared = False
+
+        signature = _signature(filepath)
+        self.signature = signature
+        if signature is not None:
+            key = os.path.abspath(filepath)
+            with _parse_cache_lock:
+                cached = _parse_cache.get(key)
+                if cached is not None and cached[0] == signature:
+                    _parse_cache_counts['hits'] += 1
+                    self._sections, self._defaults, self._use_sections = cached[1:]
+                    self._shared = True
+                    return
+                _parse_cache_counts['misses'] += 1
+
         self.use_sections(True)
 
         try:
@@ -46,6 +98,41 @@ class config_file(ConfigParser.SafeConfigParser):
             if filepath is not None:
                 raise
 
+        if signature is not None:
+            with _parse_cache_lock:
+                _parse_cache[key] = (signature, self._sections, self._defaults, self._use_sections)
+            self._shared = True
+
+    def _unshare(self):
+        """Copies the parsed sections shared with the cache before the
+        first modification (copy-on-write)"""
+        if self._shared:
+            self._sections = self._dict((name, options.copy()) for name, options in self._sections.iteritems())
+            self._defaults = self._defaults.copy()
+            self._shared = False
+
+    def set(self, section, option, value=None):
+        self._unshare()
+        ConfigParser.SafeConfigParser.set(self, section, option, value)
+
+    def add_section(self, section):
+        if section not in self._sections:
+            self._unshare()
+        ConfigParser.SafeConfigParser.add_section(self, section)
+
+    def remove_section(self, section):
+        if section in self._sections:
+            self._unshare()
+        return ConfigParser.SafeConfigParser.remove_section(self, section)
+
+    def remove_option(self, section, option):
+        self._unshare()
+        return ConfigParser.SafeConfigParser.remove_option(self, section, option)
+
+    def _read(self, fp, fpname):
+        self._unshare()
+        ConfigParser.SafeConfigParser._read(self, fp, fpname)
+
     def __enter__(self):
         return self
 
@@ -194,14 +281,74 @@ class config_file(ConfigParser.SafeConfigParser):
             else:
                 raise TypeError('Inappropriate argument type: %s' % type(option))
 
-    def commit(self):
+    def changed_on_disk(self):
+        """Returns True if filepath was modified, replaced or removed
+        since this instance loaded (or last committed) it"""
+        return _signature(self.filepath) != self.signature
+
+    @property
+    def version(self):
+        """Returns an opaque token of filepath as currently on disk, or
+        None if it does not exist; it changes whenever the file does"""
+        signature = _signature(self.filepath)
+        return None if signature is None else '%d-%d-%d' % signature
+
+    def commit(self, reject_changed=False):
+        """Writes the configuration to a temporary file in the same
+        directory, then renames it over filepath, so readers never see a
+        truncated file.  Mode and ownership of the original are kept;
+        if they cannot be (or the directory is not writable) the file is
+        rewritten in place instead.
+
+        With reject_changed, raises RuntimeError without writing if the
+        file was modified since this instance loaded it.
+        """
+        from cStringIO import StringIO
+
+        if self.filepath is not None:
+            invalidate(self.filepath)
+
+        if reject_changed and self.changed_on_disk():
+            raise RuntimeError('%s was modified since it was loaded; '
+                               'no changes were written' % self.filepath)
+
+        buf = StringIO()
         if self._use_sections:
-            with open(self.filepath, 'wb') as configfile:
-                self.write(configfile)
+            self.write(buf)
         else:
-            with open(self.filepath, "w") as configfile:
-                for k,v in self.items('sectionless'):
-                    configfile.write("%s=%s\n" % (k.strip(), v.strip()))
+            for k,v in self.items('sectionless'):
+                buf.write("%s=%s\n" % (k.strip(), v.strip()))
+
+        try:
+            self._replace(buf.getvalue())
+        except (OSError, IOError):
+            with open(self.filepath, 'wb') as configfile:
+                configfile.write(buf.getvalue())
+        self.signature = _signature(self.filepath)
+
+    def _replace(self, contents):
+        """Atomically replaces an existing filepath with contents via
+        temp file, fsync and rename"""
+        from tempfile import mkstemp
+
+        if os.path.islink(self.filepath):
+            raise OSError('%s is a symlink; rewriting in place' % self.filepath)
+
+        st = os.stat(self.filepath)
+        directory = os.path.dirname(os.path.abspath(self.filepath))
+        fd, tmp_path = mkstemp(prefix='.%s.' % os.path.basename(self.filepath), dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(contents)
+                tmp.flush()
+                os.fchmod(tmp.fileno(), st.st_mode & 07777)
+                if (st.st_uid, st.st_gid) != (os.geteuid(), os.getegid()):
+                    os.fchown(tmp.fileno(), st.st_uid, st.st_gid)
+                os.fsync(tmp.fileno())
+            os.rename(tmp_path, self.filepath)
+        except:
+            os.remove(tmp_path)
+            raise
 
     def use_sections(self, value):
         if value:
@@ -0,0 +1,225 @@
+#!/usr/bin/env python2.7
+"""
+    A content-addressed chunk store shared by the archives of every server.
+
+    Files are split into fixed-size chunks, each kept once in the store
+    under its sha256, so jars, profiles and unchanged region data that
+    appear in many archives (of one server or many) take their space once.
+    An archive itself is only a manifest: the tree's files, modes and
+    chunk lists, gzipped json.
+
+    Only the owner of the store directory adds chunks, so archiving runs
+    as that user.  Restoring may run as anyone: each chunk read must be
+    a regular file of the store's owner whose contents hash to its name.
+
+    Usage (see tree_manifest):
+        dedup_store.py archive <store> <manifest> <source>
+        dedup_store.py restore <store> <manifest> <destination>
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import os
+import stat
+from contextlib import contextmanager
+
+import tree_manifest
+
+CHUNK_SIZE = 256 * 1024
+MANIFEST_VERSION = 1
+
+def chunk_path(store, digest):
+    return os.path.join(store, digest[:2], digest[2:])
+
+def store_directory(path):
+    """Creates a directory of the store: readable by every server
+    owner, writable only by the store's owner"""
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+    else:
+        os.chmod(path, 0755)
+
+def secure_store(store):
+    """Makes the store and its fanout directories belong to the owner
+    of the store and be writable by no one else"""
+    store_directory(store)
+    st = os.stat(store)
+    os.chmod(store, 0755)
+    for fanout in os.listdir(store):
+        directory = os.path.join(store, fanout)
+        if len(fanout) == 2 and os.path.isdir(directory) and not os.path.islink(directory):
+            os.chown(directory, st.st_uid, st.st_gid)
+            os.chmod(directory, 0755)
+
+@contextmanager
+def store_lock(store, exclusive=False):
+    """Held shared while archiving, so that collect() (which holds it
+    exclusively) never removes chunks of a manifest not yet written"""
+    import fcntl
+
+    store_directory(store)
+    fd = os.open(os.path.join(store, '.lock'), os.O_RDONLY | os.O_CREAT, 0644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+    finally:
+        os.close(fd)
+
+def store_chunk(store, data):
+    """Adds a chunk to the store unless already present.
+    Returns (digest, True if the chunk was new)."""
+    from hashlib import sha256
+    from tempfile import NamedTemporaryFile
+    from zlib import compress
+
+    digest = sha256(data).hexdigest()
+    path = chunk_path(store, digest)
+    try:
+        st = os.lstat(path)
+    except OSError:
+        pass
+    else:
+        if _trusted(store, st):
+            return digest, False
+        #planted while the store was writable by every server owner
+        os.remove(path)
+
+    store_directory(os.path.dirname(path))
+    with NamedTemporaryFile('wb', dir=os.path.dirname(path), prefix='.', delete=False) as fh:
+        fh.write(compress(data, 3))
+    os.chmod(fh.name, 0444)
+    os.rename(fh.name, path)
+    return digest, True
+
+def _trusted(store, st):
+    """Whether a chunk's lstat result is a regular file of the owner
+    of the store"""
+    return stat.S_ISREG(st.st_mode) and st.st_uid == os.stat(store).st_uid
+
+def read_chunk(store, digest):
+    """Returns the data of a chunk, refusing chunks not written by the
+    store's owner or whose contents do not match their digest"""
+    from hashlib import sha256
+    from zlib import decompress, error
+
+    path = chunk_path(store, digest)
+    fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    with os.fdopen(fd, 'rb') as fh:
+        if not _trusted(store, os.fstat(fd)):
+            raise RuntimeError('Chunk %s is not owned by the owner of the store' % digest)
+        try:
+            data = decompress(fh.read())
+        except error:
+            data = None
+
+    if data is None or sha256(data).hexdigest() != digest:
+        raise RuntimeError('Chunk %s is corrupt' % digest)
+    return data
+
+def create(store, manifest_path, source, chunk_size=CHUNK_SIZE):
+    """Stores the tree at source and writes its manifest.
+    Returns a dict of counts: files, chunks, new_chunks, bytes, new_bytes."""
+    from time import time
+
+    stats = dict.fromkeys(('files', 'chunks', 'new_chunks', 'bytes', 'new_bytes'), 0)
+    entries = []
+
+    with store_lock(store):
+        for path, entry in tree_manifest.walk(source):
+            if 'type' not in entry:
+                entry.update(type='file', size=0, chunks=[])
+                with open(path, 'rb') as fh:
+                    for data in iter(lambda: fh.read(chunk_size), ''):
+                        digest, new = store_chunk(store, data)
+                        entry['chunks'].append(digest)
+                        entry['size'] += len(data)
+                        stats['chunks'] += 1
+                        if new:
+                            stats['new_chunks'] += 1
+                            stats['new_bytes'] += len(data)
+                stats['files'] += 1
+                stats['bytes'] += entry['size']
+            entries.append(entry)
+
+        tree_manifest.write_manifest(manifest_path, MANIFEST_VERSION,
+                                     created=time(),
+                                     chunk_size=chunk_size,
+                                     entries=entries)
+
+    return stats
+
+def restore(store, manifest_path, destination):
+    """Rebuilds the tree of a manifest at destination, overwriting
+    files of the same name.  Returns the number of files written."""
+    def write_file(entry, path):
+        with open(path, 'wb') as fh:
+            for digest in entry['chunks']:
+                fh.write(read_chunk(store, digest))
+
+    entries = tree_manifest.read_manifest(manifest_path, MANIFEST_VERSION)['entries']
+    return tree_manifest.restore_tree(destination, entries, write_file)
+
+def archived_bytes(manifest_path):
+    """Returns the total size of the files a manifest records"""
+    entries = tree_manifest.read_manifest(manifest_path, MANIFEST_VERSION)['entries']
+    return sum(entry.get('size', 0) for entry in entries)
+
+def collect(store, patterns):
+    """Removes every chunk no manifest matching the glob patterns
+    refers to.  The manifests are found and read only once the store is
+    locked, so an archive finished meanwhile keeps its chunks.
+    Returns a dict of chunks kept, chunks removed and bytes reclaimed."""
+    from glob import glob
+
+    stats = dict.fromkeys(('kept', 'removed', 'bytes'), 0)
+    if not os.path.isdir(store):
+        return stats
+
+    with store_lock(store, exclusive=True):
+        referenced = set()
+        for pattern in patterns:
+            for path in glob(pattern):
+                for entry in tree_manifest.read_manifest(path, MANIFEST_VERSION)['entries']:
+                    referenced.update(entry.get('chunks', ()))
+
+        for fanout in os.listdir(store):
+            directory = os.path.join(store, fanout)
+            if len(fanout) != 2 or not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                if fanout + name in referenced:
+                    stats['kept'] += 1
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    size = os.path.getsize(path)
+                    os.remove(path)
+                except OSError:
+                    continue
+                stats['removed'] += 1
+                stats['bytes'] += size
+
+    return stats
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='MineOS deduplicating archive store')
+    parser.add_argument('cmd', choices=('archive', 'restore'))
+    parser.add_argument('store', help='the shared chunk store')
+    parser.add_argument('manifest', help='the manifest to write or read')
+    parser.add_argument('path', help='the tree to archive, or to restore into')
+    args = parser.parse_args()
+
+    if args.cmd == 'archive':
+        stats = create(args.store, args.manifest, args.path)
+        print '%(files)d files, %(bytes)d bytes in %(chunks)d chunks; ' \
+              '%(new_chunks)d new chunks, %(new_bytes)d bytes stored' % stats
+    else:
+        print '%d files restored' % restore(args.store, args.manifest, args.path)
@@ -0,0 +1,341 @@
+"""
+    Watches the servers, backup, archive, import and profiles trees of a
+    base_directory and publishes invalidations to in-process caches.
+
+    Directory listings are cached only while their directory is watched,
+    so between changes they cost nothing.  inotify is used through ctypes
+    where available; otherwise directories are polled for mtime changes.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import os
+import errno
+import struct
+from threading import Lock, Thread, Event
+
+_listings = {}
+_generations = {}
+_watched = set()
+_subscribers = []
+_lock = Lock()
+_counts = {'hits': 0, 'misses': 0, 'invalidations': 0}
+
+def _scan(directory):
+    try:
+        return os.walk(directory).next()[1:]
+    except StopIteration:
+        return ([], [])
+
+def listing(directory):
+    """Returns ([subdirectories], [files]) of directory.  While directory
+    is watched, the listing is read once and served from memory until an
+    invalidation arrives."""
+    path = os.path.normpath(directory)
+    with _lock:
+        try:
+            dirs, files = _listings[path]
+        except KeyError:
+            watched = path in _watched
+            generation = _generations.get(path, 0)
+            _counts['misses'] += 1
+        else:
+            _counts['hits'] += 1
+            return list(dirs), list(files)
+
+    dirs, files = _scan(path)
+    if watched:
+        with _lock:
+            #an invalidation during the scan means the result may be stale
+            if path in _watched and _generations.get(path, 0) == generation:
+                _listings[path] = (tuple(dirs), tuple(files))
+    return dirs, files
+
+def invalidate(path):
+    """Drops the cached listing of path (and of its parent, for a
+    created or removed entry) and notifies every subscriber of path"""
+    path = os.path.normpath(path)
+    with _lock:
+        for p in (path, os.path.dirname(path)):
+            _listings.pop(p, None)
+            _generations[p] = _generations.get(p, 0) + 1
+        _counts['invalidations'] += 1
+        subscribers = list(_subscribers)
+
+    for callback in subscribers:
+        try:
+            callback(path)
+        except Exception:
+            pass
+
+def subscribe(callback):
+    """Registers callback(path) to be called for every changed path"""
+    with _lock:
+        if callback not in _subscribers:
+            _subscribers.append(callback)
+
+def unsubscribe(callback):
+    with _lock:
+        try:
+            _subscribers.remove(callback)
+        except ValueError:
+            pass
+
+def cache_info():
+    """Returns listing cache counters and the number of watched directories"""
+    with _lock:
+        info = dict(_counts)
+        info.update(entries=len(_listings), watched=len(_watched))
+        return info
+
+def _watch(path):
+    with _lock:
+        _watched.add(path)
+        _generations[path] = _generations.get(path, 0) + 1
+
+def _unwatch(path):
+    with _lock:
+        _watched.discard(path)
+        _listings.pop(path, None)
+        _generations[path] = _generations.get(path, 0) + 1
+
+class inotify(object):
+    """Minimal ctypes binding of the Linux inotify API"""
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x800
+    IN_CLOEXEC = 0x80000
+
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+           IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self):
+        import ctypes
+        from ctypes.util import find_library
+
+        self._libc = ctypes.CDLL(find_library('c') or 'libc.so.6', use_errno=True)
+        try:
+            self.fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        except AttributeError:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path):
+        import ctypes
+
+        wd = self._libc.inotify_add_watch(self.fd, path, self.MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_add_watch failed: %s' % path)
+        return wd
+
+    def rm_watch(self, wd):
+        self._libc.inotify_rm_watch(self.fd, wd)
+
+    def read(self):
+        """Returns every pending (wd, mask, name) event"""
+        try:
+            buf = os.read(self.fd, 65536)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return []
+            raise
+
+        events = []
+        offset = 0
+        while offset + self._EVENT.size <= len(buf):
+            wd, mask, cookie, length = self._EVENT.unpack_from(buf, offset)
+            offset += self._EVENT.size
+            events.append((wd, mask, buf[offset:offset + length].rstrip('\x00')))
+            offset += length
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+class fs_watcher(object):
+    """Watches base_directory, each of its trees and every directory
+    directly inside those trees (one per server, for instance).
+
+    start() and stop() are suitable for cherrypy.engine start/stop
+    subscriptions.  With use_inotify False, or where inotify cannot be
+    initialized, the same directories are polled every `interval` seconds.
+    """
+    TREES = ('servers', 'backup', 'archive', 'import', 'profiles')
+
+    def __init__(self, base_directory, interval=5, use_inotify=True):
+        self.base_directory = os.path.normpath(base_directory)
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.backend = None
+        self._tracked = {}  #path -> depth below base_directory
+        self._stat = {}
+        self._wds = {}
+        self._inotify = None
+        self._stop = Event()
+        self._thread = None
+
+    def _trees(self):
+        from mineos import mc
+        return [os.path.join(self.base_directory, mc.DEFAULT_PATHS.get(t, t)) for t in self.TREES]
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        self._stop.clear()
+        self._inotify = None
+        if self.use_inotify:
+            try:
+                self._inotify = inotify()
+            except OSError:
+                self._inotify = None
+        self.backend = 'inotify' if self._inotify else 'polling'
+
+        self._track(self.base_directory, 0)
+        for tree in self._trees():
+            self._track(tree, 1)
+
+        self._thread = Thread(target=self._run, name='fs_watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        for path in self._tracked.keys():
+            self._untrack(path)
+        if self._inotify:
+            self._inotify.close()
+            self._inotify = None
+
+    def _track(self, path, depth):
+        """Watches path and, above the first level of trees, its subdirectories"""
+        path = os.path.normpath(path)
+        if path in self._tracked:
+            return
+        if depth and not os.path.isdir(path):
+            return
+
+        if self._inotify:
+            try:
+                self._wds[self._inotify.add_watch(path)] = path
+            except OSError:
+                return
+        else:
+            try:
+                st = os.stat(path)
+                self._stat[path] = (st.st_ino, st.st_mtime, st.st_uid, st.st_gid)
+            except OSError:
+                return
+
+        self._tracked[path] = depth
+        _watch(path)
+        invalidate(path)
+
+        if depth == 1:
+            for d in _scan(path)[0]:
+                self._track(os.path.join(path, d), 2)
+
+    def _untrack(self, path):
+        self._tracked.pop(path, None)
+        self._stat.pop(path, None)
+        for wd, p in self._wds.items():
+            if p == path:
+                del self._wds[wd]
+                if self._inotify:
+                    self._inotify.rm_watch(wd)
+        _unwatch(path)
+        invalidate(path)
+
+    def _changed_directory(self, path):
+        """Re-syncs the tracked subdirectories of a changed directory"""
+        depth = self._tracked.get(path)
+        if depth is None:
+            return
+        elif depth == 0:
+            for tree in self._trees():
+                self._track(tree, 1)
+        elif depth == 1:
+            for d in _scan(path)[0]:
+                self._track(os.path.join(path, d), 2)
+
+        for p, d in self._tracked.items():
+            if d == depth + 1 and os.path.dirname(p) == path and not os.path.isdir(p):
+                self._untrack(p)
+
+    def _run(self):
+        import select
+
+        while not self._stop.is_set():
+            if self._inotify:
+                try:
+                    readable = select.select([self._inotify.fd], [], [], 1)[0]
+                except select.error:
+                    continue
+                if readable:
+                    self._handle(self._inotify.read())
+            else:
+                self._stop.wait(self.interval)
+                if not self._stop.is_set():
+                    self.poll()
+
+    def _handle(self, events):
+        for wd, mask, name in events:
+            if mask & inotify.IN_Q_OVERFLOW:
+                for path in self._tracked.keys():
+                    invalidate(path)
+                    self._changed_directory(path)
+                continue
+
+            try:
+                path = self._wds[wd]
+            except KeyError:
+                continue
+
+            if mask & (inotify.IN_IGNORED | inotify.IN_DELETE_SELF | inotify.IN_MOVE_SELF):
+                self._untrack(path)
+                continue
+
+            invalidate(os.path.join(path, name) if name else path)
+            if mask & inotify.IN_ISDIR and mask & (inotify.IN_CREATE | inotify.IN_DELETE |
+                                                   inotify.IN_MOVED_FROM | inotify.IN_MOVED_TO):
+                self._changed_directory(path)
+
+    def poll(self):
+        """Checks every tracked directory for a changed inode, mtime or
+        owner (a chown, which inotify reports as IN_ATTRIB)"""
+        for path, depth in sorted(self._tracked.items(), key=lambda i: i[1]):
+            if path not in self._tracked:
+                continue
+            try:
+                st = os.stat(path)
+            except OSError:
+                self._untrack(path)
+                continue
+
+            signature = (st.st_ino, st.st_mtime, st.st_uid, st.st_gid)
+            if self._stat.get(path) != signature:
+                self._stat[path] = signature
+                invalidate(path)
+                self._changed_directory(path)
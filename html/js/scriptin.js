@@ -742,15 +742,58 @@ function webui() {
 				text: (data.payload) ? data.payload : '{0} [{1}]'.format(data.cmd, data.result),
 				sticky: false,
 				time: '3000',
-				class_name: 'gritter-{0}'.format(data.result)
+				class_name: 'gritter-{0}'.format(data.result == 'queued' ? 'info' : data.result)
 			});
 			console.log(data);
 
-			if (data.result == 'success')
+			if (data.result == 'queued')
+				return self.ajax.job(data.job);
+			else if (data.result == 'success')
 				return $.Deferred().resolve().promise();
 			else
 				return $.Deferred().reject().promise();
 		},
+		job: function(job_id) {
+			/* polls a queued command until it ends, then reports its final state */
+			var done = $.Deferred();
+
+			function poll() {
+				$.getJSON('/jobs', {job_id: job_id}).then(function(job) {
+					if (!job.state) {
+						/* unknown, expired or not ours: nothing left to follow */
+						$.gritter.add({
+							text: 'job {0} is no longer available'.format(job_id),
+							sticky: false,
+							time: '3000',
+							class_name: 'gritter-error'
+						});
+						done.reject();
+						return;
+					} else if (job.state == 'queued' || job.state == 'running') {
+						setTimeout(poll, 1000);
+						return;
+					}
+
+					$.gritter.add({
+						text: '{0} [{1}]{2}'.format(job.action, job.state, job.error ? ': ' + job.error : ''),
+						sticky: false,
+						time: '3000',
+						class_name: 'gritter-{0}'.format(job.state == 'finished' ? 'success' : 'error')
+					});
+					self.ajax.refresh(null);
+
+					if (job.state == 'finished')
+						done.resolve();
+					else
+						done.reject();
+				}, function() {
+					setTimeout(poll, 5000);
+				});
+			}
+
+			poll();
+			return done.promise();
+		},
 		lost: function(data) {
 			$.gritter.add({
 				text: data.payload || 'Server did not respond to request',
@@ -0,0 +1,105 @@
+"""
+    Follows a server's log to confirm that console commands took effect,
+    e.g., that save-all has finished writing the world to disk.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import io
+import os
+import re
+
+SAVED = ('Saved the game', 'Saved the world', 'Save complete')
+STOPPING = ('Stopping server', 'Stopping the server')
+
+#the earliest ']: ' (1.7+, bukkit) or '[INFO] ' (server.log) ends the prefix
+_PREFIX = re.compile(r'^(.*?)(?:\]: |\[INFO\] )')
+
+def message(line):
+    """Returns the message of an INFO line logged by the server itself,
+    without its timestamp, thread and level prefix, or None.  Chat and
+    /say lines carry a <name> or [name] prefix in their message, so
+    what players type never reads as a message of the server."""
+    match = _PREFIX.match(line)
+    if match is None or 'INFO' not in line[:match.end()]:
+        return None
+
+    text = line[match.end():].strip()
+    if text.startswith('CONSOLE: '):
+        text = text[len('CONSOLE: '):]
+    return text.rstrip('.')
+
+class log_watcher(object):
+    """Reads lines appended to a log file after the watcher was created.
+    A rotated or truncated log is followed from the start of the new file.
+
+    Create the watcher before issuing the command whose output is
+    expected, so that no line is missed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+        self._ino = None
+        self._partial = ''
+        self._open(from_end=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def _open(self, from_end):
+        self.close()
+        try:
+            #io.open rather than file(): reads after reaching EOF see appended data
+            self._fh = io.open(self.path, 'rb')
+        except IOError:
+            return
+        self._ino = os.fstat(self._fh.fileno()).st_ino
+        if from_end:
+            self._fh.seek(0, os.SEEK_END)
+        self._partial = ''
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def lines(self):
+        """Returns the complete lines appended since the last call"""
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            st = None
+
+        if self._fh is None:
+            if st is not None:
+                self._open(from_end=False)
+        elif st is not None and (st.st_ino != self._ino or st.st_size < self._fh.tell()):
+            self._open(from_end=False)
+
+        if self._fh is None:
+            return []
+
+        data = self._partial + self._fh.read()
+        lines = data.split('\n')
+        self._partial = lines.pop()
+        return lines
+
+    def wait_for(self, patterns, timeout, interval=0.05):
+        """Returns the first new line whose message() is one of patterns,
+        or None if none was logged within timeout seconds"""
+        from time import sleep, time
+
+        deadline = time() + timeout
+        while True:
+            for line in self.lines():
+                if message(line) in patterns:
+                    return line
+            if time() >= deadline:
+                return None
+            sleep(interval)
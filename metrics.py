@@ -0,0 +1,279 @@
+"""
+    Resource sampling of running minecraft servers into fixed-size,
+    array-backed ring buffers and persistent round-robin archives.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import os
+import struct
+from array import array
+from threading import Lock
+
+class ring_buffer(object):
+    """Fixed-capacity circular series of numbers backed by array.array.
+    Appending is O(1) and allocates nothing once constructed.
+    """
+    def __init__(self, capacity, typecode='d'):
+        self._data = array(typecode, [0]) * capacity
+        self._capacity = capacity
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self._capacity
+        self._count = min(self._count + 1, self._capacity)
+
+    def last(self):
+        """Returns the most recently appended value"""
+        if not self._count:
+            raise IndexError('ring_buffer is empty')
+        return self._data[self._next - 1]
+
+    def values(self):
+        """Returns the contents as a list, oldest first"""
+        if self._count < self._capacity:
+            return self._data[:self._count].tolist()
+        return (self._data[self._next:] + self._data[:self._next]).tolist()
+
+class round_robin_archive(object):
+    """Fixed-size, memory-mapped history of one server's metrics.
+
+    Every resolution (step seconds x rows) is a ring of fixed-width rows:
+    the slot number (timestamp // step) followed by a running sum and
+    sample count per field.  A write touches exactly one row per
+    resolution and is left to the kernel to flush; reads unpack rows
+    directly from the map.
+    """
+    MAGIC = 'MRRA'
+    VERSION = 1
+    FIELDS = ('cpu', 'rss', 'players', 'ping')
+    RESOLUTIONS = ((10, 2160),   #6 hours of 10 second averages
+                   (60, 2880),   #2 days of 1 minute averages
+                   (3600, 8760)) #1 year of 1 hour averages
+
+    _HEADER = struct.Struct('<4sIII')
+    _RESOLUTION = struct.Struct('<II')
+    _ROW = struct.Struct('<q%dd%dI' % (len(FIELDS), len(FIELDS)))
+
+    def __init__(self, path, readonly=False):
+        import mmap
+
+        self.path = path
+        self.readonly = readonly
+
+        header = self._HEADER.pack(self.MAGIC, self.VERSION, len(self.RESOLUTIONS), len(self.FIELDS)) + \
+                 ''.join(self._RESOLUTION.pack(step, rows) for step, rows in self.RESOLUTIONS)
+        self._offsets = []
+        size = len(header)
+        for step, rows in self.RESOLUTIONS:
+            self._offsets.append(size)
+            size += rows * self._ROW.size
+
+        with open(path, 'rb' if readonly else 'a+b') as fh:
+            if readonly:
+                if fh.read(len(header)) != header:
+                    raise ValueError('%s is not a compatible metrics archive' % path)
+                self._map = mmap.mmap(fh.fileno(), size, access=mmap.ACCESS_READ)
+            else:
+                fh.seek(0)
+                if fh.read(len(header)) != header or os.fstat(fh.fileno()).st_size != size:
+                    #new or incompatible layout: start an empty archive
+                    fh.truncate(0)
+                    fh.write(header)
+                    fh.truncate(size)
+                    fh.flush()
+                self._map = mmap.mmap(fh.fileno(), size)
+
+    def close(self):
+        self._map.close()
+
+    def _pos(self, level, slot):
+        return self._offsets[level] + (slot % self.RESOLUTIONS[level][1]) * self._ROW.size
+
+    def update(self, timestamp, **values):
+        """Adds one reading of any FIELDS to every resolution.
+        None and NaN values are skipped."""
+        width = len(self.FIELDS)
+        values = [(self.FIELDS.index(k), v) for k, v in values.iteritems() if v is not None and v == v]
+
+        for level, (step, rows) in enumerate(self.RESOLUTIONS):
+            slot = int(timestamp // step)
+            pos = self._pos(level, slot)
+            row = list(self._ROW.unpack_from(self._map, pos))
+            if row[0] != slot:
+                row = [slot] + [0.0] * width + [0] * width
+            for index, value in values:
+                row[1 + index] += value
+                row[1 + width + index] += 1
+            self._ROW.pack_into(self._map, pos, *row)
+
+    def fetch(self, field, start, end, step=None):
+        """Returns (step, [(timestamp, average), ...]) for field between
+        start and end.  Without step, the finest resolution still holding
+        start is chosen.  Slots without readings are omitted.
+        """
+        from time import time
+
+        index = self.FIELDS.index(field)
+        width = len(self.FIELDS)
+        now = time()
+
+        if step is None:
+            level = next((i for i, (s, rows) in enumerate(self.RESOLUTIONS) if now - start < s * rows),
+                         len(self.RESOLUTIONS) - 1)
+        else:
+            level = [s for s, rows in self.RESOLUTIONS].index(step)
+        step, rows = self.RESOLUTIONS[level]
+
+        last = int(min(end, now) // step)
+        points = []
+        for slot in xrange(max(int(start // step), last - rows + 1), last + 1):
+            row = self._ROW.unpack_from(self._map, self._pos(level, slot))
+            count = row[1 + width + index]
+            if row[0] == slot and count:
+                points.append((slot * step, row[1 + index] / count))
+        return step, points
+
+class resource_sampler(object):
+    """Samples cpu, memory, thread and disk i/o usage of every running
+    server's java process from /proc/<pid>/{stat,status,io}.
+
+    Intended to be driven by a cherrypy Monitor every `interval` seconds;
+    each server keeps the last `capacity` samples of every series.
+    """
+    SERIES = ('timestamp', 'cpu', 'rss', 'threads', 'read_bps', 'write_bps')
+
+    def __init__(self, base_directory, interval=5, capacity=720, archive_directory=None):
+        self.base_directory = os.path.normpath(base_directory)
+        self.interval = interval
+        self.capacity = capacity
+        self.archive_directory = archive_directory
+        self._series = {}
+        self._previous = {}
+        self._archives = {}
+        self._lock = Lock()
+        self._clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+
+    @staticmethod
+    def archive_path(archive_directory, server_name):
+        """Returns the path of a server's round_robin_archive"""
+        return os.path.join(archive_directory, '%s.rra' % server_name)
+
+    def record(self, server_name, timestamp=None, **values):
+        """Writes readings (see round_robin_archive.FIELDS) to a server's
+        persistent history, if an archive_directory is configured."""
+        from time import time
+
+        if not self.archive_directory:
+            return
+
+        with self._lock:
+            try:
+                archive = self._archives[server_name]
+            except KeyError:
+                try:
+                    archive = round_robin_archive(self.archive_path(self.archive_directory, server_name))
+                except (IOError, OSError, ValueError):
+                    return
+                self._archives[server_name] = archive
+            archive.update(timestamp or time(), **values)
+
+    def sample(self):
+        """Records one sample for every server running from base_directory"""
+        from mineos import mc
+
+        seen = set()
+        for server_name, java_pid, screen_pid, base_dir in mc.list_servers_up():
+            if java_pid and os.path.normpath(base_dir) == self.base_directory:
+                self.sample_process(server_name, java_pid)
+                seen.add(server_name)
+
+        with self._lock:
+            for server_name in set(self._previous) - seen:
+                del self._previous[server_name]
+            for server_name in set(self._archives) - seen:
+                #stopped or deleted servers release their archive; record() reopens it
+                self._archives.pop(server_name).close()
+
+    def sample_process(self, server_name, pid):
+        """Reads a single process and appends to server_name's series.
+        The first reading of a pid only primes the cpu and i/o deltas.
+        """
+        from procfs_reader import pid_fields
+        from time import time
+
+        now = time()
+        try:
+            proc = pid_fields(pid, stat=('utime', 'stime', 'num_threads'), status=('VmRSS',))
+        except (IOError, IndexError, ValueError):
+            return
+
+        try:
+            proc.update(pid_fields(pid, io=('read_bytes', 'write_bytes')))
+        except (IOError, ValueError):
+            #/proc/<pid>/io is only readable by the process owner or root
+            proc.update(read_bytes=None, write_bytes=None)
+
+        ticks = proc['utime'] + proc['stime']
+        current = (pid, now, ticks, proc['read_bytes'], proc['write_bytes'])
+
+        with self._lock:
+            previous = self._previous.get(server_name)
+            self._previous[server_name] = current
+
+            if not previous or previous[0] != pid or now <= previous[1]:
+                return
+
+            elapsed = now - previous[1]
+
+            def rate(new, old):
+                return float('nan') if new is None or old is None else (new - old) / elapsed
+
+            series = self._series.get(server_name)
+            if series is None:
+                series = dict((k, ring_buffer(self.capacity)) for k in self.SERIES)
+                self._series[server_name] = series
+
+            series['timestamp'].append(now)
+            series['cpu'].append((ticks - previous[2]) / self._clock_ticks / elapsed * 100)
+            series['rss'].append(int(proc['VmRSS'].split()[0]) * 1024)
+            series['threads'].append(proc['num_threads'])
+            series['read_bps'].append(rate(proc['read_bytes'], previous[3]))
+            series['write_bps'].append(rate(proc['write_bytes'], previous[4]))
+
+        self.record(server_name, now,
+                    cpu=series['cpu'].last(),
+                    rss=series['rss'].last())
+
+    def latest(self, server_name, field):
+        """Returns the newest value of a series, or None if the server
+        has no sample from the last two intervals."""
+        from time import time
+
+        with self._lock:
+            try:
+                series = self._series[server_name]
+                if time() - series['timestamp'].last() > self.interval * 2:
+                    return None
+                return series[field].last()
+            except (KeyError, IndexError):
+                return None
+
+    def series(self, server_names=None):
+        """Returns {server_name: {series: [values, oldest first]}};
+        unavailable readings (NaN) are returned as None."""
+        def clean(values):
+            return [None if v != v else v for v in values]
+
+        with self._lock:
+            names = self._series.keys() if server_names is None else server_names
+            return dict((name, dict((k, clean(v.values())) for k, v in self._series[name].iteritems()))
+                        for name in names if name in self._series)
@@ -11,9 +11,12 @@ __email__ = "wdchromium@gmail.com"
 
 import os
 from conf_reader import config_file
+from procfs_reader import pid_snapshot
+from query_engine import query_client
 from collections import namedtuple
 from distutils.spawn import find_executable
 from functools import wraps
+from scheduler import io_slots
 
 def sanitize(fn):
     """Checks that attempted CLI commands have all required fields.
@@ -39,7 +42,7 @@ def server_exists(state):
     def dec(fn):
         @wraps(fn)
         def wrapper(self, *args, **kwargs):
-            if (self.server_name in self.list_servers(self.base)) == state:
+            if (self.server_name in self._server_registry(self.base)) == state:
                 fn(self, *args, **kwargs)
             else:
                 if state:
@@ -69,6 +72,62 @@ def server_up(up):
         return wrapper
     return dec
 
+class lazy_environment(dict):
+    """Environment paths of an mc instance; 'log' depends on which
+    log file exists, so it is only probed for when first looked up.
+    """
+    def __init__(self, locate_log):
+        dict.__init__(self)
+        self._locate_log = locate_log
+
+    def __missing__(self, key):
+        if key == 'log':
+            self._locate_log()
+            if key in self:
+                return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+archive_format = namedtuple('archive_format', 'extension program options')
+
+class server_summary(namedtuple('server_summary', ['server_name',
+                                                    'base',
+                                                    'owner',
+                                                    'cwd',
+                                                    'profile',
+                                                    'up',
+                                                    'screen_pid',
+                                                    'java_pid',
+                                                    'server_type',
+                                                    'ip_address',
+                                                    'port',
+                                                    'query_port',
+                                                    'motd',
+                                                    'max_players',
+                                                    'java_xmx',
+                                                    'eula'])):
+    """Read-only snapshot of the fields fleet-level views need from a
+    server, read without building an mc instance (see mc._server_summaries).
+    Anything beyond these fields goes through instance().
+    """
+    __slots__ = ()
+
+    def instance(self):
+        """Returns a full mc instance of the server, e.g., for modifications"""
+        return mc(self.server_name, self.owner, self.base)
+
+    @property
+    def memory(self):
+        """Returns the amount of memory the java instance is using (VmRSS)"""
+        return mc._pid_memory(self.java_pid)
+
+    @property
+    def server_milestone_long(self):
+        return self.instance().server_milestone_long
+
+    @property
+    def server_list_packet(self):
+        return self.instance().server_list_packet
+
 class mc(object):
 
     NICE_VALUE = 10
@@ -77,7 +136,12 @@ class mc(object):
         'backup': 'backup',
         'archive': 'archive',
         'profiles': 'profiles',
-        'import': 'import'
+        'import': 'import',
+        'metrics': 'metrics',
+        'jobs': 'jobs',
+        'store': 'store',
+        'snapshots': 'snapshots',
+        'run': 'run'
         }
     BINARY_PATHS = {
         'rdiff-backup': find_executable('rdiff-backup'),
@@ -85,6 +149,7 @@ class mc(object):
         'screen': find_executable('screen'),
         'java': find_executable('java'),
         'nice': find_executable('nice'),
+        'ionice': find_executable('ionice'),
         'tar': find_executable('tar'),
         'kill': find_executable('kill'),
         'wget': find_executable('wget'),
@@ -93,8 +158,30 @@ class mc(object):
         'legacy': 'server.log',
         'current': os.path.join('logs', 'latest.log'),
         'bungee': 'proxy.log.0'
-        } 
-    
+        }
+    PROCESS_SNAPSHOT = pid_snapshot(ttl=2.0)
+    PING_PROTOCOLS = {}
+    PING_LEGACY_TTL = 300
+    SERVER_REGISTRIES = {}
+    SAVE_TIMEOUT = 120
+    IO_BUDGET = 8
+    IO_WINDOW = 15
+    IONICE_CLASS = 2
+    IONICE_LEVEL = 7
+    IO_SLOTS = io_slots(2)
+    ARCHIVE_CODECS = {
+        'gzip': archive_format('.tar.gz', None, ''),
+        'pigz': archive_format('.tar.gz', 'pigz', '-p %(threads)s'),
+        'zstd': archive_format('.tar.zst', 'zstd', '-T%(threads)s -3'),
+        'lz4': archive_format('.tar.lz4', 'lz4', '-1'),
+        'none': archive_format('.tar', None, ''),
+        'dedup': archive_format('.dedup', None, ''),
+        }
+    ARCHIVE_THREADS = 0
+    BACKUP_ENGINES = ('rdiff', 'region')
+    SAVE_DURATIONS = {}
+    QUERY_CLIENT = query_client()
+
     def __init__(self,
                  server_name,
                  owner=None,
@@ -106,47 +193,94 @@ class mc(object):
         self._base_directory = base_directory or os.path.expanduser("~")
 
         self._set_environment()
-        try:
-            self._load_config(generate_missing=True)
-        except RuntimeError:
-            pass
-        else:
-            if self.server_config.has_option('java', 'java_bin'):
-                self.upgrade_old_config()
 
     def _set_environment(self):
         """Sets the most common short-hand paths for the minecraft directories
-        and configuration files.
+        and configuration files.  Configuration files are loaded and the
+        log file located only when first used.
         """
         self.server_properties = None
         self.server_config = None
         self.profile_config = None
+        self._server_type = None
         
-        self.env = {
+        self.env = lazy_environment(self._locate_log)
+        self.env.update({
             'cwd': os.path.join(self.base, self.DEFAULT_PATHS['servers'], self.server_name),
             'bwd': os.path.join(self.base, self.DEFAULT_PATHS['backup'], self.server_name),
             'awd': os.path.join(self.base, self.DEFAULT_PATHS['archive'], self.server_name),
-            'pwd': os.path.join(self.base, self.DEFAULT_PATHS['profiles'])
-            }
+            'pwd': os.path.join(self.base, self.DEFAULT_PATHS['profiles']),
+            'swd': os.path.join(self.base, self.DEFAULT_PATHS['snapshots'], self.server_name),
+            'store': os.path.join(self.base, self.DEFAULT_PATHS['store'])
+            })
 
         self.env.update({
             'sp': os.path.join(self.env['cwd'], 'server.properties'),
             'sc': os.path.join(self.env['cwd'], 'server.config'),
             'pc': os.path.join(self.base, self.DEFAULT_PATHS['profiles'], 'profile.config'),
             'sp_backup': os.path.join(self.env['bwd'], 'server.properties'),
-            'sc_backup': os.path.join(self.env['bwd'], 'server.config')
+            'sc_backup': os.path.join(self.env['bwd'], 'server.config'),
+            'runtime': os.path.join(self.base, self.DEFAULT_PATHS['run'], '%s.runtime' % self.server_name)
             })
 
-        for server_type, lp in sorted(self.LOG_PATHS.iteritems()):
+    def _locate_log(self):
+        """Finds the server's log file, which also determines server_type.
+        Sets env['log'] if one exists."""
+        if self._server_type is not None:
+            return
+
+        self._server_type, path = self._find_log(self.env['cwd'])
+        if path is not None:
+            self.env['log'] = path
+
+    @classmethod
+    def _find_log(cls, cwd):
+        """Returns (server_type, path of the log) of a server directory,
+        or ('unknown', None) if it has no log"""
+        for server_type, lp in sorted(cls.LOG_PATHS.iteritems()):
             #implementation detail; sorted() depends on 'current' always preceeding 'legacy',
             #to ensure that current is always tested first in the event both logfiles exist.
-            path = os.path.join(self.env['cwd'], lp)
+            path = os.path.join(cwd, lp)
             if os.path.isfile(path):
-                self.env['log'] = path
-                self._server_type = server_type
-                break
-        else:
-            self._server_type = 'unknown'
+                return server_type, path
+        return 'unknown', None
+
+    @property
+    def server_properties(self):
+        """server.properties of the live server, loaded on first access"""
+        if self._server_properties is None:
+            self._server_properties = config_file(self.env['sp'])
+            self._server_properties.use_sections(False)
+        return self._server_properties
+
+    @server_properties.setter
+    def server_properties(self, value):
+        self._server_properties = value
+
+    @property
+    def server_config(self):
+        """server.config of the live server, loaded on first access;
+        obsolete configs are upgraded when first loaded"""
+        if self._server_config is None:
+            self._server_config = config_file(self.env['sc'])
+            if self._server_config.has_option('java', 'java_bin'):
+                self.upgrade_old_config()
+        return self._server_config
+
+    @server_config.setter
+    def server_config(self, value):
+        self._server_config = value
+
+    @property
+    def profile_config(self):
+        """The shared profile.config, loaded on first access"""
+        if self._profile_config is None:
+            self._profile_config = config_file(self.env['pc'])
+        return self._profile_config
+
+    @profile_config.setter
+    def profile_config(self, value):
+        self._profile_config = value
 
     def _load_config(self, load_backup=False, generate_missing=False):
         """Loads server.properties and server.config for a given server.
@@ -158,15 +292,14 @@ class mc(object):
         def load_sp():
             self.server_properties = config_file(self.env['sp_backup']) if load_backup else config_file(self.env['sp'])
             self.server_properties.use_sections(False)
-            return self.server_properties[:]
 
         def load_sc():
             self.server_config = config_file(self.env['sc_backup']) if load_backup else config_file(self.env['sc'])
-            return self.server_config[:]
+            if not load_backup and self.server_config.has_option('java', 'java_bin'):
+                self.upgrade_old_config()
 
         def load_profiles():
             self.profile_config = config_file(self.env['pc'])
-            return self.profile_config[:]
 
         load_sc()
         load_sp()
@@ -265,7 +398,9 @@ class mc(object):
                 },
             'crontabs': {
                 'archive_interval': '',
+                'archive_codec': 'gzip',
                 'backup_interval': '',
+                'backup_engine': 'rdiff',
                 'restart_interval': '',
                 },
             'onreboot': {
@@ -314,6 +449,7 @@ class mc(object):
         self._create_sc(sc)
         self._create_sp(sp)
         self._load_config()
+        self._invalidate_listings('cwd', 'bwd', 'awd')
 
     @server_exists(True)
     def modify_config(self, option, value, section=None):
@@ -325,6 +461,77 @@ class mc(object):
             with self.server_properties as sp:
                 sp[option] = value
 
+    @server_exists(True)
+    def modify_config_many(self, changes, versions=None):
+        """Applies many changes to server.properties and/or server.config
+        in memory, then writes each modified file once, atomically.
+
+        changes is a list (or its JSON encoding) of [option, value] or
+        [option, value, section] entries, or of dicts with those keys;
+        entries with a section go to server.config.  versions is
+        config_versions (or its JSON encoding) as read when the client
+        loaded the values it edited.  If either file changed since then,
+        or since this instance loaded it, or any change is invalid,
+        nothing is written and RuntimeError is raised.
+        """
+        import json
+
+        try:
+            if isinstance(changes, basestring):
+                changes = json.loads(changes)
+            if isinstance(versions, basestring):
+                versions = json.loads(versions)
+        except ValueError:
+            raise RuntimeError('Ignoring command {modify_config_many}; arguments are not valid JSON')
+        versions = versions or {}
+
+        def text(value):
+            if isinstance(value, bool):
+                return str(value).lower()
+            elif isinstance(value, unicode):
+                return value.encode('utf-8')
+            return str(value)
+
+        sp, sc = self.server_properties, self.server_config
+        touched = set()
+        try:
+            for change in changes:
+                if isinstance(change, dict):
+                    option, value, section = change['option'], change['value'], change.get('section')
+                else:
+                    option, value, section = (list(change) + [None])[:3]
+
+                if section:
+                    sc[text(section):text(option)] = text(value)
+                    touched.add(sc)
+                else:
+                    sp[text(option)] = text(value)
+                    touched.add(sp)
+        except (KeyError, ValueError, TypeError) as e:
+            self.server_properties, self.server_config = None, None
+            raise RuntimeError('Ignoring command {modify_config_many}; invalid change: %s' % e)
+
+        #every file is validated before any is written
+        for key, cf in (('sp', sp), ('sc', sc)):
+            if cf not in touched:
+                continue
+            if cf.changed_on_disk() or versions.get(key, cf.version) != cf.version:
+                self.server_properties, self.server_config = None, None
+                raise RuntimeError('Ignoring command {modify_config_many}; '
+                                   '%s was modified by another writer' % os.path.basename(cf.filepath))
+
+        for cf in touched:
+            cf.commit()
+
+    @property
+    def config_versions(self):
+        """Returns {'sp': token, 'sc': token} of server.properties and
+        server.config as on disk, to pass to modify_config_many"""
+        return {
+            'sp': self.server_properties.version,
+            'sc': self.server_config.version,
+            }
+
     def modify_profile(self, option, value, section):
         """Modifies a value in profile.config
         Whitelisted values that can be changed.
@@ -352,12 +559,29 @@ class mc(object):
             self.profile = self.profile
 
         self._command_direct(self.command_start, self.env['cwd'])
+        self.PROCESS_SNAPSHOT.invalidate()
+        self.PING_PROTOCOLS.pop(self.env['cwd'], None)
+
+        from time import sleep
+        for i in range(20):
+            #screen forks java shortly after detaching; record both pids once visible
+            screen_pid, java_pid = self._record_runtime()
+            if java_pid:
+                break
+            sleep(0.1)
+            self.PROCESS_SNAPSHOT.invalidate()
 
     @server_exists(True)
     @server_up(True)
     def kill(self):
         """Kills a server instance by SIGTERM"""
         self._command_direct(self.command_kill, self.env['cwd'])
+        self.PROCESS_SNAPSHOT.invalidate()
+
+        try:
+            os.remove(self.env['runtime'])
+        except OSError:
+            pass
 
     @server_exists(True)
     @server_up(True)
@@ -369,17 +593,22 @@ class mc(object):
     @server_up(True)
     def stop_and_backup(self):
         """Stop a server, then initiate a backup"""
+        from log_watcher import STOPPING
         from time import sleep
 
-        last_mirror = self.list_increments().current_mirror
+        rdiff = self.backup_engine == 'rdiff'
+        if rdiff:
+            last_mirror = self.list_increments().current_mirror
 
-        self._command_stuff('stop')
+        self._stuff_and_wait('stop', STOPPING)
         while self.up:
-            sleep(1)
+            sleep(0.2)
 
-        self._command_direct(self.command_backup, self.env['cwd'])
+        self._make_directory(self.env['swd'] if not rdiff else self.env['bwd'])
+        self._command_direct(self.command_backup, self.env['cwd'], maintenance=True)
+        self._invalidate_listings('swd' if not rdiff else 'bwd')
 
-        while last_mirror == self.list_increments().current_mirror:
+        while rdiff and last_mirror == self.list_increments().current_mirror:
             sleep(1)
 
     @server_exists(True)
@@ -393,35 +622,87 @@ class mc(object):
 
     @server_exists(True)
     def archive(self):
-        """Creates a timestamped, gzipped tarball of the server contents."""
+        """Creates a timestamped, gzipped tarball of the server contents.
+        The IO slot is taken before save-off, so saving stays on while
+        waiting for one."""
         self._make_directory(self.env['awd'])
-        if self.up:
-            self._command_stuff('save-off')
-            try:
-                self._command_direct(self.command_archive, self.env['cwd'])
-            finally:
-                self._command_stuff('save-on')
-        else:
-            self._command_direct(self.command_archive, self.env['cwd'])
+        with self.IO_SLOTS:
+            if self.up:
+                self._command_stuff('save-off')
+                try:
+                    self._save_confirmed()
+                    self._run_archive()
+                finally:
+                    self._command_stuff('save-on')
+            else:
+                self._run_archive()
+        self._invalidate_listings('awd')
+
+    def _run_archive(self):
+        """Runs command_archive as the server's owner; deduplicated
+        archives run as the owner of the shared store, the only user who
+        may add chunks to it, and their manifest is then given to the
+        server's owner."""
+        if self.archive_codec != 'dedup':
+            self._command_direct(self.command_archive, self.env['cwd'], maintenance=True)
+            return
+
+        self._command_direct(self.command_archive, self.env['cwd'], maintenance=True,
+                             user=self._store_owner)
+        try:
+            os.chown(self._previous_arguments['archive_filename'], self.owner.pw_uid, self.owner.pw_gid)
+        except OSError:
+            pass
+
+    @property
+    def _store_owner(self):
+        """Returns the pwd entry of the owner of the shared archive store,
+        creating the store as this process's user if it is missing"""
+        from nss_cache import getpwuid
+        from dedup_store import store_directory
+
+        store_directory(self.env['store'])
+        return getpwuid(os.stat(self.env['store']).st_uid)
 
     @server_exists(True)
     def backup(self):
-        """Creates an rdiff-backup of a server."""
-        self._make_directory(self.env['bwd'])
-        if self.up:
-            self._command_stuff('save-off')
-            self._command_stuff('save-all')
-            self._command_direct(self.command_backup, self.env['cwd'])
-            self._command_stuff('save-on')
-        else:
-            self._command_direct(self.command_backup, self.env['cwd'])
+        """Creates an rdiff-backup of a server, or a region-aware snapshot
+        if crontabs:backup_engine is 'region'."""
+        self._make_directory(self.env['bwd'] if self.backup_engine == 'rdiff' else self.env['swd'])
+        with self.IO_SLOTS:
+            if self.up:
+                self._command_stuff('save-off')
+                try:
+                    self._save_confirmed()
+                    self._command_direct(self.command_backup, self.env['cwd'], maintenance=True)
+                finally:
+                    self._command_stuff('save-on')
+            else:
+                self._command_direct(self.command_backup, self.env['cwd'], maintenance=True)
+        self._invalidate_listings('bwd' if self.backup_engine == 'rdiff' else 'swd')
 
     @server_exists(True)
     @server_up(False)
     def restore(self, step='now', force=False):
-        """Overwrites the /servers/ version of a server with the /backup/."""
+        """Overwrites the /servers/ version of a server with the /backup/.
+        With the region engine, step names a snapshot, or is 'now' or
+        '[n]B' (n snapshots before the latest) as listed by
+        list_increment_sizes."""
         from subprocess import CalledProcessError
-        
+
+        if self._restores_from_snapshots:
+            self._make_directory(self.env['cwd'])
+            try:
+                self._command_direct(self.command_restore_snapshot(self._snapshot_of(step)),
+                                     self.env['cwd'], maintenance=True)
+            except CalledProcessError as e:
+                raise RuntimeError(e.output)
+            finally:
+                self._invalidate_listings('cwd')
+
+            self._load_config(generate_missing=True)
+            return
+
         self._load_config(load_backup=True)
 
         if self.server_properties or self.server_config:
@@ -429,9 +710,11 @@ class mc(object):
 
             self._make_directory(self.env['cwd'])
             try:
-                self._command_direct(self.command_restore(step,force), self.env['cwd'])
+                self._command_direct(self.command_restore(step,force), self.env['cwd'], maintenance=True)
             except CalledProcessError as e:
                 raise RuntimeError(e.output)
+            finally:
+                self._invalidate_listings('cwd')
 
             self._load_config(generate_missing=True)
         else:
@@ -440,14 +723,27 @@ class mc(object):
     @server_exists(False)
     def import_server(self, path, filename):
         """ Extracts an existing archive into the live space.
+        Tarballs compressed with zstd or lz4, which tarfile cannot read,
+        are listed and extracted by tar through the compressor.
         Might need additional review if run as root by server.py
         """
         import tarfile, zipfile
         from shutil import rmtree
+        from subprocess import check_call, check_output
         
         filepath = os.path.join(path, filename)
-
-        if tarfile.is_tarfile(filepath):
+        codec = self._archive_codec_of(filename)
+
+        if codec in ('zstd', 'lz4'):
+            compressor = find_executable(self.ARCHIVE_CODECS[codec].program)
+            if not compressor:
+                raise NotImplementedError('Ignoring command {import_server};'
+                                          '%s is not installed' % self.ARCHIVE_CODECS[codec].program)
+            archive_ = None
+            tar = [self.BINARY_PATHS['tar'], '-I', compressor]
+            members_ = check_output(tar + ['-tf', filepath]).splitlines()
+            prefix_ = os.path.commonprefix(members_)
+        elif tarfile.is_tarfile(filepath):
             archive_ = tarfile.open(filepath, mode='r')
             members_ = archive_.getnames()
             prefix_ = os.path.commonprefix(members_)
@@ -463,8 +759,13 @@ class mc(object):
             raise RuntimeError('Ignoring command {import_server};'
                                'archive contains files with absolute path or ../')
         
-        archive_.extractall(self.env['cwd'])
-        archive_.close()
+        if archive_ is None:
+            if not os.path.isdir(self.env['cwd']):
+                os.makedirs(self.env['cwd'])
+            check_call(tar + ['-xf', filepath, '-C', self.env['cwd']])
+        else:
+            archive_.extractall(self.env['cwd'])
+            archive_.close()
 
         if not os.path.samefile(self.env['cwd'], os.path.join(self.env['cwd'], prefix_)):     
             prefixed_dir = os.path.join(self.env['cwd'], prefix_)
@@ -481,21 +782,99 @@ class mc(object):
         except RuntimeError:
             rmtree(self.env['cwd'])
             raise
+        finally:
+            self._invalidate_listings('cwd')
 
     @server_exists(True)
     def prune(self, step):
-        """Removes old rdiff-backup data/metadata."""
-        self._command_direct(self.command_prune(step), self.env['bwd'])
+        """Removes old rdiff-backup data/metadata.  With the region engine,
+        removes the snapshots older than step ('[n]B'), keeping n+1."""
+        if self._restores_from_snapshots:
+            self._command_direct(self.command_prune_snapshots(step), self.env['swd'], maintenance=True)
+            self._invalidate_listings('swd')
+            return
+
+        self._command_direct(self.command_prune(step), self.env['bwd'], maintenance=True)
+        self._invalidate_listings('bwd')
+
+    @staticmethod
+    def _snapshot_steps(step):
+        """Returns n of a '[n]B' step (or int), else None"""
+        import re
+
+        if type(step) is int:
+            return step
+        match = re.match(r'^(\d+)B$', str(step))
+        return int(match.group(1)) if match else None
+
+    def _snapshot_of(self, step):
+        """Returns the region_backup snapshot a restore step names"""
+        from region_backup import snapshots
+
+        steps = self._snapshot_steps(step)
+        if steps is None:
+            return step
+
+        available = snapshots(self.env['swd'])
+        if steps >= len(available):
+            raise RuntimeError('Ignoring command {restore}; no snapshot %s' % step)
+        return available[-1 - steps]
 
     def prune_archives(self, filename):
-        """Removes old archives by filename as a space-separated string."""
-        self._command_direct(self.command_delete_files(filename), self.env['awd'])
+        """Removes old archives by filename as a space-separated string.
+        Removing a deduplicated archive also collects chunks no
+        remaining manifest of any server refers to."""
+        self._command_direct(self.command_delete_files(filename), self.env['awd'], maintenance=True)
+        self._invalidate_listings('awd')
+        if any(self._archive_codec_of(f) == 'dedup' for f in filename.split()):
+            self._collect_chunks(self.base)
+
+    @classmethod
+    def _collect_chunks(cls, base_directory):
+        """Removes chunks of the shared archive store that no manifest
+        refers to; returns counts of chunks kept, removed and bytes freed"""
+        from dedup_store import collect
+
+        manifests = os.path.join(base_directory, cls.DEFAULT_PATHS['archive'], '*',
+                                 '*' + cls.ARCHIVE_CODECS['dedup'].extension)
+        return collect(os.path.join(base_directory, cls.DEFAULT_PATHS['store']), [manifests])
+
+    @server_up(False)
+    def restore_archive(self, filename):
+        """Extracts an archive of this server (of any codec) over the
+        /servers/ version of the server."""
+        from subprocess import CalledProcessError
+
+        if os.path.basename(filename) not in self._list_files(self.env['awd']):
+            raise RuntimeError('Ignoring command {restore_archive}; Unable to locate %s' % filename)
+
+        self._make_directory(self.env['cwd'])
+        try:
+            self._command_direct(self.command_restore_archive(filename), self.env['cwd'], maintenance=True)
+        except CalledProcessError as e:
+            raise RuntimeError(e.output)
+        finally:
+            self._invalidate_listings('cwd')
+
+        self._load_config(generate_missing=True)
 
     @server_exists(True)
     @server_up(False)
     def delete_server(self):
         """Deletes server files from system"""
-        self._command_direct(self.command_delete_server, self.env['pwd'])
+        self._command_direct(self.command_delete_server, self.env['pwd'], maintenance=True)
+        self._invalidate_listings('cwd', 'bwd', 'awd', 'swd')
+
+    def _invalidate_listings(self, *keys):
+        """Drops cached listings and server_registry entries of the env
+        paths this process just changed, rather than waiting for the
+        fs_watcher to notice"""
+        from fs_watcher import invalidate
+
+        registry = self._server_registry(self.base)
+        for key in keys:
+            invalidate(self.env[key])
+            registry.invalidate(self.env[key])
 
     @server_exists(True)
     def accept_eula(self):
@@ -684,17 +1063,77 @@ class mc(object):
             os.setuid(user_uid)
         return set_ids
 
-    def _command_direct(self, command, working_directory):
+    def _command_direct(self, command, working_directory, maintenance=False, user=None):
         """Opens a subprocess and executes a command as the user
-        specified in self._owner.
+        specified in self._owner, or as user (a pwd entry) if given.
+
+        Maintenance commands (backups, archives, restores...) run under
+        ionice and wait for one of IO_SLOTS, so only a few disk-heavy
+        jobs compete with live servers at once.
         """
         from subprocess import check_output, STDOUT
         from shlex import split
 
+        user = user or self.owner
+        if maintenance:
+            return self._command_maintenance(split(command), working_directory, user)
+
         return check_output(split(command),
                             cwd=working_directory,
                             stderr=STDOUT,
-                            preexec_fn=self._demote(self.owner.pw_uid, self.owner.pw_gid))
+                            preexec_fn=self._demote(user.pw_uid, user.pw_gid))
+
+    @property
+    def ionice_arguments(self):
+        """Returns the ionice prefix for maintenance commands, if any"""
+        if not self.BINARY_PATHS['ionice'] or self.IONICE_CLASS is None:
+            return []
+        elif self.IONICE_CLASS in (1, 2):
+            return [self.BINARY_PATHS['ionice'], '-c', str(self.IONICE_CLASS),
+                    '-n', str(self.IONICE_LEVEL)]
+        return [self.BINARY_PATHS['ionice'], '-c', str(self.IONICE_CLASS)]
+
+    def _command_maintenance(self, args, working_directory, user):
+        """Runs a maintenance command as user (a pwd entry) like
+        check_output, then adds the bytes it read and wrote to the
+        scheduler job running it.  /proc/<pid>/io is read once the
+        process has exited but before it is reaped, when the counters
+        are final."""
+        from subprocess import Popen, CalledProcessError, STDOUT
+        from tempfile import TemporaryFile
+        from time import sleep
+        from procfs_reader import pid_fields
+        from scheduler import record_io
+
+        counters = {}
+        with self.IO_SLOTS, TemporaryFile() as output:
+            proc = Popen(self.ionice_arguments + args,
+                         cwd=working_directory,
+                         stdout=output,
+                         stderr=STDOUT,
+                         preexec_fn=self._demote(user.pw_uid, user.pw_gid))
+
+            interval = 0.01
+            while True:
+                try:
+                    fields = pid_fields(proc.pid, stat=('state',), io=('read_bytes', 'write_bytes'))
+                except (IOError, IndexError, ValueError):
+                    break
+                state = fields.pop('state')
+                counters = fields or counters
+                if state == 'Z':
+                    break
+                sleep(interval)
+                interval = min(interval * 2, 0.5)
+
+            retcode = proc.wait()
+            output.seek(0)
+            stdout = output.read()
+
+        record_io(counters.get('read_bytes', 0), counters.get('write_bytes', 0))
+        if retcode:
+            raise CalledProcessError(retcode, args, stdout)
+        return stdout
 
     @server_exists(True)
     @server_up(True)
@@ -711,6 +1150,62 @@ class mc(object):
         check_call(split(command),
                    preexec_fn=self._demote(self.owner.pw_uid, self.owner.pw_gid))
 
+    def _stuff_and_wait(self, stuff_text, patterns, timeout=None):
+        """Stuffs text to the console and waits up to timeout seconds
+        (default SAVE_TIMEOUT) for a log line containing any of patterns.
+        Returns the seconds taken, or None if it could not be confirmed.
+        """
+        from log_watcher import log_watcher
+        from time import time
+
+        try:
+            watcher = log_watcher(self.env['log'])
+        except KeyError:
+            watcher = None
+
+        start = time()
+        try:
+            self._command_stuff(stuff_text)
+            if watcher is None or \
+               watcher.wait_for(patterns, self.SAVE_TIMEOUT if timeout is None else timeout) is None:
+                return None
+            return time() - start
+        finally:
+            if watcher is not None:
+                watcher.close()
+
+    def _save_confirmed(self, timeout=None):
+        """Issues save-all and returns once the log reports the world
+        saved (or timeout elapses); confirmed durations are kept in
+        SAVE_DURATIONS.  Returns the seconds taken, or None."""
+        from log_watcher import SAVED
+        from metrics import ring_buffer
+
+        duration = self._stuff_and_wait('save-all', SAVED, timeout)
+        if duration is not None:
+            self.SAVE_DURATIONS.setdefault(self.env['cwd'], ring_buffer(50)).append(duration)
+        return duration
+
+    def _wait_until_down(self, timeout=None):
+        """Returns True once the server has no running process, or
+        False if it is still up after timeout seconds"""
+        from time import sleep, time
+
+        deadline = time() + (self.SAVE_TIMEOUT if timeout is None else timeout)
+        while self.up:
+            if time() >= deadline:
+                return False
+            sleep(0.2)
+        return True
+
+    @property
+    def save_durations(self):
+        """Returns the seconds recent confirmed world saves took, oldest first"""
+        try:
+            return self.SAVE_DURATIONS[self.env['cwd']].values()
+        except KeyError:
+            return []
+
 #validation checks
 
     @staticmethod
@@ -758,31 +1253,84 @@ class mc(object):
     @property
     def owner(self):
         """Returns pwd named tuple"""
-        from pwd import getpwnam
+        from nss_cache import getpwnam
         return getpwnam(self._owner)
 
     @property
     def up(self):
         """Returns True if the server has a running process."""
-        return any(s.server_name == self.server_name for s in self.list_servers_up())
+        return self._runtime_pids()[0] is not None
 
     @property
     def java_pid(self):
         """Returns the process id of the server's java instance."""
-        for server, java_pid, screen_pid, base_dir in self.list_servers_up():
-            if self.server_name == server:
-                return java_pid
-        else:
-            return None
+        return self._runtime_pids()[1]
 
     @property
     def screen_pid(self):
         """Returns the process id of the server's screen instance."""
-        for server, java_pid, screen_pid, base_dir in self.list_servers_up():
-            if self.server_name == server:
-                return screen_pid
-        else:
-            return None
+        return self._runtime_pids()[0]
+
+    def _runtime_pids(self):
+        """Returns (screen_pid, java_pid) as recorded in the runtime file,
+        provided both processes are alive and have the recorded start times.
+        Missing or stale state falls back to a process table scan; a stale
+        file is rewritten from the scan, or removed if the server is down,
+        so that later checks do not read it again.
+        """
+        from procfs_reader import pid_alive
+
+        try:
+            with open(self.env['runtime'], 'rb') as runtime:
+                state = dict(line.strip().split('=', 1) for line in runtime if '=' in line)
+        except IOError:
+            screen_pid, java_pid, base_dir = \
+                self._servers_up_index().get('mc-%s' % self.server_name, (None, None, None))
+            return (screen_pid, java_pid)
+
+        try:
+            screen_pid = int(state['screen_pid'])
+            java_pid = int(state['java_pid'])
+
+            if pid_alive(screen_pid, int(state['screen_start'])) and \
+               pid_alive(java_pid, int(state['java_start'])):
+                return (screen_pid, java_pid)
+        except (KeyError, ValueError):
+            pass
+
+        return self._record_runtime()
+
+    def _record_runtime(self):
+        """Finds the server in the process table and rewrites (or removes)
+        its runtime file, kept under the base's run/ directory rather than
+        the server's, so that backups and archives never capture it.
+        Returns (screen_pid, java_pid)."""
+        from procfs_reader import pid_starttime
+
+        screen_pid, java_pid, base_dir = \
+            self._servers_up_index().get('mc-%s' % self.server_name, (None, None, None))
+
+        try:
+            if screen_pid and java_pid:
+                if not os.path.isdir(os.path.dirname(self.env['runtime'])):
+                    os.makedirs(os.path.dirname(self.env['runtime']))
+                lines = ['screen_pid=%s' % screen_pid,
+                         'screen_start=%s' % pid_starttime(screen_pid),
+                         'java_pid=%s' % java_pid,
+                         'java_start=%s' % pid_starttime(java_pid)]
+                with open(self.env['runtime'], 'wb') as runtime:
+                    runtime.write('\n'.join(lines) + '\n')
+                try:
+                    os.chown(self.env['runtime'], self.owner.pw_uid, self.owner.pw_gid)
+                except (OSError, KeyError, TypeError):
+                    pass
+            else:
+                os.remove(self.env['runtime'])
+        except (IOError, OSError):
+            #state file is only an optimization; missing permissions or dirs are fine
+            pass
+
+        return (screen_pid, java_pid)
 
     @property
     def profile(self):
@@ -811,7 +1359,8 @@ class mc(object):
                 finally:
                     sc['minecraft':'profile'] = str(profile).strip()
 
-            self._command_direct(self.command_apply_profile(profile), self.env['cwd'])
+            self._command_direct(self.command_apply_profile(profile), self.env['cwd'], maintenance=True)
+            self.PING_PROTOCOLS.pop(self.env['cwd'], None)
 
     @property
     def profile_current(self):
@@ -868,6 +1417,11 @@ class mc(object):
     @property
     def memory(self):
         """Returns the amount of memory the java instance is using (VmRSS)"""
+        return self._pid_memory(self.java_pid)
+
+    @staticmethod
+    def _pid_memory(pid):
+        """Returns the amount of memory a process is using (VmRSS)"""
         def bytesto(num, to, bsize=1024):
             """convert bytes to megabytes, etc.
                sample code:
@@ -884,10 +1438,10 @@ class mc(object):
 
             return r
 
-        from procfs_reader import entries
+        from procfs_reader import pid_fields
 
         try:
-            mem_str = dict(entries(self.java_pid, 'status'))['VmRSS']
+            mem_str = pid_fields(pid, status=('VmRSS',))['VmRSS']
             mem = int(mem_str.split()[0]) * 1024
             return '%s MB' % bytesto(mem, 'm')
         except IOError:
@@ -897,67 +1451,287 @@ class mc(object):
     def ping(self):
         """Returns a named tuple using the current Minecraft protocol
         to retreive versions, player counts, etc"""
-        import socket
-
-        def server_list_packet():
-            """Guesses what version minecraft a live server directory is."""
-            if self.server_milestone_short in ['1.5', '1.6'] or \
-               (self.server_type == 'forgemod' and self.server_milestone == 'unknown'):
-                return '\xfe' \
-                       '\x01' \
-                       '\xfa' \
-                       '\x00\x06' \
-                       '\x00\x6d\x00\x69\x00\x6e\x00\x65\x00\x6f\x00\x73' \
-                       '\x00\x19' \
-                       '\x49' \
-                       '\x00\x09' \
-                       '\x00\x6c\x00\x6f\x00\x63\x00\x61\x00\x6c\x00\x68' \
-                       '\x00\x6f\x00\x73\x00\x74' \
-                       '\x00\x00\x63\xdd'
-            else:
-                return '\xfe\x01'
+        try:
+            return self.ping_many([self])[self.server_name]
+        except KeyError:
+            raise RuntimeWarning('Server not found "%s"' % self.server_name)
+
+    @property
+    def server_list_packet(self):
+        """Guesses what version minecraft a live server directory is."""
+        if self.server_milestone_short in ['1.5', '1.6'] or \
+           (self.server_type == 'forgemod' and self.server_milestone == 'unknown'):
+            return '\xfe' \
+                   '\x01' \
+                   '\xfa' \
+                   '\x00\x06' \
+                   '\x00\x6d\x00\x69\x00\x6e\x00\x65\x00\x6f\x00\x73' \
+                   '\x00\x19' \
+                   '\x49' \
+                   '\x00\x09' \
+                   '\x00\x6c\x00\x6f\x00\x63\x00\x61\x00\x6c\x00\x68' \
+                   '\x00\x6f\x00\x73\x00\x74' \
+                   '\x00\x00\x63\xdd'
+        else:
+            return '\xfe\x01'
+
+    @classmethod
+    def ping_many(cls, instances, timeout=2.5):
+        """Pings every instance concurrently and returns
+        {server_name: ping namedtuple}, all within a single timeout.
+        instances may be mc instances or server_summary records.
+        Servers that do not exist (or lack server.properties values
+        needed for a reply) are omitted.
+
+        Live servers are pinged with the 1.7+ protocol, given the whole
+        timeout, and fall back to the legacy ping as soon as it fails;
+        whichever protocol answered is remembered per server in
+        PING_PROTOCOLS.  A remembered legacy answer expires after
+        PING_LEGACY_TTL seconds and is forgotten when the server is
+        started or its profile changes.
+        """
+        from ping_engine import legacy_exchange, modern_exchange, run, chat_text
+        from time import time
 
         server_ping = namedtuple('ping', ['protocol_version',
                                           'server_version',
                                           'motd',
                                           'players_online',
-                                          'max_players'])
-
-        error_ping = server_ping(None,None,self.server_properties['motd'::''],
-                                 '-1',self.server_properties['max-players'])
+                                          'max_players',
+                                          'latency'])
 
-        if self.server_type == 'bungee':
-            return server_ping(None,None,'','0',1)
-        elif self.up:
-            try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.settimeout(2.5)
-                s.connect((self.ip_address, self.port))
-                s.send(server_list_packet())
-
-                d = s.recv(1024)
-                s.shutdown(socket.SHUT_RDWR)
-            except (socket.error, socket.timeout):
-                return error_ping
-            finally:
-                s.close()
-
-            if d[0] == '\xff':
+        def parse_legacy(instance, ex, error_ping):
+            d = ex.response
+            if d and d[0] == '\xff':
                 d = d[3:].decode('utf-16be')
                 if d[:3] == u'\xa7\x31\x00': #modern protocol [u'127', u'1.7.4', u'A Minecraft Server', u'0', u'20']
                     segments = d[3:].split('\x00')
-                    return server_ping(*segments)
+                    return server_ping(*segments, latency=ex.latency)
                 else: #1.2-era protocol [u'A Minecraft Server', u'0', u'20']
                     segments = d.split(u'\xa7')
-                    return server_ping(None,self.server_milestone_long,*segments)
-                    
+                    return server_ping(None,instance.server_milestone_long,*segments,latency=ex.latency)
+
             return error_ping
+
+        def parse_modern(ex):
+            version = ex.status.get('version', {})
+            players = ex.status.get('players', {})
+            return server_ping(unicode(version['protocol']),
+                               unicode(version['name']),
+                               chat_text(ex.status.get('description', u'')),
+                               unicode(players['online']),
+                               unicode(players['max']),
+                               ex.latency)
+
+        deadline = time() + timeout
+        results = {}
+        pending = []
+        for instance in (cls._summary_of(i) for i in instances):
+            if instance.server_type == 'bungee':
+                results[instance.server_name] = server_ping(None,None,'','0',1,None)
+            elif instance.max_players is None:
+                continue
+            elif instance.up:
+                error_ping = server_ping(None,None,instance.motd,'-1',instance.max_players,None)
+                pending.append((instance, error_ping))
+            elif instance.server_name in cls._server_registry(instance.base):
+                results[instance.server_name] = server_ping(None,None,instance.motd,
+                                                            '0',instance.max_players,None)
+
+        protocols = dict((instance.cwd, cls._ping_protocol(instance.cwd))
+                         for instance, error_ping in pending)
+
+        exchanges = []
+        for instance, error_ping in pending:
+            legacy = legacy_exchange(instance.ip_address, instance.port, instance.server_list_packet)
+            if protocols[instance.cwd] == 'legacy':
+                exchanges.append((instance, error_ping, None, legacy))
+                continue
+
+            modern = modern_exchange(instance.ip_address, instance.port)
+            if protocols[instance.cwd] is None:
+                #a server not yet known to be 1.7+ might still be pre-1.7
+                modern.fallback = legacy
+            exchanges.append((instance, error_ping, modern, legacy))
+
+        run([modern or legacy for i, e, modern, legacy in exchanges], deadline - time())
+
+        for instance, error_ping, modern, legacy in exchanges:
+            if modern and modern.complete:
+                try:
+                    results[instance.server_name] = parse_modern(modern)
+                    cls.PING_PROTOCOLS[instance.cwd] = ('modern', time())
+                    continue
+                except (AttributeError, KeyError, TypeError):
+                    pass
+
+            try:
+                ping = parse_legacy(instance, legacy, error_ping)
+            except (TypeError, UnicodeDecodeError):
+                ping = error_ping
+
+            if ping is not error_ping:
+                cls.PING_PROTOCOLS[instance.cwd] = ('legacy', time())
+            elif protocols[instance.cwd] == 'legacy':
+                #no answer any more; the next ping starts over with 1.7+
+                cls.PING_PROTOCOLS.pop(instance.cwd, None)
+            results[instance.server_name] = ping
+
+        return results
+
+    @classmethod
+    def _ping_protocol(cls, cwd):
+        """Returns the protocol the server at cwd last answered, 'modern'
+        or 'legacy', or None if unknown or the legacy answer expired"""
+        from time import time
+
+        try:
+            protocol, recorded = cls.PING_PROTOCOLS[cwd]
+        except KeyError:
+            return None
+
+        if protocol == 'legacy' and time() - recorded > cls.PING_LEGACY_TTL:
+            return None
+        return protocol
+
+    @property
+    def query_port(self):
+        """Returns the UDP port of the query protocol if enable-query
+        is set in server.properties, otherwise None"""
+        if str(self.server_properties['enable-query'::'false']).lower() != 'true':
+            return None
+        try:
+            return int(self.server_properties['query.port'::self.port])
+        except ValueError:
+            return self.port
+
+    @property
+    def query(self):
+        """Returns the full query (server info and player names) of a
+        live, query-enabled server, or None"""
+        return self.query_many([self]).get(self.server_name)
+
+    @classmethod
+    def query_many(cls, instances, timeout=1.5):
+        """Queries every live, query-enabled instance through a single
+        UDP socket and returns {server_name: {'info': {...}, 'players': [...]}}
+        for those that answered within timeout."""
+        targets = {}
+        for instance in (cls._summary_of(i) for i in instances):
+            if instance.server_type != 'bungee' and instance.query_port and instance.up:
+                targets[instance.server_name] = (instance.ip_address, instance.query_port)
+
+        if not targets:
+            return {}
+        return cls.QUERY_CLIENT.query(targets, timeout)
+
+    @property
+    def summary(self):
+        """Returns a server_summary of the server as currently on disk"""
+        return self._read_summary(self.server_name, self.base, self._owner, self._runtime_pids())
+
+    @classmethod
+    def _summary_of(cls, instance):
+        return instance.summary if isinstance(instance, cls) else instance
+
+    @staticmethod
+    def _read_options(path, options):
+        """Returns {(section, option): value} of those of options set in
+        the config_file at path; section is None for sectionless files.
+        A value that does not interpolate (a lone '%' in a motd) is
+        returned raw; options that cannot be read are left out."""
+        from ConfigParser import Error, InterpolationError
+
+        try:
+            conf = config_file(path)
+        except Error:
+            return {}
+
+        found = {}
+        for section, option in options:
+            try:
+                found[(section, option)] = conf.get(section or 'sectionless', option)
+            except InterpolationError:
+                found[(section, option)] = conf.get(section or 'sectionless', option, raw=True)
+            except Error:
+                continue
+        return found
+
+    @classmethod
+    def _read_summary(cls, server_name, base_directory, owner, pids):
+        """Builds a server_summary from the needed options of
+        server.properties, server.config and eula.txt"""
+        cwd = os.path.join(base_directory, cls.DEFAULT_PATHS['servers'], server_name)
+        sp = cls._read_options(os.path.join(cwd, 'server.properties'),
+                               [(None, 'server-port'), (None, 'server-ip'), (None, 'motd'),
+                                (None, 'max-players'), (None, 'enable-query'), (None, 'query.port')])
+        sc = cls._read_options(os.path.join(cwd, 'server.config'),
+                               [('minecraft', 'profile'), ('java', 'java_xmx')])
+        eula = cls._read_options(os.path.join(cwd, 'eula.txt'), [(None, 'eula')])
+
+        try:
+            port = int(sp[(None, 'server-port')])
+        except (KeyError, TypeError, ValueError):
+            port = 25565
+
+        if str(sp.get((None, 'enable-query'), 'false')).lower() != 'true':
+            query_port = None
         else:
-            if self.server_name in self.list_servers(self.base):
-                return server_ping(None,None,self.server_properties['motd'::''],
-                                   '0',self.server_properties['max-players'])
-            else:
-                raise RuntimeWarning('Server not found "%s"' % self.server_name)
+            try:
+                query_port = int(sp.get((None, 'query.port'), port))
+            except (TypeError, ValueError):
+                query_port = port
+
+        try:
+            java_xmx = int(sc[('java', 'java_xmx')])
+        except (KeyError, TypeError, ValueError):
+            java_xmx = 0
+
+        server_type = cls._find_log(cwd)[0]
+
+        return server_summary(server_name=server_name,
+                              base=base_directory,
+                              owner=owner,
+                              cwd=cwd,
+                              profile=sc.get(('minecraft', 'profile')) or None,
+                              up=pids[0] is not None,
+                              screen_pid=pids[0],
+                              java_pid=pids[1],
+                              server_type=server_type,
+                              ip_address=sp.get((None, 'server-ip')) or '0.0.0.0',
+                              port=port,
+                              query_port=query_port,
+                              motd=sp.get((None, 'motd'), ''),
+                              max_players=sp.get((None, 'max-players')),
+                              java_xmx=java_xmx,
+                              eula=eula.get((None, 'eula')))
+
+    @classmethod
+    def _server_summaries(cls, base_directory, server_names=None):
+        """Returns {server_name: server_summary} of every server in
+        base_directory, or only of server_names, without constructing
+        mc instances.  Running state comes from one process snapshot and
+        owners from the server_registry; names that are invalid or do
+        not exist are omitted.
+        """
+        owners = cls._server_registry(base_directory).owners()
+        index = cls._servers_up_index()
+
+        summaries = {}
+        for name in (owners.keys() if server_names is None else server_names):
+            try:
+                cls.valid_server_name(name)
+            except ValueError:
+                continue
+
+            ownership = owners.get(name)
+            if not ownership:
+                continue
+
+            screen_pid, java_pid, base_dir = index.get('mc-%s' % name, (None, None, None))
+            summaries[name] = cls._read_summary(name, base_directory, ownership[0].owner,
+                                                (screen_pid, java_pid))
+        return summaries
 
     @property
     def sp(self):
@@ -972,6 +1746,7 @@ class mc(object):
     @property
     def server_type(self):
         """Returns best guess of server type"""
+        self._locate_log()
         return self._server_type
 
     @property
@@ -1094,6 +1869,20 @@ class mc(object):
         match = re.match(r'^.+ mc-.+? (.+)', command)
         return match.group(1)
 
+    @property
+    def archive_codec(self):
+        """Returns the compression codec of this server's archives, one
+        of ARCHIVE_CODECS, from crontabs:archive_codec in server.config"""
+        try:
+            codec = self.server_config['crontabs':'archive_codec':'gzip'] or 'gzip'
+        except KeyError:
+            codec = 'gzip'
+
+        if codec not in self.ARCHIVE_CODECS:
+            raise RuntimeError('Unknown archive codec %s; expected one of %s' % (codec,
+                               ', '.join(sorted(self.ARCHIVE_CODECS))))
+        return codec
+
     @property
     @sanitize
     def command_archive(self):
@@ -1102,24 +1891,118 @@ class mc(object):
         """
         from time import strftime
 
+        name = self.archive_codec
+        codec = self.ARCHIVE_CODECS[name]
+        compressor = find_executable(codec.program) if codec.program else None
+
         required_arguments = {
             'nice': self.BINARY_PATHS['nice'],
             'tar': self.BINARY_PATHS['tar'],
             'nice_value': self.NICE_VALUE,
             'archive_filename': os.path.join(self.env['awd'],
-                                             'server-%s_%s.tar.gz' % (self.server_name,
-                                                                      strftime("%Y-%m-%d_%H:%M:%S"))),
+                                             'server-%s_%s%s' % (self.server_name,
+                                                                 strftime("%Y-%m-%d_%H:%M:%S"),
+                                                                 codec.extension)),
             'cwd': '.'
             }
 
+        if name == 'gzip' or (name == 'pigz' and not compressor):
+            self._previous_arguments = required_arguments
+            return '%(nice)s -n %(nice_value)s ' \
+                   '%(tar)s czf %(archive_filename)s %(cwd)s' % required_arguments
+        elif name == 'none':
+            self._previous_arguments = required_arguments
+            return '%(nice)s -n %(nice_value)s ' \
+                   '%(tar)s cf %(archive_filename)s %(cwd)s' % required_arguments
+        elif name == 'dedup':
+            required_arguments.update(self._dedup_arguments)
+            self._previous_arguments = required_arguments
+            return '%(nice)s -n %(nice_value)s ' \
+                   '%(python)s %(dedup)s archive %(store)s %(archive_filename)s %(cwd)s' % required_arguments
+
+        from multiprocessing import cpu_count
+
+        threads = self.ARCHIVE_THREADS or (cpu_count() if codec.program == 'pigz' else 0)
+        required_arguments['compressor'] = compressor
+        required_arguments['options'] = codec.options % {'threads': threads}
+
         self._previous_arguments = required_arguments
         return '%(nice)s -n %(nice_value)s ' \
-               '%(tar)s czf %(archive_filename)s %(cwd)s' % required_arguments
+               '%(tar)s cf %(archive_filename)s -I "%(compressor)s %(options)s" %(cwd)s' % required_arguments
+
+    @property
+    def _dedup_arguments(self):
+        import sys
+        return {
+            'python': sys.executable,
+            'dedup': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dedup_store.py'),
+            'store': self.env['store'],
+            }
+
+    @sanitize
+    def command_restore_archive(self, filename):
+        """Returns the command to extract an archive of any codec into
+        the /servers/[servername] directory."""
+        required_arguments = {
+            'tar': self.BINARY_PATHS['tar'],
+            'archive_filename': os.path.join(self.env['awd'], os.path.basename(filename)),
+            'cwd': self.env['cwd']
+            }
+
+        codec = self._archive_codec_of(filename)
+        if codec == 'dedup':
+            required_arguments.update(self._dedup_arguments)
+            self._previous_arguments = required_arguments
+            return '%(python)s %(dedup)s restore %(store)s %(archive_filename)s %(cwd)s' % required_arguments
+        elif codec in ('zstd', 'lz4'):
+            #tar does not recognize every compressor by itself
+            required_arguments['compressor'] = find_executable(self.ARCHIVE_CODECS[codec].program)
+            self._previous_arguments = required_arguments
+            return '%(tar)s xf %(archive_filename)s -I %(compressor)s -C %(cwd)s' % required_arguments
+
+        self._previous_arguments = required_arguments
+        return '%(tar)s xf %(archive_filename)s -C %(cwd)s' % required_arguments
+
+    @property
+    def backup_engine(self):
+        """Returns the engine of this server's backups, one of
+        BACKUP_ENGINES, from crontabs:backup_engine in server.config"""
+        try:
+            engine = self.server_config['crontabs':'backup_engine':'rdiff'] or 'rdiff'
+        except KeyError:
+            engine = 'rdiff'
+
+        if engine not in self.BACKUP_ENGINES:
+            raise RuntimeError('Unknown backup engine %s; expected one of %s' % (engine,
+                               ', '.join(self.BACKUP_ENGINES)))
+        return engine
+
+    @property
+    def _restores_from_snapshots(self):
+        """Whether restore() uses region_backup snapshots: if so configured,
+        or, when server.config is gone with the live server, if there are
+        snapshots but no rdiff-backup mirror"""
+        from region_backup import snapshots
+
+        if os.path.isfile(self.env['sc']):
+            return self.backup_engine == 'region'
+        return not os.path.isdir(os.path.join(self.env['bwd'], 'rdiff-backup-data')) and \
+               bool(snapshots(self.env['swd']))
+
+    @property
+    def _region_arguments(self):
+        import sys
+        return {
+            'python': sys.executable,
+            'region': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'region_backup.py'),
+            'swd': self.env['swd'],
+            }
 
     @property
     @sanitize
     def command_backup(self):
-        """Returns the actual command used to rdiff-backup a minecraft server."""
+        """Returns the actual command used to rdiff-backup a minecraft server,
+        or to snapshot it with region_backup."""
         required_arguments = {
             'nice': self.BINARY_PATHS['nice'],
             'nice_value': self.NICE_VALUE,
@@ -1128,10 +2011,45 @@ class mc(object):
             'bwd': self.env['bwd']
             }
 
+        if self.backup_engine == 'region':
+            del required_arguments['rdiff']
+            required_arguments.update(self._region_arguments)
+            self._previous_arguments = required_arguments
+            return '%(nice)s -n %(nice_value)s ' \
+                   '%(python)s %(region)s backup %(swd)s %(cwd)s' % required_arguments
+
         self._previous_arguments = required_arguments
         return '%(nice)s -n %(nice_value)s ' \
                '%(rdiff)s %(cwd)s/ %(bwd)s' % required_arguments
 
+    @sanitize
+    def command_restore_snapshot(self, snapshot):
+        """Returns the command to rebuild a region_backup snapshot into
+        the /servers/[servername] directory."""
+        required_arguments = self._region_arguments
+        required_arguments.update({
+            'snapshot': snapshot,
+            'cwd': self.env['cwd']
+            })
+
+        self._previous_arguments = required_arguments
+        return '%(python)s %(region)s restore %(swd)s %(cwd)s %(snapshot)s' % required_arguments
+
+    @sanitize
+    def command_prune_snapshots(self, step):
+        """Returns the command to remove the region_backup snapshots
+        older than step ('[n]B'), keeping n+1 of them."""
+        steps = self._snapshot_steps(step)
+        if steps is None:
+            raise RuntimeError('Ignoring command {prune}; '
+                               'region snapshots are pruned by count, e.g. 3B')
+
+        required_arguments = self._region_arguments
+        required_arguments['keep'] = steps + 1
+
+        self._previous_arguments = required_arguments
+        return '%(python)s %(region)s prune %(swd)s %(keep)s' % required_arguments
+
     @property
     @sanitize
     def command_kill(self):
@@ -1257,11 +2175,12 @@ class mc(object):
         required_arguments = {
             'live': self.env['cwd'],
             'backup': self.env['bwd'],
-            'archive': self.env['awd']
+            'archive': self.env['awd'],
+            'snapshots': self.env['swd']
             }
 
         self._previous_arguments = required_arguments
-        return 'rm -rf -- %(live)s %(backup)s %(archive)s' % required_arguments
+        return 'rm -rf -- %(live)s %(backup)s %(archive)s %(snapshots)s' % required_arguments
 
     @sanitize
     def command_chown(self, user, path):
@@ -1289,15 +2208,25 @@ class mc(object):
 
     @classmethod
     def list_servers(cls, base_directory):
-        """Lists all directories in /servers/ and /backup/.
+        """Lists all directories in /servers/, /backup/ and /snapshots/.
         Note: not all listings may be servers.
         """        
-        from itertools import chain
+        return cls._server_registry(base_directory).names()
 
-        return list(set(chain(
-            cls._list_subdirs(os.path.join(base_directory, cls.DEFAULT_PATHS['servers'])),
-            cls._list_subdirs(os.path.join(base_directory, cls.DEFAULT_PATHS['backup']))
-            )))
+    @classmethod
+    def _server_registry(cls, base_directory):
+        """Returns the shared server_registry of a base_directory, which
+        indexes server names and directory ownership"""
+        from server_registry import server_registry
+
+        key = os.path.normpath(base_directory)
+        try:
+            return cls.SERVER_REGISTRIES[key]
+        except KeyError:
+            registry = server_registry(key, [cls.DEFAULT_PATHS['servers'],
+                                             cls.DEFAULT_PATHS['backup'],
+                                             cls.DEFAULT_PATHS['snapshots']])
+            return cls.SERVER_REGISTRIES.setdefault(key, registry)
 
     @classmethod
     def list_ports_up(cls):
@@ -1307,6 +2236,16 @@ class mc(object):
             instance = cls(name, base_directory=base_dir)
             yield instance_connection(name, instance.port, instance.ip_address)
 
+    def list_snapshots(self):
+        """Returns the region_backup snapshots of a server, oldest first"""
+        from time import ctime
+        from region_backup import snapshots
+        snaps = namedtuple('snapshots', 'snapshot timestamp friendly_timestamp')
+
+        for i in snapshots(self.env['swd']):
+            mtime = os.stat(os.path.join(self.env['swd'], i)).st_mtime
+            yield snaps(i, int(mtime), ctime(mtime))
+
     def list_increments(self):
         """Returns a tuple of the timestamp of the most current mirror
         and a list of all the increment files found.
@@ -1333,11 +2272,17 @@ class mc(object):
 
     def list_increment_sizes(self):
         """Returns a list of the timestamps/sizes of all the increment files found.
+        With the region engine, lists the snapshots in the same form.
         """
         from subprocess import CalledProcessError
         import re
 
         incs = namedtuple('increments', 'step timestamp increment_size cumulative_size')
+
+        if self._restores_from_snapshots:
+            for row in self._list_snapshot_sizes(incs):
+                yield row
+            return
         
         try:
             output = self._command_direct(self.command_list_increment_sizes, self.env['bwd'])
@@ -1356,39 +2301,94 @@ class mc(object):
             except AttributeError:
                 continue
 
+    def _list_snapshot_sizes(self, incs):
+        """Yields the region_backup snapshots newest first as incs rows,
+        sized as rdiff-backup --list-increment-sizes prints them"""
+        from time import ctime
+
+        def du(path):
+            return sum(os.lstat(os.path.join(root, f)).st_size
+                       for root, dirs, files in os.walk(path) for f in files)
+
+        def size(n):
+            if n < 1 << 20:
+                return '%.2f KB' % (n / 1024.0)
+            return '%.2f MB' % (n / 1048576.0)
+
+        cumulative = 0
+        for count, snapshot in enumerate(reversed(list(self.list_snapshots()))):
+            increment = du(os.path.join(self.env['swd'], snapshot.snapshot))
+            cumulative += increment
+            yield incs('%sB' % count, ctime(snapshot.timestamp), size(increment), size(cumulative))
+
     def list_archives(self):
         """Returns a list of the filenames/sizes of all archives found.
+        A deduplicated archive reports the size of the files it holds,
+        not that of its manifest.
         """
         from time import ctime
         from procfs_reader import human_readable
-        arcs = namedtuple('archives', 'filename size timestamp friendly_timestamp path')
+        arcs = namedtuple('archives', 'filename size timestamp friendly_timestamp path codec')
 
         for i in self._list_files(self.env['awd']):
-            info = os.stat(os.path.join(self.env['awd'], i))
+            path = os.path.join(self.env['awd'], i)
+            info = os.stat(path)
+            size = info.st_size
+            if self._archive_codec_of(i) == 'dedup':
+                from dedup_store import archived_bytes
+                try:
+                    size = archived_bytes(path)
+                except (IOError, ValueError, RuntimeError):
+                    pass
+
             yield arcs(i,
-                       info.st_size,
+                       size,
                        int(info.st_mtime),
                        ctime(info.st_mtime),
-                       self.env['awd'])
+                       self.env['awd'],
+                       self._archive_codec_of(i))
+
+    @classmethod
+    def _archive_codec_of(cls, filename):
+        """Returns the codec whose extension an archive's filename ends
+        with (gzip for .tar.gz, whichever program wrote it), or None"""
+        found = [(len(c.extension), name) for name, c in cls.ARCHIVE_CODECS.iteritems()
+                 if filename.endswith(c.extension) and name != 'pigz']
+        return max(found)[1] if found else None
 
     @classmethod
     def list_servers_up(cls):
-        """Returns screen and java pid info for all running servers"""
-        from procfs_reader import pid_cmdline
-        
-        pids = dict(pid_cmdline())
-        instance_pids = namedtuple('instance_pids', 'server_name java_pid screen_pid base_dir')
-        
-        def name_base():
-            import re
+        """Returns screen and java pid info for all running servers.
+        The process table is read from the shared PROCESS_SNAPSHOT, so
+        repeated calls within its ttl do not rescan procfs.
+        """
+        def build(pids):
+            instance_pids = namedtuple('instance_pids', 'server_name java_pid screen_pid base_dir')
+            return tuple(instance_pids(screen_name[len('mc-'):], java, screen, base_dir)
+                         for screen_name, (screen, java, base_dir) in cls._servers_up_index().iteritems())
 
-            for cmdline in pids.itervalues():
-                if 'screen' in cmdline.lower():
-                    serv = re.search(r'SCREEN.*?mc-([\w._]+).*?-jar ([\w._/]+)\1', cmdline, re.IGNORECASE)
-                    try:
-                        yield (serv.groups()[0], serv.groups()[1]) #server_name, base_dir
-                    except AttributeError:
-                        continue
+        return cls.PROCESS_SNAPSHOT.derived('list_servers_up', build)
+
+    @classmethod
+    def _servers_up_index(cls):
+        """Returns the {screen_name: (screen_pid, java_pid, base_dir)} map
+        of the current process snapshot."""
+        snapshot = cls.PROCESS_SNAPSHOT
+        return snapshot.derived('servers_up_index',
+                                lambda pids: cls._index_servers_up(pids, snapshot.ppid))
+
+    @classmethod
+    def _index_servers_up(cls, pids, ppid):
+        """Builds {screen_name: (screen_pid, java_pid, base_dir)} in one pass
+        over a {pid: cmdline} dict.  Java processes are paired with their
+        screen session by parent pid (ppid: callable reading /proc/<pid>/stat)
+        instead of rescanning every cmdline once per server.
+        """
+        import re
+
+        screen_regex = re.compile(r'SCREEN.*?mc-([\w._]+).*?-jar ([\w._/]+)\1', re.IGNORECASE)
+        screens = {}
+        javas = []
 
         def find_base(directory, match_dir):
             pair = os.path.split(directory.rstrip('/'))
@@ -1399,22 +2399,35 @@ class mc(object):
             else:
                 return find_base(pair[0], match_dir)
 
-        for name, base in name_base():
-            java = None
-            screen = None
-
-            for pid, cmdline in pids.iteritems():
-                if '-jar' in cmdline:
-                    if 'screen' in cmdline.lower() and 'mc-%s' % name in cmdline:
-                        screen = int(pid)
-                    elif '/%s/' % name in cmdline:
-                        java = int(pid)
-                    if java and screen:
-                        break
-            yield instance_pids(name,
-                                java,
-                                screen,
-                                find_base(base, cls.DEFAULT_PATHS['servers']))
+        for pid, cmdline in pids.iteritems():
+            if '-jar' not in cmdline:
+                continue
+            elif 'screen' in cmdline.lower():
+                serv = screen_regex.search(cmdline)
+                if serv:
+                    screens[int(pid)] = serv.groups() #server_name, base_dir
+            else:
+                javas.append((int(pid), cmdline))
+
+        java_by_screen = {}
+        orphans = []
+        for pid, cmdline in javas:
+            parent = ppid(pid)
+            if parent in screens:
+                java_by_screen[parent] = pid
+            else:
+                orphans.append((pid, cmdline))
+
+        index = {}
+        for screen, (name, base) in screens.iteritems():
+            java = java_by_screen.get(screen)
+            if java is None:
+                #java not a direct child of screen (e.g., wrapper script): match by path
+                java = next((pid for pid, cmdline in orphans if '/%s/' % name in cmdline), None)
+            index['mc-%s' % name] = (screen,
+                                     java,
+                                     find_base(base, cls.DEFAULT_PATHS['servers']))
+        return index
 
     def list_last_loglines(self, lines=100):
         """Returns last n lines from logfile"""
@@ -1429,33 +2442,45 @@ class mc(object):
 
     @classmethod
     def list_servers_to_act(cls, action, base_directory):
-        """Generator listing all servers doing action at this minute in time"""
-        from procfs_reader import path_owner
-
-        hits = []
+        """Lists all servers doing action at this minute in time.
+        Servers are staggered by a per-server offset and backups/archives
+        beyond IO_BUDGET per IO_WINDOW minutes are deferred (see plan_day).
+        """
         msm = cls.minutes_since_midnight()
+        return [p.server_name for p in cls._plan_day(base_directory)
+                if p.minute == msm and p.action == action]
 
-        section_option = ('crontabs', '%s_interval' % action)
+    @classmethod
+    def _plan_day(cls, base_directory):
+        """Returns the day's planned crontab actions of every server"""
+        from scheduler import plan_day
+        return plan_day(cls._server_schedules(base_directory), cls.IO_BUDGET, cls.IO_WINDOW)
 
+    @classmethod
+    def _server_schedules(cls, base_directory):
+        """Returns {server_name: {action: interval}} of every server's
+        crontabs section; intervals that are not integers (e.g., 'skip')
+        are left out."""
+        from scheduler import ACTIONS
+
+        options = [('crontabs', '%s_interval' % action) for action in ACTIONS]
+        schedules = {}
         for i in cls.list_servers(base_directory):
             try:
-                path_ = os.path.join(base_directory, cls.DEFAULT_PATHS['servers'], i)
-                owner_ = path_owner(path_)
-                instance = cls(i, owner_, base_directory)
-            
-                interval = instance.server_config.getint(section_option[0],section_option[1])
-                '''msm == 0; at midnight, always trigger. this works because
-                if *_interval is not type(int), e.g., 'skip' or '',
-                it'll except ValueError, skipping the test altogether'''
-                if msm == 0:
-                    hits.append(i)
-                elif msm % interval == 0:
-                    hits.append(i)
-            except Exception:
-                '''(ZeroDivisionError, KeyError, ValueError, NoOptionError, NoSectionError, OSError)'''
+                cls.valid_server_name(i)
+            except ValueError:
                 continue
 
-        return hits
+            path_ = os.path.join(base_directory, cls.DEFAULT_PATHS['servers'], i, 'server.config')
+            intervals = {}
+            for (section, option), value in cls._read_options(path_, options).iteritems():
+                try:
+                    intervals[option[:-len('_interval')]] = int(value)
+                except (TypeError, ValueError):
+                    continue
+            if intervals:
+                schedules[i] = intervals
+        return schedules
 
     @classmethod
     def list_servers_start_at_boot(cls, base_directory):
@@ -1535,22 +2560,21 @@ class mc(object):
             os.chmod(path, 0775)
 
     @staticmethod
-    def has_ownership(username, path):
-        """Returns username of owner, given provided username has access via fs"""
-        from pwd import getpwuid, getpwnam
-        from grp import getgrgid
+    def has_ownership(username, path, uid=None, gid=None):
+        """Returns username of owner, given provided username has access via fs.
+        uid and gid of path may be provided if already known."""
+        from nss_cache import getpwuid, getpwnam, is_member
 
-        st = os.stat(path)
-        uid = st.st_uid
-        gid = st.st_gid
+        if uid is None or gid is None:
+            st = os.stat(path)
+            uid = st.st_uid
+            gid = st.st_gid
 
         owner_user = getpwuid(uid)
-        owner_group = getgrgid(gid)
         user_info = getpwnam(username)
 
         if user_info.pw_uid == uid or \
-           user_info.pw_gid == gid or \
-           username in owner_group.gr_mem:
+           is_member(username, gid):
             return owner_user.pw_name
         elif username == 'root':
             return owner_user.pw_name
@@ -1559,28 +2583,41 @@ class mc(object):
 
     @classmethod
     def has_server_rights(cls, username, server_name, base_directory):
-        """Checks whether a given username is owner/group of a server"""
-        has_rights = False
-        for d in ('servers', 'backup'):
+        """Checks whether a given username is owner/group of a server.
+        Ownership comes from the server_registry rather than a stat per call."""
+        return cls._rights(username, cls._server_registry(base_directory).ownership(server_name))
+
+    @classmethod
+    def _servers_with_rights(cls, username, base_directory):
+        """Returns the names of every server username is owner/group of,
+        from a single lookup of the server_registry"""
+        return [name for name, ownerships in cls._server_registry(base_directory).owners().iteritems()
+                if cls._rights(username, ownerships)]
+
+    @classmethod
+    def _rights(cls, username, ownerships):
+        """Returns the owner of the first of ownerships username has
+        rights on, or False"""
+        for own in ownerships:
             try:
-                path_ = os.path.join(base_directory, cls.DEFAULT_PATHS[d], server_name)
-                has_rights = cls.has_ownership(username, path_)
-                break
-            except OSError:
+                return cls.has_ownership(username, own.path, own.uid, own.gid)
+            except (OSError, KeyError):
                 pass
-        return has_rights
+        return False
 
     def chown(self, user):
-        """Change the ownership of servers/backup/archive"""
-        for d in ('cwd', 'bwd', 'awd'):
+        """Change the ownership of servers/backup/archive/snapshots"""
+        for d in ('cwd', 'bwd', 'awd', 'swd'):
             self._make_directory(self.env[d])
-            self._command_direct(self.command_chown(user, self.env[d]), self.env[d])
+            self._command_direct(self.command_chown(user, self.env[d]), self.env[d], maintenance=True)
+        self._server_registry(self.base).invalidate()
 
     def chgrp(self, group):
-        """Change the group ownership of servers/backup/archive"""
-        for d in ('cwd', 'bwd', 'awd'):
+        """Change the group ownership of servers/backup/archive/snapshots"""
+        for d in ('cwd', 'bwd', 'awd', 'swd'):
             self._make_directory(self.env[d])
-            self._command_direct(self.command_chgrp(group, self.env[d]), self.env[d])
+            self._command_direct(self.command_chgrp(group, self.env[d]), self.env[d], maintenance=True)
+        self._server_registry(self.base).invalidate()
 
     def chgrp_pc(self, group):
         """Change the group ownership of profile.config"""
@@ -1588,19 +2625,17 @@ class mc(object):
 
     @staticmethod
     def _list_subdirs(directory):
-        """Returns a list of all subdirectories of a path."""
-        try:
-            return os.walk(directory).next()[1]
-        except StopIteration:
-            return []
+        """Returns a list of all subdirectories of a path.
+        Listings of directories under an fs_watcher are served from memory."""
+        from fs_watcher import listing
+        return listing(directory)[0]
 
     @staticmethod
     def _list_files(directory):
-        """Returns a list of all files in a path (no recursion)."""
-        try:
-            return os.walk(directory).next()[2]
-        except StopIteration:
-            return []
+        """Returns a list of all files in a path (no recursion).
+        Listings of directories under an fs_watcher are served from memory."""
+        from fs_watcher import listing
+        return listing(directory)[1]
 
     @classmethod
     def _make_skeleton(cls, base_directory):
@@ -1611,6 +2646,14 @@ class mc(object):
             except OSError:
                 pass
 
+        from dedup_store import secure_store
+        try:
+            #only the store's owner adds chunks; stores made writable by
+            #every server owner in earlier releases are taken back
+            secure_store(os.path.join(base_directory, cls.DEFAULT_PATHS['store']))
+        except OSError:
+            pass
+
         try:
             path_ = os.path.join(base_directory, cls.DEFAULT_PATHS['profiles'], 'profile.config')
             with open(path_, 'a'): pass
@@ -10,6 +10,9 @@ __email__ = "wdchromium@gmail.com"
 
 import cherrypy
 import os
+import conf_reader
+import nss_cache
+import fs_watcher
 from mineos import mc
 from auth import require
 from subprocess import CalledProcessError
@@ -36,65 +39,126 @@ def to_jsonable_type(retval):
         return retval
 
 class ViewModel(object):
-    def __init__(self):
+    def __init__(self, sampler=None, collector=None, scheduler=None):
         self.base_directory = cherrypy.config['misc.base_directory']
+        self.sampler = sampler
+        self.collector = collector
+        self.scheduler = scheduler
 
     @property
     def login(self):
         return str(cherrypy.session['_cp_username'])
 
     def server_list(self):
-        for i in mc.list_servers(self.base_directory):
-            if mc.has_server_rights(self.login, i, self.base_directory):
-                yield i
+        return mc._servers_with_rights(self.login, self.base_directory)
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
     @strongly_expire
     def status(self):
-        servers = []
-        for i in self.server_list():
-            try:
-                instance = mc(i, self.login, self.base_directory)
-            except ValueError:
-                continue #fails valid_server_name
-
-            try:
-                java_xmx = int(instance.server_config['java':'java_xmx'])
-            except (KeyError, ValueError):
-                java_xmx = 0
-
-            srv = {
-                'server_name': i,
-                'profile': instance.profile,
-                'up': instance.up,
-                'ip_address': instance.ip_address,
-                'port': instance.port,
-                'memory': instance.memory,
-                'java_xmx': java_xmx,
-                'eula': instance.eula
-                }
+        if self.collector is not None:
+            return self.collector.servers(list(self.server_list()))
 
-            try:
-                ping = instance.ping
-            except KeyError:
-                continue
-            except IndexError:
-                #assert d[0] == '\xff'
-                #IndexError: string index out of range
-                srv.update({
-                    'protocol_version': '',
-                    'server_version': '',
-                    'motd': '',
-                    'players_online': -1,
-                    'max_players': instance.server_properties['max-players'::0]
-                    })
-            else:
-                srv.update(dict(instance.ping._asdict()))
-                
-            servers.append(srv)
+        from status_collector import server_status
 
-        return servers
+        summaries = mc._server_summaries(self.base_directory, list(self.server_list()))
+        statuses = server_status(summaries.values(), self.sampler)
+        return [statuses[i] for i in sorted(statuses)]
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @strongly_expire
+    def jobs(self):
+        if self.scheduler is None:
+            return {}
+        return self.scheduler.status(list(self.server_list()))
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @strongly_expire
+    def plan(self, hours=24):
+        from scheduler import upcoming
+
+        try:
+            hours = float(hours)
+        except ValueError:
+            hours = 24
+
+        visible = set(self.server_list())
+        planned = upcoming(mc._plan_day(self.base_directory), hours=hours, window=mc.IO_WINDOW)
+        planned['jobs'] = [j for j in planned['jobs'] if j['server_name'] in visible]
+        planned.update(io_budget=mc.IO_BUDGET, io_window=mc.IO_WINDOW)
+        return planned
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @strongly_expire
+    def metrics(self, server_name=None):
+        if server_name:
+            if not mc.has_server_rights(self.login, server_name, self.base_directory):
+                return {}
+            server_names = [server_name]
+        else:
+            server_names = list(self.server_list())
+
+        series = self.sampler.series(server_names) if self.sampler else {}
+        for i in server_names:
+            durations = mc.SAVE_DURATIONS.get(os.path.join(self.base_directory, mc.DEFAULT_PATHS['servers'], i))
+            if durations:
+                series.setdefault(i, {})['save_seconds'] = durations.values()
+        return series
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @strongly_expire
+    def history(self, server_name, field='rss', start=None, end=None, step=None):
+        from metrics import resource_sampler, round_robin_archive
+        from math import isinf, isnan
+        from time import time
+
+        def finite(value):
+            value = float(value)
+            if isinf(value) or isnan(value):
+                raise ValueError('%s is not a finite number' % value)
+            return value
+
+        try:
+            if not mc.has_server_rights(self.login, mc.valid_server_name(server_name), self.base_directory):
+                return {}
+        except ValueError:
+            return {}
+
+        try:
+            end = finite(end) if end else time()
+        except ValueError:
+            end = time()
+
+        try:
+            start = finite(start) if start else end - 3600
+        except ValueError:
+            start = end - 3600
+
+        path = resource_sampler.archive_path(os.path.join(self.base_directory,
+                                                          mc.DEFAULT_PATHS['metrics']),
+                                             server_name)
+        try:
+            archive = round_robin_archive(path, readonly=True)
+        except (IOError, ValueError, EnvironmentError):
+            return {}
+
+        try:
+            step, points = archive.fetch(field, start, end, int(step) if step else None)
+        except ValueError:
+            return {}
+        finally:
+            archive.close()
+
+        return {
+            'server_name': server_name,
+            'field': field,
+            'step': step,
+            'points': points
+            }
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -140,6 +204,13 @@ class ViewModel(object):
         instance = mc(server_name, self.login, self.base_directory)
         return [dict(d._asdict()) for d in instance.list_increment_sizes()]
 
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @strongly_expire
+    def snapshots(self, server_name):
+        instance = mc(server_name, self.login, self.base_directory)
+        return [dict(d._asdict()) for d in instance.list_snapshots()]
+
     @cherrypy.expose
     @cherrypy.tools.json_out()
     @strongly_expire
@@ -152,8 +223,7 @@ class ViewModel(object):
     @strongly_expire
     def server_summary(self, server_name):
         from procfs_reader import disk_usage
-        from pwd import getpwuid
-        from grp import getgrgid
+        from nss_cache import getpwuid, getgrgid
 
         cwd = os.path.join(self.base_directory, mc.DEFAULT_PATHS['servers'], server_name)
         bwd = os.path.join(self.base_directory, mc.DEFAULT_PATHS['backup'], server_name)
@@ -186,12 +256,21 @@ class ViewModel(object):
     @strongly_expire
     def dashboard(self):
         from procfs_reader import entries, proc_uptime, disk_free, git_hash
-        from grp import getgrall, getgrgid
-        from pwd import getpwnam
+        from nss_cache import getgrall, getgrgid, getpwnam
         from stock_profiles import STOCK_PROFILES
-        
-        kb_free = dict(entries('', 'meminfo'))['MemFree']
-        mb_free = str(round(float(kb_free.split()[0])/1000, 2))
+        from time import time
+
+        if self.collector is not None:
+            host = self.collector.host()
+        else:
+            kb_free = dict(entries('', 'meminfo'))['MemFree']
+            host = {
+                'uptime': int(proc_uptime()[0]),
+                'memfree': str(round(float(kb_free.split()[0])/1000, 2)),
+                'df': dict(disk_free(cherrypy.config['misc.base_directory'])._asdict()),
+                'git_hash': git_hash(os.path.dirname(os.path.abspath(__file__))),
+                }
+            host['timestamps'] = dict.fromkeys(host, time())
 
         try:
             pc_path = os.path.join(self.base_directory, mc.DEFAULT_PATHS['profiles'], 'profile.config')
@@ -206,19 +285,21 @@ class ViewModel(object):
 
         primary_group = getgrgid(getpwnam(self.login).pw_gid).gr_name
     
-        return {
-            'uptime': int(proc_uptime()[0]),
-            'memfree': mb_free,
+        host.update({
             'whoami': self.login,
             'group': primary_group,
-            'df': dict(disk_free(cherrypy.config['misc.base_directory'])._asdict()),
             'groups': [i.gr_name for i in getgrall() if self.login in i.gr_mem or self.login == 'root'] + [primary_group],
             'pc_permissions': profile_editable,
             'pc_group': pc_group,
-            'git_hash': git_hash(os.path.dirname(os.path.abspath(__file__))),
             'stock_profiles': [i['name'] for i in STOCK_PROFILES],
             'base_directory': self.base_directory,
-            }
+            'process_snapshot': mc.PROCESS_SNAPSHOT.stats,
+            'config_cache': conf_reader.cache_info(),
+            'nss_cache': nss_cache.cache_info(),
+            'listing_cache': fs_watcher.cache_info(),
+            'status_collector': self.collector.stats if self.collector else None,
+            })
+        return host
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -231,14 +312,30 @@ class ViewModel(object):
             } for f in mc._list_files(path)]
 
 class Root(object):
-    METHODS = list(m for m in dir(mc) if callable(getattr(mc,m)) \
-                   and not m.startswith('_'))
-    PROPERTIES = list(m for m in dir(mc) if not callable(getattr(mc,m)) \
-                      and not m.startswith('_'))
-
-    def __init__(self):
+    #class-level settings and shared state (UPPERCASE), the parsed config
+    #objects and the helpers that take mc instances are not commands
+    INTERNAL = ('ping_many', 'query_many', 'server_list_packet',
+                'server_properties', 'server_config', 'profile_config')
+    METHODS = [m for m in dir(mc) if callable(getattr(mc,m)) \
+               and not m.startswith('_') and not m.isupper() and m not in INTERNAL]
+    PROPERTIES = [m for m in dir(mc) if not callable(getattr(mc,m)) \
+                  and not m.startswith('_') and not m.isupper() and m not in INTERNAL]
+    ASYNC_COMMANDS = {
+        'backup': 'io',
+        'archive': 'cpu',
+        'restore': 'io',
+        'restore_archive': 'io',
+        'prune_archives': 'io',
+        'stop_and_backup': 'io',
+        'chown': 'io',
+        'update_profile': 'io',
+        'import_server': 'io',
+        }
+
+    def __init__(self, scheduler=None):
         self.html_directory = cherrypy.config['misc.html_directory']
         self.base_directory = cherrypy.config['misc.base_directory']
+        self.scheduler = scheduler
 
     @cherrypy.expose
     @cherrypy.tools.json_out()
@@ -250,6 +347,43 @@ class Root(object):
     def login(self):
         return str(cherrypy.session['_cp_username'])
 
+    def _submit(self, response, server_name, action, fn):
+        """Queues a long-running command on the scheduler, noting the
+        job id in the response to be polled at /jobs; the response's
+        result is then 'queued' rather than 'success'"""
+        queued = self.scheduler.submit(server_name,
+                                       action,
+                                       fn,
+                                       self.ASYNC_COMMANDS[response['cmd']],
+                                       self.login)
+        if queued is None:
+            raise RuntimeWarning('%s is already queued or running' % action)
+
+        response['job'] = queued.id
+        return '%s queued as job %s' % (action, queued.id)
+
+    @cherrypy.expose
+    @cherrypy.tools.json_out()
+    @strongly_expire
+    @require()
+    def jobs(self, job_id=None):
+        if self.scheduler is None:
+            return {}
+
+        servers = mc._servers_with_rights(self.login, self.base_directory)
+
+        if job_id is None:
+            return self.scheduler.status(servers, self.login)
+
+        try:
+            record = self.scheduler.get(int(job_id))
+        except ValueError:
+            record = None
+
+        if record is None or not (record['server_name'] in servers or record['user'] == self.login):
+            return {}
+        return record
+
     @cherrypy.expose
     @require()
     def index(self):
@@ -305,7 +439,12 @@ class Root(object):
                                                            'profile.config'))
                  
                 instance = mc('throwaway', None, self.base_directory)
-                retval = instance.update_profile(**args)
+                if self.scheduler is not None:
+                    from functools import partial
+                    retval = self._submit(response, None, '%s %s' % (command, args['profile']),
+                                          partial(instance.update_profile, **args))
+                else:
+                    retval = instance.update_profile(**args)
             elif command == 'remove_profile':
                 for i in mc.list_servers(self.base_directory):
                     if mc(i, None, self.base_directory).profile == args['profile']:
@@ -344,7 +483,7 @@ class Root(object):
             response['result'] = 'warning'
             retval = ex.message
         else:
-            response['result'] = 'success'
+            response['result'] = 'queued' if 'job' in response else 'success'
 
         response['payload'] = to_jsonable_type(retval)
         return response
@@ -375,7 +514,11 @@ class Root(object):
             
             instance = mc(server_name, owner, self.base_directory)
 
-            if command in self.METHODS:
+            if command in self.ASYNC_COMMANDS and self.scheduler is not None:
+                from functools import partial
+                retval = self._submit(response, server_name, command,
+                                      partial(getattr(instance, command), **args))
+            elif command in self.METHODS:
                 retval = getattr(instance, command)(**args)
             elif command in self.PROPERTIES:
                 if args:
@@ -396,7 +539,7 @@ class Root(object):
             response['result'] = 'warning'
             retval = ex.message
         else:
-            response['result'] = 'success'
+            response['result'] = 'queued' if 'job' in response else 'success'
 
         response['payload'] = to_jsonable_type(retval)
         return response
@@ -463,7 +606,7 @@ class Root(object):
 
         from json import loads
         from collections import defaultdict
-        from grp import getgrnam
+        from nss_cache import getgrnam
         from stat import S_IWGRP
 
         try:
@@ -523,15 +666,23 @@ class Root(object):
             'payload': None
             }
 
-        from pwd import getpwnam
-        from grp import getgrgid
+        from nss_cache import getpwnam, getgrgid
 
-        try:
-            instance = mc(server_name, self.login, self.base_directory)
+        login = self.login
+
+        def import_and_own():
+            instance = mc(server_name, login, self.base_directory)
             instance.import_server(**args)
             instance = mc(server_name, None, self.base_directory)
-            instance.chown(self.login)
-            instance.chgrp(getgrgid(getpwnam(self.login).pw_gid).gr_name)
+            instance.chown(login)
+            instance.chgrp(getgrgid(getpwnam(login).pw_gid).gr_name)
+            return "Server '%s' successfully imported" % server_name
+
+        try:
+            if self.scheduler is not None:
+                retval = self._submit(response, server_name, 'import_server', import_and_own)
+            else:
+                retval = import_and_own()
         except (RuntimeError, KeyError, OSError, ValueError) as ex:
             response['result'] = 'error'
             retval = ex.message
@@ -542,8 +693,7 @@ class Root(object):
             response['result'] = 'warning'
             retval = ex.message
         else:
-            response['result'] = 'success'
-            retval = "Server '%s' successfully imported" % server_name
+            response['result'] = 'queued' if 'job' in response else 'success'
 
         response['payload'] = to_jsonable_type(retval)
         return response 
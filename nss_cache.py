@@ -0,0 +1,138 @@
+"""
+    Cached user and group database (pwd/grp) lookups.
+
+    With NSS backed by sssd or LDAP every getpw*/getgr* call may be a
+    network round trip, so entries are kept for TTL seconds and unknown
+    names or ids (KeyError) for NEGATIVE_TTL seconds.  Group membership
+    of every user is precomputed from a single getgrall(), which only
+    speeds up is_member(): sssd and LDAP often do not enumerate groups,
+    so the group's own member list remains the authority.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+from threading import Lock
+from time import time
+
+TTL = 300
+NEGATIVE_TTL = 30
+
+_entries = {}
+_lock = Lock()
+_counts = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'lookup_seconds': 0.0}
+
+def _store(kind, key, value, ttl):
+    _entries[(kind, key)] = (time() + ttl, value)
+
+def _lookup(kind, key, fn):
+    """Returns fn(key) from the cache, calling fn on a miss or expiry;
+    a KeyError raised by fn is cached and re-raised as well"""
+    with _lock:
+        entry = _entries.get((kind, key))
+        if entry is not None and entry[0] > time():
+            if isinstance(entry[1], KeyError):
+                _counts['negative_hits'] += 1
+                raise KeyError(*entry[1].args)
+            _counts['hits'] += 1
+            return entry[1]
+        _counts['misses'] += 1
+
+    start = time()
+    try:
+        value = fn(key)
+    except KeyError as e:
+        with _lock:
+            _counts['lookup_seconds'] += time() - start
+            _store(kind, key, e, NEGATIVE_TTL)
+        raise
+
+    with _lock:
+        _counts['lookup_seconds'] += time() - start
+        _store(kind, key, value, TTL)
+        #the same entry answers the reverse lookup
+        if kind == 'pwnam':
+            _store('pwuid', value.pw_uid, value, TTL)
+        elif kind == 'pwuid':
+            _store('pwnam', value.pw_name, value, TTL)
+        elif kind == 'grgid':
+            _store('grnam', value.gr_name, value, TTL)
+        elif kind == 'grnam':
+            _store('grgid', value.gr_gid, value, TTL)
+    return value
+
+def getpwnam(name):
+    from pwd import getpwnam
+    return _lookup('pwnam', name, getpwnam)
+
+def getpwuid(uid):
+    from pwd import getpwuid
+    return _lookup('pwuid', uid, getpwuid)
+
+def getgrnam(name):
+    from grp import getgrnam
+    return _lookup('grnam', name, getgrnam)
+
+def getgrgid(gid):
+    from grp import getgrgid
+    return _lookup('grgid', gid, getgrgid)
+
+def getgrall():
+    """Returns every group entry as a tuple, with the {username: set(gids)}
+    map of supplementary memberships built from the same read"""
+    return _memberships()[0]
+
+def _memberships():
+    from grp import getgrall
+
+    def build(key):
+        groups = tuple(getgrall())
+        members = {}
+        for group in groups:
+            for user in group.gr_mem:
+                members.setdefault(user, set()).add(group.gr_gid)
+        return (groups, members)
+
+    return _lookup('grall', None, build)
+
+def user_gids(username):
+    """Returns the set of gids username belongs to, primary group
+    included, as far as getgrall() enumerates them.  Raises KeyError
+    for an unknown username."""
+    gids = set(_memberships()[1].get(username, ()))
+    gids.add(getpwnam(username).pw_gid)
+    return gids
+
+def is_member(username, gid):
+    """Returns True if gid is username's primary group or lists
+    username as a member.  The getgrall() index answers the common case;
+    anything it does not list is checked against getgrgid(gid), since
+    getgrall() may not enumerate network groups.  Raises KeyError for
+    an unknown username."""
+    if gid in user_gids(username):
+        return True
+
+    try:
+        return username in getgrgid(gid).gr_mem
+    except KeyError:
+        return False
+
+def invalidate():
+    """Drops every cached entry, e.g., after adding users or groups"""
+    with _lock:
+        _entries.clear()
+
+def cache_info():
+    """Returns hit/miss counters, seconds spent in NSS lookups and an
+    estimate of the seconds saved by cache hits at the mean miss cost"""
+    with _lock:
+        info = dict(_counts)
+        info['entries'] = len(_entries)
+
+    hits = info['hits'] + info['negative_hits']
+    lookups = hits + info['misses']
+    info['hit_rate'] = float(hits) / lookups if lookups else None
+    info['saved_seconds'] = hits * info['lookup_seconds'] / info['misses'] if info['misses'] else 0.0
+    return info
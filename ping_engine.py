@@ -0,0 +1,293 @@
+"""
+    Concurrent, non-blocking request/response exchanges with many
+    minecraft servers at once, bounded by a single overall deadline.
+
+    Both the 1.7+ server list ping (handshake, JSON status, ping/pong)
+    and the legacy 0xFE/0xFF ping are implemented as exchanges.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import errno
+import select
+import socket
+import struct
+from time import time
+
+def pack_varint(value):
+    """Encodes an int as a protocol VarInt (7 bits per byte, LSB first)"""
+    value &= 0xFFFFFFFF
+    out = ''
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out += chr(byte | 0x80)
+        else:
+            return out + chr(byte)
+
+def unpack_varint(data, offset=0):
+    """Decodes a VarInt from data at offset; returns (value, next offset).
+    Raises IndexError if data ends mid-VarInt and ValueError if the
+    VarInt is longer than five bytes."""
+    value = 0
+    for shift in range(0, 35, 7):
+        byte = ord(data[offset])
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            if value & 0x80000000:
+                value -= 1 << 32
+            return value, offset
+    raise ValueError('VarInt is too long')
+
+def pack_string(text):
+    """Encodes a protocol String: VarInt byte length and UTF-8 bytes"""
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return pack_varint(len(text)) + text
+
+def pack_packet(packet_id, payload=''):
+    """Frames a packet: VarInt length, VarInt packet id and payload"""
+    body = pack_varint(packet_id) + payload
+    return pack_varint(len(body)) + body
+
+def unpack_packet(data):
+    """Returns (packet_id, payload, remaining data) of the first packet
+    in data, or None if the packet has not been completely received."""
+    try:
+        length, offset = unpack_varint(data)
+        if len(data) < offset + length:
+            return None
+        packet_id, start = unpack_varint(data, offset)
+    except IndexError:
+        return None
+    return packet_id, data[start:offset + length], data[offset + length:]
+
+def chat_text(component):
+    """Flattens a chat component (a string, list or dict with text and
+    extra) such as a status description into plain text"""
+    if isinstance(component, basestring):
+        return component
+    elif isinstance(component, list):
+        return u''.join(chat_text(c) for c in component)
+    elif isinstance(component, dict):
+        return chat_text(component.get('text', u'')) + \
+               u''.join(chat_text(c) for c in component.get('extra', []))
+    return u''
+
+class exchange(object):
+    """One conversation with a server, driven by run().
+
+    run() sends whatever is queued in `outgoing` and hands every chunk
+    received to received(), which returns True once the conversation is
+    over.  Subclasses set `complete` when they obtained a usable response
+    and `latency` (milliseconds) when they measured a round trip; both
+    are left False/None for servers that could not be reached in time.
+    An exchange that ends without completing starts its `fallback`
+    exchange, if any, within the same deadline.
+    """
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.outgoing = ''
+        self.response = None
+        self.complete = False
+        self.latency = None
+        self.fallback = None
+
+    def connected(self):
+        """Called once the connection is established"""
+        pass
+
+    def send(self, data):
+        """Queues data to be written to the server"""
+        self.outgoing += data
+
+    def received(self, data):
+        """Appends data to the response; returns True when it is complete"""
+        self.response = (self.response or '') + data
+        return False
+
+    def closed(self):
+        """Called when the server closes the connection"""
+        pass
+
+class legacy_exchange(exchange):
+    """Server list ping (0xFE) answered by a single 0xFF kick packet:
+    a one byte id, a big-endian short length in characters and the
+    UTF-16BE payload.  The server closes the connection afterward.
+    """
+    def __init__(self, host, port, packet):
+        super(legacy_exchange, self).__init__(host, port)
+        self.packet = packet
+        self._sent = None
+
+    def connected(self):
+        self._sent = time()
+        self.send(self.packet)
+
+    def received(self, data):
+        super(legacy_exchange, self).received(data)
+        if len(self.response) >= 3:
+            length = struct.unpack('>H', self.response[1:3])[0]
+            if len(self.response) >= 3 + length * 2:
+                self.complete = True
+                self.latency = (time() - self._sent) * 1000
+                return True
+        return False
+
+    def closed(self):
+        self.complete = self.response is not None
+
+class modern_exchange(exchange):
+    """1.7+ server list ping: a handshake into the status state and a
+    status request answered with JSON, then a ping whose pong gives the
+    round-trip latency.  `status` holds the decoded JSON document.
+    """
+    PROTOCOL_VERSION = 47
+
+    def __init__(self, host, port):
+        super(modern_exchange, self).__init__(host, port)
+        self.status = None
+        self._buffer = ''
+        self._sent = None
+
+    def connected(self):
+        handshake = pack_varint(self.PROTOCOL_VERSION) + \
+                    pack_string(self.host) + \
+                    struct.pack('>H', self.port) + \
+                    pack_varint(1)
+        self.send(pack_packet(0x00, handshake) + pack_packet(0x00))
+
+    def received(self, data):
+        import json
+
+        self._buffer += data
+        if self._buffer[:1] == '\xff':
+            return True #legacy kick: the server does not speak this protocol
+
+        try:
+            packet = unpack_packet(self._buffer)
+        except ValueError:
+            return True
+        if packet is None:
+            return False
+
+        packet_id, payload, self._buffer = packet
+        if self.status is None:
+            if packet_id != 0x00:
+                return True
+            try:
+                length, offset = unpack_varint(payload)
+                self.status = json.loads(payload[offset:offset + length].decode('utf-8'))
+            except (IndexError, ValueError):
+                return True
+            if not isinstance(self.status, dict):
+                self.status = None
+                return True
+
+            self.complete = True
+            self._sent = time()
+            self.send(pack_packet(0x01, struct.pack('>q', int(self._sent * 1000))))
+            return False
+        elif packet_id == 0x01:
+            self.latency = (time() - self._sent) * 1000
+        return True
+
+def run(exchanges, timeout=2.5):
+    """Connects to every exchange's server at once and drives all of
+    them with a single poll loop.  Returns the exchanges once every one
+    has completed, failed or the shared deadline of `timeout` seconds
+    has passed, so the call never takes longer than one timeout no
+    matter how many servers hang.  Fallbacks of failed exchanges are
+    started as soon as the failure is seen.
+    """
+    deadline = time() + timeout
+    poller = select.poll()
+    active = {}
+
+    def start(ex):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(0)
+        try:
+            err = sock.connect_ex((ex.host, ex.port))
+        except (socket.error, socket.gaierror, TypeError):
+            err = None
+
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            if ex.fallback:
+                start(ex.fallback)
+            return
+
+        #[socket, exchange, connected]
+        active[sock.fileno()] = [sock, ex, False]
+        poller.register(sock, select.POLLOUT)
+
+    def finish(fd):
+        sock, ex = active.pop(fd)[:2]
+        poller.unregister(fd)
+        sock.close()
+        if ex.fallback and not ex.complete and deadline > time():
+            start(ex.fallback)
+
+    for ex in exchanges:
+        start(ex)
+
+    while active:
+        remaining = deadline - time()
+        if remaining <= 0:
+            break
+
+        try:
+            events = poller.poll(remaining * 1000)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+
+        for fd, event in events:
+            if fd not in active:
+                continue
+            state = active[fd]
+            sock, ex = state[0], state[1]
+
+            try:
+                if not state[2]:
+                    if sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR):
+                        finish(fd)
+                        continue
+                    state[2] = True
+                    ex.connected()
+
+                if ex.outgoing and event & select.POLLOUT:
+                    sent = sock.send(ex.outgoing)
+                    ex.outgoing = ex.outgoing[sent:]
+
+                if event & (select.POLLIN | select.POLLHUP | select.POLLERR):
+                    data = sock.recv(4096)
+                    if not data:
+                        ex.closed()
+                        finish(fd)
+                        continue
+                    elif ex.received(data):
+                        finish(fd)
+                        continue
+            except socket.error as e:
+                if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                    continue
+                finish(fd)
+                continue
+
+            poller.modify(sock, select.POLLIN | (select.POLLOUT if ex.outgoing else 0))
+
+    for fd in active.keys():
+        sock = active.pop(fd)[0]
+        poller.unregister(fd)
+        sock.close()
+
+    return exchanges
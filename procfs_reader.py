@@ -8,7 +8,6 @@ __version__ = "0.6.0"
 __email__ = "wdchromium@gmail.com"
 
 import os
-from binascii import b2a_qp
 
 _PROCFS_PATHS = ['/proc',
                  '/usr/compat/linux/proc',
@@ -24,37 +23,230 @@ for procfs in _PROCFS_PATHS:
     else:
         raise RuntimeError('No suitable procfs filesystem found')
 
-def pids():  
-    return set(int(pid) for pid in os.listdir(_procfs) if pid.isdigit())
+def pids(procfs=None):  
+    return set(int(pid) for pid in os.listdir(procfs or _procfs) if pid.isdigit())
 
-def pid_cmdline():
+#/proc/<pid>/stat fields, indexed from the state field (field 3),
+#since everything before it is "pid (comm)" and comm may contain spaces
+STAT_FIELDS = {
+    'state': 0,
+    'ppid': 1,
+    'minflt': 7,
+    'majflt': 9,
+    'utime': 11,
+    'stime': 12,
+    'priority': 15,
+    'nice': 16,
+    'num_threads': 17,
+    'starttime': 19,
+    'vsize': 20,
+    'rss': 21
+    }
+
+_READ_SIZE = 65536
+
+def read_page(pid, page, procfs=None):
+    """Returns the raw contents of /proc/<pid>/<page>.
+    procfs pages are generated whole, so a single os.read() normally
+    returns everything without a python file object or line iteration.
+    """
+    try:
+        fd = os.open(os.path.join(procfs or _procfs, str(pid), page), os.O_RDONLY)
+        try:
+            data = os.read(fd, _READ_SIZE)
+            if len(data) == _READ_SIZE:
+                chunks = [data]
+                while len(chunks[-1]) == _READ_SIZE:
+                    chunks.append(os.read(fd, _READ_SIZE))
+                data = ''.join(chunks)
+        finally:
+            os.close(fd)
+    except OSError as e:
+        raise IOError(e.errno, e.strerror, e.filename)
+    return data
+
+def _stat_values(raw, fields):
+    values = raw.rpartition(')')[2].split()
+    return dict((f, values[STAT_FIELDS[f]] if f == 'state' else int(values[STAT_FIELDS[f]]))
+                for f in fields)
+
+def _status_values(raw, keys):
+    """Extracts only the requested 'Key:\tvalue' lines from a status page"""
+    raw = '\n' + raw
+    found = {}
+    for key in keys:
+        start = raw.find('\n%s:' % key)
+        if start != -1:
+            start += len(key) + 2
+            end = raw.find('\n', start)
+            found[key] = raw[start:end if end != -1 else None].strip()
+    return found
+
+def pid_fields(pid, cmdline=False, stat=(), status=(), io=(), procfs=None):
+    """Returns a dict of only the requested fields of a process:
+    'cmdline' (NULs as spaces), any STAT_FIELDS names from stat,
+    any keys of /proc/<pid>/status (values as unparsed strings) and
+    any counters of /proc/<pid>/io (as ints).
+
+    Raises IOError if the process does not exist, or if io is
+    requested for a process owned by another user.
+    """
+    fields = {}
+    if cmdline:
+        fields['cmdline'] = read_page(pid, 'cmdline', procfs).replace('\x00', ' ').strip()
+    if stat:
+        fields.update(_stat_values(read_page(pid, 'stat', procfs), stat))
+    if status:
+        fields.update(_status_values(read_page(pid, 'status', procfs), status))
+    if io:
+        fields.update((k, int(v)) for k, v in
+                      _status_values(read_page(pid, 'io', procfs), io).iteritems())
+    return fields
+
+def pid_batch(pid_list, cmdline=False, stat=(), status=(), io=(), procfs=None):
+    """Returns {pid: pid_fields(...)} for every pid in pid_list that
+    still exists; vanished processes are silently omitted."""
+    batch = {}
+    for pid in pid_list:
+        try:
+            batch[pid] = pid_fields(pid, cmdline, stat, status, io, procfs)
+        except (IOError, IndexError, ValueError):
+            continue
+    return batch
+
+def pid_cmdline(procfs=None):
     """
     Generator: all processes' pids
 
     """    
-    for pid in pids():
+    procfs = procfs or _procfs
+    for pid in pids(procfs):
         try:
-            with open(os.path.join(_procfs, str(pid), 'cmdline'), 'rb') as fh:
-                cmdline = b2a_qp(fh.read())
-                cmdline = cmdline.replace('=00', ' ').replace('=\n', '').strip()
-                yield (pid, cmdline)
+            yield (pid, read_page(pid, 'cmdline', procfs).replace('\x00', ' ').strip())
         except IOError:
             continue
 
+def pid_ppid(pid, procfs=None):
+    """Returns the parent pid of a process, read from /proc/<pid>/stat"""
+    return _stat_values(read_page(pid, 'stat', procfs), ('ppid',))['ppid']
+
+def pid_starttime(pid, procfs=None):
+    """Returns the start time (clock ticks after boot) of a process,
+    or None if it is a zombie awaiting its parent."""
+    fields = _stat_values(read_page(pid, 'stat', procfs), ('state', 'starttime'))
+    return None if fields['state'] == 'Z' else fields['starttime']
+
+def pid_alive(pid, starttime=None, procfs=None):
+    """Checks that a pid exists, is not a zombie and, if starttime is
+    given, is still the same process rather than a recycled pid."""
+    from errno import EPERM
+
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        if e.errno != EPERM:
+            return False
+
+    try:
+        actual = pid_starttime(pid, procfs)
+    except (IOError, IndexError, ValueError):
+        return False
+    return actual is not None and (starttime is None or actual == starttime)
+
+class pid_snapshot(object):
+    """
+    Shared, time-limited copy of the process table.
+
+    Rebuilding the table reads every /proc/<pid>/cmdline, so callers
+    share a single snapshot and the scan only reruns once the snapshot
+    is older than ttl seconds (or after invalidate()).
+
+    """
+    def __init__(self, ttl=2.0, procfs=None):
+        from threading import RLock
+
+        self.ttl = ttl
+        self.procfs = procfs or _procfs
+        self.hits = 0
+        self.misses = 0
+        self._lock = RLock()
+        self._taken = None
+        self._cmdlines = {}
+        self._ppids = {}
+        self._derived = {}
+
+    def _refresh(self):
+        """Rescans procfs if the snapshot expired; caller holds the lock"""
+        from time import time
+
+        now = time()
+        if self._taken is None or not 0 <= now - self._taken < self.ttl:
+            self._cmdlines = dict(pid_cmdline(self.procfs))
+            self._ppids = {}
+            self._derived = {}
+            self._taken = now
+            self.misses += 1
+        else:
+            self.hits += 1
+
+    def cmdlines(self):
+        """Returns a dict of {pid: cmdline} for all running processes"""
+        with self._lock:
+            self._refresh()
+            return self._cmdlines
+
+    def derived(self, key, fn):
+        """Returns fn(cmdlines), computed at most once per snapshot"""
+        with self._lock:
+            self._refresh()
+            try:
+                return self._derived[key]
+            except KeyError:
+                self._derived[key] = fn(self._cmdlines)
+                return self._derived[key]
+
+    def ppid(self, pid):
+        """Returns the parent pid of a snapshotted process, or None if it has exited"""
+        try:
+            return self._ppids[pid]
+        except KeyError:
+            try:
+                self._ppids[pid] = pid_ppid(pid, self.procfs)
+            except (IOError, IndexError, ValueError):
+                self._ppids[pid] = None
+            return self._ppids[pid]
+
+    def invalidate(self):
+        """Forces the next access to rescan procfs"""
+        with self._lock:
+            self._taken = None
+
+    @property
+    def stats(self):
+        """Returns hit/miss counters and the age of the current snapshot"""
+        from time import time
+
+        with self._lock:
+            return {
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'age': time() - self._taken if self._taken else None
+                }
+
 def entries(pid, page):
-    with open(os.path.join(_procfs, str(pid), page)) as proc_status:
-        for line in proc_status:
-            split = b2a_qp(line).partition(':')
-            yield (split[0].strip(), split[2].strip())
+    for line in read_page(pid, page).splitlines():
+        split = line.partition(':')
+        yield (split[0].strip(), split[2].strip())
 
 def path_owner(path):
-    from pwd import getpwuid
+    from nss_cache import getpwuid
     st = os.stat(path)
     uid = st.st_uid
     return getpwuid(uid).pw_name
 
 def pid_owner(pid):
-    from pwd import getpwuid
+    from nss_cache import getpwuid
     
     try:
         status_page = dict(entries(pid, 'status'))
@@ -64,7 +256,7 @@ def pid_owner(pid):
         return getpwuid(int(status_page['Uid'].partition('\t')[0]))
 
 def pid_group(pid):
-    from grp import getgrgid
+    from nss_cache import getgrgid
 
     try:
         status_page = dict(entries(pid, 'status'))
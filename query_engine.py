@@ -0,0 +1,161 @@
+"""
+    GameSpy4 (UDP) query of many minecraft servers through one socket.
+    Servers with enable-query=true answer a full stat request with
+    their settings, plugins, map and the names of all online players.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import errno
+import select
+import socket
+import struct
+from threading import Lock
+from time import time
+
+MAGIC = '\xfe\xfd'
+HANDSHAKE = 0x09
+STAT = 0x00
+
+def session_id(n):
+    """Spreads n (0-65535) over the low nibble of each byte, since
+    servers mask session ids with 0x0F0F0F0F"""
+    return sum(((n >> 4 * i) & 0xF) << 8 * i for i in range(4))
+
+def handshake_packet(session):
+    return MAGIC + struct.pack('>BI', HANDSHAKE, session)
+
+def stat_packet(session, token):
+    return MAGIC + struct.pack('>BII', STAT, session, token & 0xFFFFFFFF) + '\x00' * 4
+
+def parse_stat(payload):
+    """Parses the body of a full stat response (after type and session)
+    into ({key: value}, [player names])."""
+    def decode(s):
+        return s.decode('utf-8', 'replace')
+
+    if payload.startswith('splitnum\x00'):
+        payload = payload[11:]
+
+    info_raw, sep, players_raw = payload.partition('\x00\x00\x01player_\x00\x00')
+    fields = info_raw.split('\x00')
+    info = dict((decode(k), decode(v)) for k, v in zip(fields[::2], fields[1::2]) if k)
+    players = [decode(p) for p in players_raw.split('\x00') if p]
+    return info, players
+
+class query_client(object):
+    """Queries servers in batches over a single UDP socket.
+
+    Challenge tokens are cached per address for TOKEN_TTL seconds (servers
+    rotate them every 30), so repeated queries skip the handshake.  A
+    server that has not answered by half the timeout is asked again,
+    with a fresh handshake in case its cached token went stale.
+    """
+    TOKEN_TTL = 25
+
+    def __init__(self):
+        self._tokens = {}
+        self._counter = 0
+        self._lock = Lock()
+
+    def forget(self, address=None):
+        """Drops the cached token of one (host, port), or all of them"""
+        with self._lock:
+            if address is None:
+                self._tokens.clear()
+            else:
+                self._tokens.pop(address, None)
+
+    def _token(self, address, now):
+        with self._lock:
+            token, issued = self._tokens.get(address, (None, 0))
+            return token if now - issued < self.TOKEN_TTL else None
+
+    def query(self, targets, timeout=1.5):
+        """Sends full stat requests to every {key: (host, port)} and returns
+        {key: {'info': {...}, 'players': [...]}} for those answering within
+        `timeout` seconds."""
+        deadline = time() + timeout
+        results = {}
+        sessions = {}
+
+        with self._lock:
+            for key, address in targets.iteritems():
+                sessions[session_id(self._counter)] = [key, address, None]
+                self._counter = (self._counter + 1) % 65536
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setblocking(0)
+
+        def send(session, retry=False):
+            address = sessions[session][1]
+            token = None if retry else self._token(address, time())
+            if token is None:
+                packet = handshake_packet(session)
+                sessions[session][2] = None
+            else:
+                packet = stat_packet(session, token)
+                sessions[session][2] = token
+            try:
+                sock.sendto(packet, address)
+            except (socket.error, socket.gaierror, TypeError):
+                pass
+
+        try:
+            for session in sessions:
+                send(session)
+
+            retried = False
+            while len(results) < len(sessions):
+                now = time()
+                if now >= deadline:
+                    break
+                if not retried and now >= deadline - timeout / 2.0:
+                    retried = True
+                    for session, (key, address, token) in sessions.items():
+                        if key not in results:
+                            self.forget(address)
+                            send(session, retry=True)
+
+                wait = (deadline - timeout / 2.0 if not retried else deadline) - now
+                try:
+                    readable = select.select([sock], [], [], max(0, wait))[0]
+                except select.error as e:
+                    if e.args[0] == errno.EINTR:
+                        continue
+                    raise
+
+                while readable:
+                    try:
+                        data = sock.recv(65535)
+                    except socket.error:
+                        break
+
+                    if len(data) < 5:
+                        continue
+                    packet_type, session = struct.unpack('>BI', data[:5])
+                    try:
+                        key, address, token = sessions[session]
+                    except KeyError:
+                        continue #stale response from an earlier batch
+
+                    if key in results:
+                        continue
+                    elif packet_type == HANDSHAKE:
+                        try:
+                            token = int(data[5:].rstrip('\x00'))
+                        except ValueError:
+                            continue
+                        with self._lock:
+                            self._tokens[address] = (token, time())
+                        send(session)
+                    elif packet_type == STAT:
+                        info, players = parse_stat(data[5:])
+                        results[key] = {'info': info, 'players': players}
+        finally:
+            sock.close()
+
+        return results
@@ -0,0 +1,359 @@
+#!/usr/bin/env python2.7
+"""
+    Incremental backups that look inside Minecraft region files.
+
+    A region file (.mca/.mcr) is an 8 KiB header, 1024 chunk locations
+    and 1024 chunk timestamps, followed by the chunks in 4 KiB sectors.
+    Each snapshot reads the headers through mmap and copies only the
+    chunks whose timestamp, sector count or record length changed since
+    the previous snapshot; every other file is copied only when its size
+    or mtime changed.
+    Unchanged data is referenced from the snapshot that holds it, and
+    restore() rebuilds whole region files from those pieces.  prune()
+    moves data still referenced out of the snapshots it removes.
+
+    Usage (see tree_manifest):
+        region_backup.py backup <snapshot directory> <source>
+        region_backup.py restore <snapshot directory> <destination> [snapshot]
+        region_backup.py prune <snapshot directory> <snapshots to keep>
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import os
+import struct
+
+import tree_manifest
+
+SECTOR = 4096
+HEADER = 2 * SECTOR
+CHUNKS_PER_REGION = 1024
+REGION_EXTENSIONS = ('.mca', '.mcr')
+MANIFEST = 'manifest.json.gz'
+MANIFEST_VERSION = 1
+
+def read_header(mm, size):
+    """Returns {index: (timestamp, sectors, offset)} of the chunks in a
+    mapped region file, or None if the header does not describe a valid
+    region file of that size."""
+    if size < HEADER:
+        return None
+
+    locations = struct.unpack('>%dI' % CHUNKS_PER_REGION, mm[0:SECTOR])
+    timestamps = struct.unpack('>%dI' % CHUNKS_PER_REGION, mm[SECTOR:HEADER])
+
+    chunks = {}
+    for index, location in enumerate(locations):
+        if not location:
+            continue
+        offset = (location >> 8) * SECTOR
+        sectors = location & 0xff
+        if offset < HEADER or not sectors or offset + 5 > size:
+            return None
+        chunks[index] = (timestamps[index], sectors, offset)
+    return chunks
+
+def chunk_record(mm, offset, sectors, size):
+    """Returns the length-prefixed record of the chunk at offset, without
+    the padding of its last sector"""
+    length = struct.unpack('>I', mm[offset:offset + 4])[0]
+    if not length or 4 + length > sectors * SECTOR or offset + 4 + length > size:
+        raise ValueError('Chunk at %d overruns its sectors' % offset)
+    return mm[offset:offset + 4 + length]
+
+def snapshots(directory):
+    """Returns the ids of the complete snapshots in directory, oldest first"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(n for n in names
+                  if not n.startswith('.') and os.path.isfile(os.path.join(directory, n, MANIFEST)))
+
+def read_manifest(directory, snapshot):
+    return tree_manifest.read_manifest(os.path.join(directory, snapshot, MANIFEST),
+                                       MANIFEST_VERSION)
+
+def _copy_region(path, size, previous, snapshot, chunk_file, stats):
+    """Returns the chunk list of a region file, appending changed chunks
+    to chunk_file; None if the file is not a valid region file"""
+    import mmap
+
+    if size < HEADER:
+        return None
+
+    with open(path, 'rb') as fh:
+        mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            header = read_header(mm, size)
+            if header is None:
+                return None
+
+            known = dict((c[0], c) for c in previous['chunks']) if previous else {}
+            chunks = []
+            pending = []
+            for index in sorted(header):
+                timestamp, sectors, offset = header[index]
+                old = known.get(index)
+                #editors and trimmers rewrite chunks without touching the
+                #one-second timestamp, so the record's length is compared too
+                length = struct.unpack('>I', mm[offset:offset + 4])[0]
+                if old is not None and old[1] == timestamp and old[2] == sectors and \
+                   old[5] == 4 + length:
+                    chunks.append(old)
+                else:
+                    pending.append((index, timestamp, sectors, offset))
+
+            if pending:
+                position = 0
+                records = []
+                for index, timestamp, sectors, offset in pending:
+                    try:
+                        record = chunk_record(mm, offset, sectors, size)
+                    except ValueError:
+                        return None
+                    records.append(record)
+                    chunks.append([index, timestamp, sectors, snapshot, position, len(record)])
+                    position += len(record)
+
+                stats['chunks_copied'] += len(records)
+                stats['bytes_copied'] += position
+                _make_parent(chunk_file)
+                with open(chunk_file, 'wb') as out:
+                    for record in records:
+                        out.write(record)
+            stats['chunks_kept'] += len(chunks) - len(pending)
+        finally:
+            mm.close()
+
+    return sorted(chunks)
+
+def _make_parent(path):
+    try:
+        os.makedirs(os.path.dirname(path))
+    except OSError:
+        if not os.path.isdir(os.path.dirname(path)):
+            raise
+
+def backup(directory, source):
+    """Takes a snapshot of source into directory, relative to the latest
+    snapshot there.  Returns (snapshot id, dict of counts)."""
+    from shutil import copy2, rmtree
+    from time import strftime, time
+
+    existing = snapshots(directory)
+    previous = {}
+    if existing:
+        previous = dict((e['path'], e) for e in read_manifest(directory, existing[-1])['entries'])
+
+    snapshot = strftime('%Y-%m-%d_%H:%M:%S')
+    suffix = 1
+    while snapshot in existing or os.path.exists(os.path.join(directory, snapshot)):
+        snapshot = '%s.%d' % (strftime('%Y-%m-%d_%H:%M:%S'), suffix)
+        suffix += 1
+
+    partial = os.path.join(directory, '.%s.partial' % snapshot)
+    stats = dict.fromkeys(('files_copied', 'files_kept', 'chunks_copied',
+                           'chunks_kept', 'bytes_copied'), 0)
+    entries = []
+
+    try:
+        for path, entry in tree_manifest.walk(source):
+            if 'type' not in entry:
+                relpath = entry['path']
+                old = previous.get(relpath)
+                unchanged = old is not None and old.get('size') == entry['size'] and \
+                            old.get('mtime') == entry['mtime']
+
+                if unchanged and old['type'] in ('file', 'region'):
+                    entry.update((k, old[k]) for k in ('type', 'snapshot', 'chunks') if k in old)
+                    stats['files_kept'] += 1
+                    if old['type'] == 'region':
+                        stats['chunks_kept'] += len(old['chunks'])
+                else:
+                    chunks = None
+                    if path.endswith(REGION_EXTENSIONS):
+                        chunks = _copy_region(path, entry['size'],
+                                              old if old and old['type'] == 'region' else None,
+                                              snapshot, os.path.join(partial, 'chunks', relpath),
+                                              stats)
+                    if chunks is not None:
+                        entry.update(type='region', chunks=chunks)
+                    else:
+                        target = os.path.join(partial, 'files', relpath)
+                        _make_parent(target)
+                        copy2(path, target)
+                        entry.update(type='file', snapshot=snapshot)
+                        stats['bytes_copied'] += entry['size']
+                    stats['files_copied'] += 1
+            entries.append(entry)
+
+        if not os.path.isdir(partial):
+            os.makedirs(partial)
+        tree_manifest.write_manifest(os.path.join(partial, MANIFEST), MANIFEST_VERSION,
+                                     created=time(),
+                                     snapshot=snapshot,
+                                     previous=existing[-1] if existing else None,
+                                     entries=entries)
+        os.rename(partial, os.path.join(directory, snapshot))
+    except:
+        rmtree(partial, ignore_errors=True)
+        raise
+
+    return snapshot, stats
+
+def _rebuild_region(directory, path, entry, handles):
+    """Writes a region file from its chunk list, packing chunks into
+    consecutive sectors after the header"""
+    locations = [0] * CHUNKS_PER_REGION
+    timestamps = [0] * CHUNKS_PER_REGION
+
+    with open(path, 'wb') as out:
+        out.write('\x00' * HEADER)
+        sector = HEADER // SECTOR
+        for index, timestamp, sectors, snapshot, position, length in entry['chunks']:
+            key = (snapshot, entry['path'])
+            if key not in handles:
+                handles[key] = open(os.path.join(directory, snapshot, 'chunks', entry['path']), 'rb')
+            handles[key].seek(position)
+            record = handles[key].read(length)
+
+            count = (len(record) + SECTOR - 1) // SECTOR
+            out.write(record + '\x00' * (count * SECTOR - len(record)))
+            locations[index] = (sector << 8) | count
+            timestamps[index] = timestamp
+            sector += count
+
+        out.seek(0)
+        out.write(struct.pack('>%dI' % CHUNKS_PER_REGION, *locations))
+        out.write(struct.pack('>%dI' % CHUNKS_PER_REGION, *timestamps))
+
+def restore(directory, destination, snapshot=None):
+    """Rebuilds the tree of a snapshot (the latest if None or 'now') at
+    destination, overwriting files of the same name and removing those
+    the snapshot does not have.  Returns the id of the restored snapshot."""
+    from shutil import copyfile
+
+    available = snapshots(directory)
+    if snapshot in (None, 'now'):
+        if not available:
+            raise RuntimeError('No snapshots found in %s' % directory)
+        snapshot = available[-1]
+    elif snapshot not in available:
+        raise RuntimeError('No snapshot %s in %s' % (snapshot, directory))
+
+    handles = {}
+    def write_file(entry, path):
+        if entry['type'] == 'region':
+            _rebuild_region(directory, path, entry, handles)
+        else:
+            copyfile(os.path.join(directory, entry['snapshot'], 'files', entry['path']), path)
+
+    try:
+        tree_manifest.restore_tree(destination, read_manifest(directory, snapshot)['entries'],
+                                   write_file, remove_others=True)
+    finally:
+        for fh in handles.itervalues():
+            fh.close()
+
+    return snapshot
+
+def prune(directory, keep):
+    """Removes all but the latest keep snapshots.  Files and chunks the
+    kept snapshots refer to in removed ones are first copied into the
+    oldest kept snapshot and the kept manifests rewritten to match, so
+    every kept snapshot still restores.  Returns the removed ids."""
+    from shutil import copy2, rmtree
+
+    if keep < 1:
+        raise RuntimeError('At least one snapshot must be kept')
+
+    available = snapshots(directory)
+    removed, kept = available[:-keep], available[-keep:]
+    if not removed:
+        return []
+
+    base = kept[0]
+    gone = set(removed)
+    moved = {}
+    readers = {}
+    writers = {}
+
+    try:
+        for snapshot in kept:
+            manifest = read_manifest(directory, snapshot)
+            for entry in manifest['entries']:
+                if entry['type'] == 'file' and entry['snapshot'] in gone:
+                    key = (entry['snapshot'], entry['path'])
+                    if key not in moved:
+                        target = os.path.join(directory, base, 'files', entry['path'])
+                        _make_parent(target)
+                        copy2(os.path.join(directory, entry['snapshot'], 'files', entry['path']), target)
+                        moved[key] = None
+                    entry['snapshot'] = base
+                elif entry['type'] == 'region':
+                    for chunk in entry['chunks']:
+                        if chunk[3] not in gone:
+                            continue
+                        key = (chunk[3], entry['path'], chunk[4])
+                        if key not in moved:
+                            source = (chunk[3], entry['path'])
+                            if source not in readers:
+                                readers[source] = open(os.path.join(directory, chunk[3], 'chunks',
+                                                                    entry['path']), 'rb')
+                            readers[source].seek(chunk[4])
+                            record = readers[source].read(chunk[5])
+
+                            if entry['path'] not in writers:
+                                target = os.path.join(directory, base, 'chunks', entry['path'])
+                                _make_parent(target)
+                                writers[entry['path']] = open(target, 'ab')
+                                writers[entry['path']].seek(0, os.SEEK_END)
+                            moved[key] = writers[entry['path']].tell()
+                            writers[entry['path']].write(record)
+                        chunk[3], chunk[4] = base, moved[key]
+
+            if snapshot == base:
+                manifest['previous'] = None
+            del manifest['version']
+
+            for fh in writers.itervalues():
+                fh.flush()
+            tree_manifest.write_manifest(os.path.join(directory, snapshot, MANIFEST),
+                                         MANIFEST_VERSION, **manifest)
+    finally:
+        for fh in readers.values() + writers.values():
+            fh.close()
+
+    for snapshot in removed:
+        hidden = os.path.join(directory, '.%s.pruned' % snapshot)
+        os.rename(os.path.join(directory, snapshot), hidden)
+        rmtree(hidden)
+
+    return removed
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='MineOS region-aware incremental backups')
+    parser.add_argument('cmd', choices=('backup', 'restore', 'prune'))
+    parser.add_argument('directory', help='the directory of snapshots')
+    parser.add_argument('path', help='the tree to back up or to restore into, '
+                                     'or the number of snapshots to keep')
+    parser.add_argument('snapshot', nargs='?', default=None, help='the snapshot to restore')
+    args = parser.parse_args()
+
+    if args.cmd == 'backup':
+        snapshot, stats = backup(args.directory, args.path)
+        print 'snapshot %s: %d files copied, %d kept; %d chunks copied, %d kept; ' \
+              '%d bytes copied' % ((snapshot, stats['files_copied'], stats['files_kept'],
+                                    stats['chunks_copied'], stats['chunks_kept'],
+                                    stats['bytes_copied']))
+    elif args.cmd == 'restore':
+        print 'snapshot %s restored' % restore(args.directory, args.path, args.snapshot)
+    else:
+        removed = prune(args.directory, int(args.path))
+        print '%d snapshots removed' % len(removed)
@@ -0,0 +1,478 @@
+"""
+    Runs maintenance jobs (backups, archives, restarts) concurrently
+    across servers while keeping each server's jobs strictly in order.
+
+    Every server has its own queue and at most one running job.  Jobs
+    are also bounded globally and by kind: 'cpu' jobs (compression,
+    server startup) and 'io' jobs (incremental backups) each have their
+    own limit, so a burst of due servers cannot saturate either.
+
+    When jobs are due is planned a day at a time (plan_day): each server
+    is offset by a hash of its name, and backups and archives are held
+    to a host-wide budget per window of minutes.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import os
+from collections import deque, namedtuple
+from itertools import count
+from threading import BoundedSemaphore, Condition, Lock, Thread, local
+
+ACTIONS = ('restart', 'backup', 'archive')
+IO_ACTIONS = ('backup', 'archive')
+MINUTES_PER_DAY = 1440
+
+planned = namedtuple('planned', 'minute nominal action server_name')
+
+_context = local()
+
+def record_io(read_bytes, write_bytes):
+    """Adds the disk io of a finished subprocess to the job running
+    on this thread, if any"""
+    current = getattr(_context, 'job', None)
+    if current is not None:
+        current.read_bytes += read_bytes
+        current.write_bytes += write_bytes
+
+class io_slots(object):
+    """A host-wide limit on concurrent disk-heavy work, used as a
+    context manager.  A thread already holding a slot may enter again
+    without taking another, so an operation can hold one slot across
+    save-off, its maintenance commands and save-on."""
+    def __init__(self, slots=2):
+        self._semaphore = BoundedSemaphore(slots)
+        self._held = local()
+
+    def __enter__(self):
+        depth = getattr(self._held, 'depth', 0)
+        if not depth:
+            self._semaphore.acquire()
+        self._held.depth = depth + 1
+        return self
+
+    def __exit__(self, *exc_info):
+        self._held.depth -= 1
+        if not self._held.depth:
+            self._semaphore.release()
+
+def stagger_offset(server_name, interval):
+    """Returns the minute (0 <= offset < interval) from which a server's
+    action with that interval recurs; stable across restarts"""
+    from zlib import crc32
+    return (crc32(server_name) & 0xffffffff) % interval
+
+def plan_day(schedules, io_budget=None, window=15):
+    """Returns the actions of a day as planned tuples sorted by minute
+    since midnight, from schedules {server_name: {action: interval}}.
+
+    An action recurs every interval minutes from the server's
+    stagger_offset.  An interval of 0 means daily, as at midnight in
+    earlier releases, and so does any interval longer than a day, since
+    the plan only spans one; negative intervals are skipped.  With
+    io_budget, at most that many backups and archives start within each
+    window of minutes; the rest are deferred to the next window with
+    room (the last window of the day takes any overflow).  nominal is
+    the minute before deferral.
+    """
+    nominal = []
+    for server_name, intervals in schedules.iteritems():
+        for action, interval in intervals.iteritems():
+            if action not in ACTIONS or interval < 0:
+                continue
+            interval = min(interval or MINUTES_PER_DAY, MINUTES_PER_DAY)
+            for minute in xrange(stagger_offset(server_name, interval), MINUTES_PER_DAY, interval):
+                nominal.append((minute, ACTIONS.index(action), server_name, action))
+    nominal.sort()
+
+    last_window = (MINUTES_PER_DAY - 1) // window
+    load = {}
+    plan = []
+    for minute, order, server_name, action in nominal:
+        start = minute
+        if io_budget and action in IO_ACTIONS:
+            w = minute // window
+            while w < last_window and load.get(w, 0) >= io_budget:
+                w += 1
+            load[w] = load.get(w, 0) + 1
+            start = max(minute, w * window)
+        plan.append(planned(start, minute, action, server_name))
+
+    plan.sort(key=lambda p: (p.minute, ACTIONS.index(p.action), p.server_name))
+    return plan
+
+def upcoming(plan, now=None, hours=24, window=15):
+    """Returns the next `hours` (at most 24) of a daily plan as
+    {'jobs': [...], 'load': [...]}: every job with its start time and
+    minutes deferred, and the number of backups and archives starting
+    in each window of minutes."""
+    from datetime import datetime, timedelta
+    from time import mktime, time
+
+    now = time() if now is None else now
+    end = now + min(hours, 24) * 3600
+    today = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    #local midnights, so that days across a daylight saving change still line up
+    midnights = [mktime((today + timedelta(days=d)).timetuple()) for d in (0, 1)]
+
+    jobs = []
+    load = {}
+    for midnight in midnights:
+        for p in plan:
+            start = midnight + p.minute * 60
+            if not now - 60 < start < end:
+                continue
+            jobs.append({
+                'time': start,
+                'server_name': p.server_name,
+                'action': p.action,
+                'deferred': p.minute - p.nominal,
+                })
+            if p.action in IO_ACTIONS:
+                window_start = start - (p.minute % window) * 60
+                load[window_start] = load.get(window_start, 0) + 1
+
+    jobs.sort(key=lambda j: j['time'])
+    return {
+        'jobs': jobs,
+        'load': [{'start': k, 'io_jobs': v} for k, v in sorted(load.iteritems())],
+        }
+
+class job(object):
+    """A unit of scheduled work on a single server (server_name None
+    for host-wide work), submitted by user if on someone's behalf"""
+    FIELDS = ('id', 'server_name', 'action', 'kind', 'user', 'state', 'queued',
+              'started', 'finished', 'returncode', 'output', 'error',
+              'read_bytes', 'write_bytes')
+
+    def __init__(self, job_id, server_name, action, fn, kind, user=None):
+        from time import time
+
+        self.id = job_id
+        self.server_name = server_name
+        self.action = action
+        self.kind = kind
+        self.user = user
+        self.fn = fn
+        self.state = 'queued'
+        self.queued = time()
+        self.started = None
+        self.finished = None
+        self.returncode = None
+        self.output = None
+        self.error = None
+        self.read_bytes = 0
+        self.write_bytes = 0
+
+    def as_dict(self):
+        return dict((k, getattr(self, k)) for k in self.FIELDS)
+
+    @classmethod
+    def from_dict(cls, record):
+        restored = cls(record['id'], record.get('server_name'), record.get('action'),
+                       None, record.get('kind'), record.get('user'))
+        for k in cls.FIELDS:
+            if k in record:
+                setattr(restored, k, record[k])
+        return restored
+
+class scheduler(object):
+    """Per-server job queues drained by up to `workers` threads, of
+    which at most `cpu_jobs` run 'cpu' jobs and `io_jobs` run 'io' jobs.
+    The most recent `history` finished jobs are kept for status().
+
+    With a record_directory, every job is also kept there as <id>.json,
+    so finished jobs outlive a restart; jobs that were queued or running
+    when the previous process ended are marked 'interrupted'.  Records
+    are copied while _lock is held and written after it is released.
+
+    start() and stop() are suitable for cherrypy.engine start/stop
+    subscriptions; stop() cancels queued jobs and lets running ones end.
+    """
+    def __init__(self, workers=4, cpu_jobs=2, io_jobs=2, history=100, record_directory=None):
+        self.limits = {
+            'workers': max(1, int(workers)),
+            'cpu': max(1, int(cpu_jobs)),
+            'io': max(1, int(io_jobs)),
+            }
+        self.record_directory = record_directory
+        self._queues = {}   #server_name -> deque of queued jobs
+        self._running = {}  #server_name -> running job
+        self._finished = deque(maxlen=history)
+        self._lock = Lock()
+        self._changed = Condition(self._lock)
+        self._records = {}  #job id -> record to write, or None to remove
+        self._record_lock = Lock()
+        self._stopped = False
+        self._ids = count(self._load_records() + 1)
+        self._flush()
+
+    def _record_path(self, job_id):
+        return os.path.join(self.record_directory, '%d.json' % job_id)
+
+    def _load_records(self):
+        """Restores finished jobs from record_directory, marking those
+        cut short by a restart as interrupted and removing records
+        beyond history.  Returns the highest job id seen."""
+        import json
+        from time import time
+
+        if not self.record_directory:
+            return 0
+
+        try:
+            names = os.listdir(self.record_directory)
+        except OSError:
+            return 0
+
+        records = []
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.record_directory, name), 'rb') as fh:
+                    records.append(job.from_dict(json.load(fh)))
+            except (IOError, ValueError, KeyError, TypeError):
+                continue
+
+        records.sort(key=lambda j: j.id)
+        keep = len(records) - self._finished.maxlen
+        for i, record in enumerate(records):
+            if i < keep:
+                self._forget(record)
+                continue
+
+            if record.state in ('queued', 'running'):
+                record.state = 'interrupted'
+                record.finished = time()
+                self._save(record)
+            self._finished.append(record)
+
+        return records[-1].id if records else 0
+
+    def _save(self, saved_job):
+        """Copies a job's record for the next _flush(); called with _lock held"""
+        if self.record_directory:
+            self._records[saved_job.id] = saved_job.as_dict()
+
+    def _forget(self, forgotten):
+        """Marks the record of a job pushed out of the history for
+        removal by the next _flush(); called with _lock held"""
+        if self.record_directory:
+            self._records[forgotten.id] = None
+
+    def _flush(self):
+        """Writes (atomically) or removes the records copied since the
+        last flush; called without _lock.  Records are best effort.
+        While another thread is flushing, returns at once: that thread
+        keeps flushing until nothing is left, so a job's newer record
+        always lands after an older one."""
+        import json
+        from tempfile import NamedTemporaryFile
+
+        while self._record_lock.acquire(False):
+            try:
+                with self._lock:
+                    records, self._records = self._records, {}
+
+                for job_id, record in sorted(records.iteritems()):
+                    try:
+                        if record is None:
+                            os.remove(self._record_path(job_id))
+                            continue
+
+                        if not os.path.isdir(self.record_directory):
+                            os.makedirs(self.record_directory)
+                        with NamedTemporaryFile('wb', dir=self.record_directory, suffix='.tmp',
+                                                delete=False) as fh:
+                            try:
+                                json.dump(record, fh)
+                            except (TypeError, ValueError):
+                                record['output'] = repr(record['output'])
+                                fh.seek(0)
+                                fh.truncate()
+                                json.dump(record, fh)
+                        os.rename(fh.name, self._record_path(job_id))
+                    except (IOError, OSError):
+                        pass
+            finally:
+                self._record_lock.release()
+
+            with self._lock:
+                if not self._records:
+                    return
+
+    def _retire(self, retired):
+        """Moves a job into the history; called with _lock held"""
+        if len(self._finished) == self._finished.maxlen:
+            self._forget(self._finished[0])
+        self._finished.append(retired)
+        self._save(retired)
+
+    def submit(self, server_name, action, fn, kind='io', user=None):
+        """Queues fn() to run after every job already queued for
+        server_name.  Returns the job, or None if the same action is
+        already queued or running for the server (so overlapping ticks
+        never stack up duplicate work)."""
+        if kind not in ('cpu', 'io'):
+            raise ValueError("job kind must be 'cpu' or 'io', not %r" % kind)
+
+        with self._lock:
+            if self._stopped:
+                return None
+
+            pending = list(self._queues.get(server_name, ()))
+            if server_name in self._running:
+                pending.append(self._running[server_name])
+            if any(j.action == action for j in pending):
+                return None
+
+            new_job = job(next(self._ids), server_name, action, fn, kind, user)
+            self._queues.setdefault(server_name, deque()).append(new_job)
+            self._save(new_job)
+            self._dispatch()
+
+        self._flush()
+        return new_job
+
+    def _dispatch(self):
+        """Starts queued jobs, oldest first, as limits allow; called with _lock held"""
+        if self._stopped:
+            return
+
+        running_kinds = [j.kind for j in self._running.itervalues()]
+        for server_name in sorted(self._queues, key=lambda s: self._queues[s][0].id):
+            if len(self._running) >= self.limits['workers']:
+                break
+            elif server_name in self._running:
+                continue
+
+            queue = self._queues[server_name]
+            if running_kinds.count(queue[0].kind) >= self.limits[queue[0].kind]:
+                continue
+
+            next_job = queue.popleft()
+            if not queue:
+                del self._queues[server_name]
+            self._start(next_job)
+            running_kinds.append(next_job.kind)
+
+    def _start(self, next_job):
+        from time import time
+
+        next_job.state = 'running'
+        next_job.started = time()
+        self._running[next_job.server_name] = next_job
+        self._save(next_job)
+
+        thread = Thread(target=self._run,
+                        args=(next_job,),
+                        name='scheduler-%s-%s' % (next_job.server_name, next_job.action))
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, running_job):
+        from subprocess import CalledProcessError
+        from time import time
+
+        _context.job = running_job
+        try:
+            running_job.output = running_job.fn()
+        except CalledProcessError as e:
+            running_job.state = 'failed'
+            running_job.returncode = e.returncode
+            running_job.output = e.output
+            running_job.error = '%s: %s' % (type(e).__name__, e)
+        except Exception as e:
+            running_job.state = 'failed'
+            running_job.error = '%s: %s' % (type(e).__name__, e)
+        else:
+            running_job.state = 'finished'
+            running_job.returncode = 0
+        finally:
+            _context.job = None
+            with self._lock:
+                running_job.finished = time()
+                running_job.fn = None
+                del self._running[running_job.server_name]
+                self._retire(running_job)
+                self._dispatch()
+            self._flush()
+            with self._lock:
+                self._changed.notify_all()
+
+    def wait(self, timeout=None):
+        """Blocks until no job is queued or running; returns False if
+        timeout elapsed first"""
+        from time import time
+
+        deadline = None if timeout is None else time() + timeout
+        with self._lock:
+            while self._queues or self._running:
+                if deadline is None:
+                    self._changed.wait()
+                else:
+                    remaining = deadline - time()
+                    if remaining <= 0:
+                        return False
+                    self._changed.wait(remaining)
+            return True
+
+    def start(self):
+        with self._lock:
+            self._stopped = False
+            self._dispatch()
+        self._flush()
+
+    def stop(self):
+        from time import time
+
+        with self._lock:
+            self._stopped = True
+            for queue in self._queues.itervalues():
+                for cancelled in queue:
+                    cancelled.state = 'cancelled'
+                    cancelled.finished = time()
+                    cancelled.fn = None
+                    self._retire(cancelled)
+            self._queues.clear()
+            self._changed.notify_all()
+        self._flush()
+
+    def get(self, job_id):
+        """Returns the record of a queued, running or remembered job, or None"""
+        with self._lock:
+            for candidate in self._jobs():
+                if candidate.id == job_id:
+                    return candidate.as_dict()
+        return None
+
+    def _jobs(self):
+        for queue in self._queues.itervalues():
+            for queued in queue:
+                yield queued
+        for running in self._running.itervalues():
+            yield running
+        for finished in self._finished:
+            yield finished
+
+    def status(self, server_names=None, user=None):
+        """Returns the queued, running and recently finished jobs, of
+        every server or only of server_names (plus those submitted by
+        user), with the limits in effect"""
+        with self._lock:
+            def jobs(iterable):
+                return [j.as_dict() for j in iterable
+                        if server_names is None or j.server_name in server_names or
+                           (user is not None and j.user == user)]
+
+            queued = sorted((j for q in self._queues.itervalues() for j in q), key=lambda j: j.id)
+            return {
+                'queued': jobs(queued),
+                'running': jobs(sorted(self._running.itervalues(), key=lambda j: j.id)),
+                'finished': jobs(reversed(self._finished)),
+                'limits': dict(self.limits),
+                }
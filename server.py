@@ -13,83 +13,106 @@ import os
 from mineos import mc
 
 class cron(cherrypy.process.plugins.SimplePlugin):
-    def __init__(self, base_directory, commit_delay):
+    ACTION_KINDS = {
+        'restart': 'cpu',
+        'backup': 'io',
+        'archive': 'cpu'
+        }
+
+    def __init__(self, base_directory, commit_delay, job_scheduler=None):
+        from scheduler import scheduler
+
         self.base_directory = base_directory
         try:
             self.commit_delay = int(commit_delay)
         except (ValueError, TypeError):
             self.commit_delay = 10
+        self.scheduler = job_scheduler or scheduler()
         
     def check_interval(self):
+        """Queues the actions due this minute; the scheduler runs them
+        concurrently across servers and in order within each server.
+        A backup or archive due with a restart is taken while the
+        server is down, between the stop and the start."""
+        from functools import partial
+
+        mc.PROCESS_SNAPSHOT.invalidate()
+        msm = mc.minutes_since_midnight()
+
+        due = [p for p in mc._plan_day(self.base_directory) if p.minute == msm]
+        restarting = set(p.server_name for p in due if p.action == 'restart')
+
+        for planned in due:
+            server, action = planned.server_name, planned.action
+            between = ()
+            if action == 'restart':
+                between = tuple(p.action for p in due if p.server_name == server and p.action != 'restart')
+            elif server in restarting:
+                continue
+
+            kinds = [self.ACTION_KINDS[a] for a in (action,) + between]
+            queued = self.scheduler.submit(server,
+                                           action,
+                                           partial(self.act, action, server, between),
+                                           'io' if 'io' in kinds else kinds[0])
+            if queued is None:
+                cherrypy.log('[%s] %s still pending from an earlier tick; not queued again' % (server, action))
+            elif planned.minute != planned.nominal:
+                cherrypy.log('[%s] %s deferred %s minutes by the IO budget' % (server, action, planned.minute - planned.nominal))
+
+    def act(self, action, server, between=()):
+        """Performs action on a server.  backup and archive save the
+        world themselves and wait for the log to confirm it; a restart
+        waits for the server to stop, performs the actions in between
+        and then starts it again."""
+        from log_watcher import STOPPING
         from procfs_reader import path_owner
         from time import sleep
         from subprocess import CalledProcessError
-        
-        crons = []
-        
-        for action in ('restart','backup','archive'):
-            for server in mc.list_servers_to_act(action, self.base_directory):
-                crons.append( (action, server) )
 
-        for server in set(s for a,s in crons):
-            path_ = os.path.join(self.base_directory, mc.DEFAULT_PATHS['servers'], server)
-            instance = mc(server, path_owner(path_), self.base_directory)
+        path_ = os.path.join(self.base_directory, mc.DEFAULT_PATHS['servers'], server)
+        instance = mc(server, path_owner(path_), self.base_directory)
 
-            cherrypy.log('[%s] commit' % server)
+        if action == 'restart':
+            cherrypy.log('[%s] stop' % server)
             try:
-                instance._command_stuff('save-off')
-                instance.commit()
-            except RuntimeError:
+                waited = instance._stuff_and_wait('stop', STOPPING)
+            except (RuntimeError, TypeError):
                 pass
             else:
-                cherrypy.log('[%s] commit command received by process; sleeping %ssec' % (server, self.commit_delay))
-                sleep(self.commit_delay)
-
-        for action, server in crons:
-            path_ = os.path.join(self.base_directory, mc.DEFAULT_PATHS['servers'], server)
-            instance = mc(server, path_owner(path_), self.base_directory)
-
-            if action == 'restart':
-                cherrypy.log('[%s] stop' % server)
-                try:
-                    instance._command_stuff('stop')
-                except RuntimeError:
-                    pass
-                else:
-                    cherrypy.log('[%s] stop command received by process; sleeping %ssec' % (server, self.commit_delay))
+                if waited is None:
+                    cherrypy.log('[%s] stop not confirmed by log; sleeping %ssec' % (server, self.commit_delay))
                     sleep(self.commit_delay)
-            elif action in ('backup', 'archive'):
-                cherrypy.log('[%s] %s (Server Up: %s)' % (server, action, instance.up))
-                try:
-                    getattr(instance, action)()
-                except CalledProcessError as e:
-                    cherrypy.log('[%s] %s exception: returncode %s' % (server, action, e.returncode))
-                    cherrypy.log(e.output)
-                except RuntimeError:
-                    cherrypy.log('[%s] %s exception: server state changed since beginning of %s.' % (server, action, action))
-                    cherrypy.log('[%s] %s (Server Up: %s)' % (server, action, instance.up))
-                    cherrypy.log('You may need to increase mineos.conf => server.commit_delay')
                 else:
-                    cherrypy.log('[%s] %s return code reports success; sleeping 3sec' % (server, action))
-                    sleep(3)
-                
-        for action, server in crons:
-            path_ = os.path.join(self.base_directory, mc.DEFAULT_PATHS['servers'], server)
-            instance = mc(server, path_owner(path_), self.base_directory)
-            
-            if action == 'restart':
-                if instance.up:
-                    cherrypy.log('[%s] extra delay; sleeping %s seconds' % (server, self.commit_delay))
-                    sleep(self.commit_delay)
+                    cherrypy.log('[%s] stop confirmed by log after %.1fsec' % (server, waited))
+                if not instance._wait_until_down():
+                    cherrypy.log('[%s] still up %ssec after stop' % (server, mc.SAVE_TIMEOUT))
 
+            try:
+                for other in between:
+                    self.act(other, server)
+            finally:
                 cherrypy.log('[%s] start' % server)
                 try:
                     instance.start()
                 except RuntimeError:
                     pass
                 else:
-                    cherrypy.log('[%s] started; sleeping %s seconds' % (server, self.commit_delay))
-                    sleep(self.commit_delay)
+                    cherrypy.log('[%s] started' % server)
+        elif action in ('backup', 'archive'):
+            cherrypy.log('[%s] %s (Server Up: %s)' % (server, action, instance.up))
+            try:
+                getattr(instance, action)()
+            except CalledProcessError as e:
+                cherrypy.log('[%s] %s exception: returncode %s' % (server, action, e.returncode))
+                cherrypy.log(e.output)
+                raise
+            except RuntimeError:
+                cherrypy.log('[%s] %s exception: server state changed since beginning of %s.' % (server, action, action))
+                cherrypy.log('[%s] %s (Server Up: %s)' % (server, action, instance.up))
+                raise
+            else:
+                cherrypy.log('[%s] %s return code reports success' % (server, action))
 
 def tally():
     import platform, urllib2, urllib
@@ -249,15 +272,111 @@ if __name__ == "__main__":
         }
 
     try:
-        cron_instance = cron(base_dir, cherrypy.config['server.commit_delay'])
+        mc.PROCESS_SNAPSHOT.ttl = float(cherrypy.config['misc.process_snapshot_ttl'])
+    except (KeyError, ValueError, TypeError):
+        pass
+
+    try:
+        mc.SAVE_TIMEOUT = float(cherrypy.config['misc.save_timeout'])
+    except (KeyError, ValueError, TypeError):
+        pass
+
+    for option in ('IO_BUDGET', 'IO_WINDOW'):
+        try:
+            setattr(mc, option, max(1, int(cherrypy.config['misc.%s' % option.lower()])))
+        except (KeyError, ValueError, TypeError):
+            pass
+
+    try:
+        mc.IONICE_CLASS = cherrypy.config['misc.ionice_class']
+        if mc.IONICE_CLASS is not None:
+            mc.IONICE_CLASS = int(mc.IONICE_CLASS)
+        mc.IONICE_LEVEL = min(7, max(0, int(cherrypy.config['misc.ionice_level'])))
+    except (KeyError, ValueError, TypeError):
+        pass
+
+    try:
+        mc.ARCHIVE_THREADS = max(0, int(cherrypy.config['misc.archive_threads']))
+    except (KeyError, ValueError, TypeError):
+        pass
+
+    try:
+        from scheduler import io_slots
+        mc.IO_SLOTS = io_slots(max(1, int(cherrypy.config['misc.io_slots'])))
+    except (KeyError, ValueError, TypeError):
+        pass
+
+    import nss_cache
+
+    try:
+        nss_cache.TTL = float(cherrypy.config['misc.nss_cache_ttl'])
+    except (KeyError, ValueError, TypeError):
+        pass
+
+    import scheduler
+
+    scheduler_limits = {}
+    for option in ('workers', 'cpu_jobs', 'io_jobs'):
+        try:
+            scheduler_limits[option] = int(cherrypy.config['misc.scheduler_%s' % option])
+        except (KeyError, ValueError, TypeError):
+            pass
+
+    scheduler_instance = scheduler.scheduler(record_directory=os.path.join(base_dir, mc.DEFAULT_PATHS['jobs']),
+                                             **scheduler_limits)
+    cherrypy.engine.subscribe('start', scheduler_instance.start)
+    cherrypy.engine.subscribe('stop', scheduler_instance.stop)
+
+    try:
+        cron_instance = cron(base_dir, cherrypy.config['server.commit_delay'], scheduler_instance)
     except KeyError:
-        cron_instance = cron(base_dir, 10)
+        cron_instance = cron(base_dir, 10, scheduler_instance)
     finally:
         minute_crontab = cherrypy.process.plugins.Monitor(cherrypy.engine,
                                                           cron_instance.check_interval,
                                                           60)
         minute_crontab.subscribe()
 
+    import metrics
+
+    try:
+        sample_interval = int(cherrypy.config['misc.sample_interval'])
+    except (KeyError, ValueError, TypeError):
+        sample_interval = 5
+    finally:
+        sampler_instance = metrics.resource_sampler(base_dir,
+                                                    sample_interval,
+                                                    archive_directory=os.path.join(base_dir,
+                                                                                   mc.DEFAULT_PATHS['metrics']))
+        resource_sampler = cherrypy.process.plugins.Monitor(cherrypy.engine,
+                                                            sampler_instance.sample,
+                                                            sample_interval)
+        resource_sampler.subscribe()
+
+    import status_collector
+
+    try:
+        status_interval = int(cherrypy.config['misc.status_interval'])
+    except (KeyError, ValueError, TypeError):
+        status_interval = 5
+    finally:
+        collector_instance = status_collector.status_collector(base_dir,
+                                                               status_interval,
+                                                               sampler=sampler_instance)
+        status_collector_monitor = cherrypy.process.plugins.Monitor(cherrypy.engine,
+                                                                    collector_instance.collect,
+                                                                    status_interval)
+        status_collector_monitor.subscribe()
+
+    import fs_watcher, conf_reader
+
+    watcher_instance = fs_watcher.fs_watcher(base_dir)
+    fs_watcher.subscribe(conf_reader.invalidate)
+    fs_watcher.subscribe(mc._server_registry(base_dir).invalidate)
+    #start after the daemonizer has forked, alongside the Monitors
+    cherrypy.engine.subscribe('start', watcher_instance.start, priority=70)
+    cherrypy.engine.subscribe('stop', watcher_instance.stop)
+
     import mounts, auth
 
     try:
@@ -270,8 +389,10 @@ if __name__ == "__main__":
     except (KeyError, TypeError, AttributeError):
         cherrypy.config['misc.localization'] = 'en'
 
-    cherrypy.tree.mount(mounts.Root(), "/", config=root_conf)
-    cherrypy.tree.mount(mounts.ViewModel(), "/vm", config=empty_conf)
+    cherrypy.tree.mount(mounts.Root(scheduler=scheduler_instance), "/", config=root_conf)
+    cherrypy.tree.mount(mounts.ViewModel(sampler=sampler_instance,
+                                        collector=collector_instance,
+                                        scheduler=scheduler_instance), "/vm", config=empty_conf)
     cherrypy.tree.mount(auth.AuthController(), '/auth', config=empty_conf)
     cherrypy.engine.start()
     cherrypy.engine.block()
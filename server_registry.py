@@ -0,0 +1,124 @@
+"""
+    In-memory index of the servers under a base_directory: which names
+    exist in servers/ or backup/ and who owns each directory.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import os
+from collections import namedtuple
+from stat import S_ISDIR
+from threading import RLock
+
+ownership = namedtuple('ownership', 'path uid gid owner group')
+
+class server_registry(object):
+    """Set of server names with the ownership of every server directory,
+    read in a single pass over the trees (servers/ before backup/).
+
+    Each lookup costs one stat per tree: the index is rebuilt only when
+    a tree's inode or mtime changed, or after invalidate().  A tree
+    modified within a second of the last scan is rescanned on the next
+    lookup, since a coarse mtime could hide a later change.  A chown of
+    a server directory leaves its tree's mtime alone; it reaches the
+    index through invalidate(), from mc.chown/chgrp or the fs_watcher.
+    """
+    def __init__(self, base_directory, trees=('servers', 'backup')):
+        self.base_directory = os.path.normpath(base_directory)
+        self.trees = [os.path.join(self.base_directory, t) for t in trees]
+        self.scans = 0
+        self._entries = {}
+        self._signature = None
+        self._racy = True
+        self._lock = RLock()
+
+    def _stat_trees(self):
+        signature = []
+        for tree in self.trees:
+            try:
+                st = os.stat(tree)
+                signature.append((st.st_ino, st.st_mtime))
+            except OSError:
+                signature.append(None)
+        return tuple(signature)
+
+    def invalidate(self, path=None):
+        """Forces a rescan on the next lookup.  With path, only if path
+        is one of the trees or inside them (suitable as an fs_watcher
+        subscriber)."""
+        if path is None or any(os.path.normpath(path) == tree or
+                               os.path.normpath(path).startswith(tree + os.sep)
+                               for tree in self.trees):
+            with self._lock:
+                self._racy = True
+
+    def refresh(self):
+        """Rebuilds the index if any tree changed since the last scan"""
+        from nss_cache import getpwuid, getgrgid
+        from time import time
+
+        with self._lock:
+            signature = self._stat_trees()
+            if signature == self._signature and not self._racy:
+                return
+
+            started = time()
+            users, groups = {}, {}
+            entries = {}
+            for tree in self.trees:
+                try:
+                    names = os.listdir(tree)
+                except OSError:
+                    continue
+
+                for name in names:
+                    path = os.path.join(tree, name)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    if not S_ISDIR(st.st_mode):
+                        continue
+
+                    if st.st_uid not in users:
+                        try:
+                            users[st.st_uid] = getpwuid(st.st_uid).pw_name
+                        except KeyError:
+                            users[st.st_uid] = None
+                    if st.st_gid not in groups:
+                        try:
+                            groups[st.st_gid] = getgrgid(st.st_gid).gr_name
+                        except KeyError:
+                            groups[st.st_gid] = None
+
+                    entries.setdefault(name, []).append(
+                        ownership(path, st.st_uid, st.st_gid, users[st.st_uid], groups[st.st_gid]))
+
+            self._entries = dict((k, tuple(v)) for k, v in entries.iteritems())
+            self._signature = signature
+            self._racy = any(s is not None and s[1] >= started - 1 for s in signature)
+            self.scans += 1
+
+    def __contains__(self, server_name):
+        self.refresh()
+        return server_name in self._entries
+
+    def names(self):
+        """Returns the names of every server"""
+        self.refresh()
+        return self._entries.keys()
+
+    def ownership(self, server_name):
+        """Returns the ownership of each directory of server_name,
+        servers/ first, or () if it does not exist"""
+        self.refresh()
+        return self._entries.get(server_name, ())
+
+    def owners(self):
+        """Returns {server_name: ownerships} of every server, as
+        ownership() would, from the same pass as the listing"""
+        self.refresh()
+        return dict(self._entries)
@@ -0,0 +1,180 @@
+"""
+    Background collection of every server's status into a shared
+    snapshot, so that web clients polling status read a cached copy
+    instead of each scanning procfs, parsing configs and pinging.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import os
+from threading import Lock
+
+def server_status(instances, sampler=None, ping_timeout=2.5):
+    """Returns {server_name: status dict} for mc instances or
+    server_summary records (see mc._server_summaries), pinging all
+    of them concurrently and including the full query ('query') of those
+    with enable-query.  Every status carries 'timestamps', the time
+    each field was read, so clients can judge its staleness.
+    Instances whose ping cannot be built are omitted.
+    """
+    from mineos import mc
+    from time import time
+
+    instances = [mc._summary_of(i) for i in instances]
+    read = time()
+    pings = mc.ping_many(instances, ping_timeout)
+    pinged = time()
+    queries = mc.query_many(instances)
+    queried = time()
+
+    statuses = {}
+    for instance in instances:
+        i = instance.server_name
+        try:
+            ping = pings[i]
+        except KeyError:
+            continue
+
+        srv = {
+            'server_name': i,
+            'profile': instance.profile,
+            'up': instance.up,
+            'ip_address': instance.ip_address,
+            'port': instance.port,
+            'java_xmx': instance.java_xmx,
+            'eula': instance.eula
+            }
+        timestamps = dict.fromkeys(srv, read)
+
+        rss = sampler.latest(i, 'rss') if sampler else None
+        if rss is not None:
+            srv['memory'] = '%s MB' % (rss / 1048576.0)
+            timestamps['memory'] = sampler.latest(i, 'timestamp')
+        else:
+            srv['memory'] = instance.memory
+            timestamps['memory'] = time()
+
+        srv.update(dict(ping._asdict()))
+        timestamps.update(dict.fromkeys(ping._fields, pinged))
+
+        srv['query'] = queries.get(i)
+        timestamps['query'] = queried
+
+        srv['timestamps'] = timestamps
+        statuses[i] = srv
+
+    return statuses
+
+class status_collector(object):
+    """Refreshes the status of every server in base_directory, and the
+    host figures shown on the dashboard, into one shared snapshot.
+
+    Intended to be driven by a cherrypy Monitor every `interval`
+    seconds; readers never trigger collection except to fill a snapshot
+    that has not yet been collected.  Players online and ping latency
+    of running servers are recorded to the sampler's archives.
+    """
+    def __init__(self, base_directory, interval=5, sampler=None, ping_timeout=2.5):
+        self.base_directory = base_directory
+        self.interval = interval
+        self.sampler = sampler
+        self.ping_timeout = ping_timeout
+        self.collected = None
+        self._servers = {}
+        self._host = {}
+        self._git_hash = None
+        self._lock = Lock()
+        self._collecting = Lock()
+
+    def collect(self):
+        """Rebuilds the snapshot of all servers and the host"""
+        with self._collecting:
+            self._collect()
+
+    def _collect(self):
+        from mineos import mc
+        from time import time
+
+        started = time()
+        summaries = mc._server_summaries(self.base_directory).values()
+        servers = server_status(summaries, self.sampler, self.ping_timeout)
+        host = self._collect_host()
+
+        if self.sampler:
+            for i, srv in servers.iteritems():
+                if srv['up']:
+                    try:
+                        players = int(srv['players_online'])
+                    except (TypeError, ValueError):
+                        players = None
+                    self.sampler.record(i, srv['timestamps']['players_online'],
+                                        players=players, ping=srv['latency'])
+
+        with self._lock:
+            self._servers = servers
+            self._host = host
+            self.collected = started
+
+    def _collect_host(self):
+        from procfs_reader import entries, proc_uptime, disk_free, git_hash
+        from time import time
+
+        if self._git_hash is None:
+            self._git_hash = git_hash(os.path.dirname(os.path.abspath(__file__)))
+
+        now = time()
+        kb_free = dict(entries('', 'meminfo'))['MemFree']
+
+        host = {
+            'uptime': proc_uptime()[0],
+            'memfree': str(round(float(kb_free.split()[0])/1000, 2)),
+            'df': dict(disk_free(self.base_directory)._asdict()),
+            'git_hash': self._git_hash,
+            }
+        host['timestamps'] = dict.fromkeys(host, now)
+        return host
+
+    def _ensure_collected(self):
+        if self.collected is None:
+            with self._collecting:
+                if self.collected is None:
+                    self._collect()
+
+    def servers(self, server_names=None):
+        """Returns the status of every server, or only of server_names,
+        from the latest snapshot, sorted by server name."""
+        from copy import deepcopy
+
+        self._ensure_collected()
+        with self._lock:
+            names = sorted(self._servers if server_names is None else server_names)
+            return [deepcopy(self._servers[i]) for i in names if i in self._servers]
+
+    def host(self):
+        """Returns the host figures from the latest snapshot; uptime is
+        advanced to the time of the call."""
+        from copy import deepcopy
+        from time import time
+
+        self._ensure_collected()
+        with self._lock:
+            host = deepcopy(self._host)
+        host['uptime'] = int(host['uptime'] + time() - host['timestamps']['uptime'])
+        return host
+
+    @property
+    def stats(self):
+        """Returns the collection interval, time of the latest snapshot
+        and how many servers it holds"""
+        from time import time
+
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'collected': self.collected,
+                'age': None if self.collected is None else time() - self.collected,
+                'servers': len(self._servers),
+                }
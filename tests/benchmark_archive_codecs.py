@@ -0,0 +1,104 @@
+#!/usr/bin/env python2.7
+"""Times mc.archive with every available archive codec on a synthetic
+world of region files, reporting throughput and compression ratio.
+
+A dedup archive is measured by its manifest plus the chunk store.
+
+Region files are built like the real thing: an 8 KiB header of chunk
+locations and timestamps, then zlib-compressed chunk payloads padded to
+4 KiB sectors, so most of the input is already compressed.
+
+usage: python tests/benchmark_archive_codecs.py [regions]
+"""
+
+import os
+import random
+import struct
+import sys
+import tempfile
+import zlib
+from distutils.spawn import find_executable
+from getpass import getuser
+from shutil import rmtree
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mineos import mc
+
+SECTOR = 4096
+
+def chunk_payload(rng):
+    """Returns a zlib-compressed stand-in for a chunk's NBT: mostly
+    repeated block ids with some noise, like terrain"""
+    blocks = bytearray(rng.choice((0, 0, 0, 1, 1, 3, 7, 12, 13)) for i in range(16 * 16 * 64))
+    names = ''.join('Section%dBlocksDataSkyLightBlockLight' % y for y in range(16))
+    return zlib.compress(names + str(blocks), 6)
+
+def build_region(path, rng, chunks=1024):
+    locations = []
+    body = []
+    sector = 2
+    for i in range(chunks):
+        payload = chunk_payload(rng)
+        data = struct.pack('>IB', len(payload) + 1, 2) + payload
+        count = (len(data) + SECTOR - 1) // SECTOR
+        body.append(data + '\x00' * (count * SECTOR - len(data)))
+        locations.append(struct.pack('>I', (sector << 8) | count))
+        sector += count
+
+    with open(path, 'wb') as fh:
+        fh.write(''.join(locations))
+        fh.write(struct.pack('>1024I', *([1400000000] * 1024)))
+        fh.write(''.join(body))
+
+def build_world(base, regions):
+    instance = mc('benchmark', getuser(), base)
+    instance.create()
+
+    rng = random.Random(0)
+    region_dir = os.path.join(instance.env['cwd'], 'world', 'region')
+    os.makedirs(region_dir)
+    for i in range(regions):
+        build_region(os.path.join(region_dir, 'r.%d.%d.mca' % (i % 4, i // 4)), rng)
+    return instance
+
+def world_size(path):
+    return sum(os.path.getsize(os.path.join(root, f))
+               for root, dirs, files in os.walk(path) for f in files)
+
+def available(codec):
+    program = mc.ARCHIVE_CODECS[codec].program
+    return program is None or find_executable(program)
+
+if __name__ == '__main__':
+    regions = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+
+    base = tempfile.mkdtemp(prefix='archive_codecs_')
+    try:
+        instance = build_world(base, regions)
+        size = world_size(instance.env['cwd'])
+        print '%d region files, %.1f MiB' % (regions, size / 1048576.0)
+
+        for codec in sorted(mc.ARCHIVE_CODECS):
+            if not available(codec):
+                print '%-6s (not installed)' % codec
+                continue
+
+            instance.modify_config('archive_codec', codec, 'crontabs')
+            start = default_timer()
+            instance.archive()
+            elapsed = default_timer() - start
+
+            archive = max(instance.list_archives(), key=lambda a: a.timestamp)
+            stored = archive.size
+            if codec == 'dedup':
+                stored += world_size(instance.env['store'])
+            print '%-6s %8.2fs %8.1f MiB/s  ratio %.3f  %s' % (codec,
+                                                              elapsed,
+                                                              size / 1048576.0 / elapsed,
+                                                              stored / float(size),
+                                                              archive.filename)
+            os.remove(os.path.join(archive.path, archive.filename))
+    finally:
+        rmtree(base)
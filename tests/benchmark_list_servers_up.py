@@ -0,0 +1,129 @@
+#!/usr/bin/env python2.7
+"""Compares the original per-server cmdline rescan in list_servers_up
+against the single-pass ppid indexer, using a synthetic procfs tree.
+
+usage: python tests/benchmark_list_servers_up.py [processes] [servers]
+"""
+
+import os
+import sys
+import re
+import random
+import tempfile
+from shutil import rmtree
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mineos import mc
+from procfs_reader import pid_snapshot
+
+BASE = '/var/games/minecraft'
+
+def build_procfs(root, processes, servers):
+    """Writes cmdline and stat pages for a fake process table.
+    Every server contributes a SCREEN parent and its java child."""
+    def write(pid, ppid, argv):
+        path = os.path.join(root, str(pid))
+        os.mkdir(path)
+        with open(os.path.join(path, 'cmdline'), 'wb') as fh:
+            fh.write('\x00'.join(argv) + '\x00')
+        with open(os.path.join(path, 'stat'), 'wb') as fh:
+            fh.write('%d (%s) S %d %d 0 0\n' % (pid, os.path.basename(argv[0])[:15], ppid, pid))
+
+    with open(os.path.join(root, 'uptime'), 'wb') as fh:
+        fh.write('1.0 1.0\n')
+
+    #scatter server pids across the table as on a long-running host
+    pids = range(100, 100 + processes)
+    random.Random(processes).shuffle(pids)
+
+    for i in range(servers):
+        name = 'server%d' % i
+        screen, java_pid = pids.pop(), pids.pop()
+        jar = os.path.join(BASE, 'servers', name, 'minecraft_server.jar')
+        java = ['/usr/bin/java', '-server', '-Xmx1024M', '-Xms1024M', '-jar', jar, 'nogui']
+        write(screen, 1, ['SCREEN', '-dmS', 'mc-%s' % name] + java)
+        write(java_pid, screen, java)
+
+    for i, pid in enumerate(pids):
+        if i % 10 == 0:
+            write(pid, 1, ['/usr/bin/java', '-jar', '/opt/app%d/app.jar' % i])
+        else:
+            write(pid, 1, ['/bin/bash', '-c', 'sleep %d' % i])
+
+def legacy_list_servers_up(pids):
+    """list_servers_up() as it was before the indexer"""
+    def name_base():
+        for cmdline in pids.itervalues():
+            if 'screen' in cmdline.lower():
+                serv = re.search(r'SCREEN.*?mc-([\w._]+).*?-jar ([\w._/]+)\1', cmdline, re.IGNORECASE)
+                try:
+                    yield (serv.groups()[0], serv.groups()[1])
+                except AttributeError:
+                    continue
+
+    def find_base(directory, match_dir):
+        pair = os.path.split(directory.rstrip('/'))
+        if pair[1] == match_dir:
+            return pair[0]
+        elif not pair[1]:
+            return ''
+        else:
+            return find_base(pair[0], match_dir)
+
+    found = []
+    for name, base in name_base():
+        java = None
+        screen = None
+        for pid, cmdline in pids.iteritems():
+            if '-jar' in cmdline:
+                if 'screen' in cmdline.lower() and 'mc-%s' % name in cmdline:
+                    screen = int(pid)
+                elif '/%s/' % name in cmdline:
+                    java = int(pid)
+                if java and screen:
+                    break
+        found.append((name, java, screen, find_base(base, 'servers')))
+    return found
+
+def timed(fn, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = default_timer()
+        result = fn()
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+if __name__ == '__main__':
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    servers = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    root = tempfile.mkdtemp(prefix='fake_procfs_')
+    try:
+        build_procfs(root, processes, servers)
+
+        scan_time, pids = timed(lambda: pid_snapshot(ttl=60, procfs=root).cmdlines())
+
+        def indexed():
+            snapshot = pid_snapshot(ttl=60, procfs=root)
+            return mc._index_servers_up(pids, snapshot.ppid)
+
+        legacy_time, legacy = timed(lambda: legacy_list_servers_up(pids), repeat=1)
+        indexed_time, index = timed(indexed)
+
+        #legacy substring matching can pair mc-server1 with mc-server10's pids,
+        #so only the discovered names and base directories are compared
+        assert sorted((n, b) for n, j, s, b in legacy) == \
+               sorted((k[len('mc-'):], b) for k, (s, j, b) in index.iteritems())
+        mispaired = sum(1 for n, j, s, b in legacy if index['mc-%s' % n][:2] != (s, j))
+
+        print '%d processes, %d servers' % (processes, servers)
+        print 'procfs cmdline scan:           %8.3fs' % scan_time
+        print 'legacy rescan per server:      %8.3fs' % legacy_time
+        print 'single-pass ppid indexer:      %8.3fs (incl. stat reads)' % indexed_time
+        print 'speedup:                       %8.1fx' % (legacy_time / indexed_time)
+        print 'legacy mispaired servers:      %8d' % mispaired
+    finally:
+        rmtree(root)
@@ -0,0 +1,104 @@
+#!/usr/bin/env python2.7
+"""Times constructing mc instances for many servers, comparing the
+original eager loading (log probe plus server.properties, server.config
+and profile.config parsed in __init__) against lazy loading, and
+reading the fields of the status endpoint through mc instances against
+the bulk mc._server_summaries loader.
+
+usage: python tests/benchmark_mc_init.py [servers]
+"""
+
+import os
+import sys
+import tempfile
+from getpass import getuser
+from shutil import rmtree
+from timeit import default_timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import conf_reader
+from mineos import mc
+
+def build_servers(base, servers):
+    """Writes config files for servers without spawning any processes"""
+    profiles = os.path.join(base, mc.DEFAULT_PATHS['profiles'])
+    os.makedirs(profiles)
+    with open(os.path.join(profiles, 'profile.config'), 'w') as fh:
+        for i in range(20):
+            fh.write('[profile%d]\nrun_as = minecraft_server.jar\nurl = \n'
+                     'save_as = minecraft_server.jar\ntype = standard_jar\n\n' % i)
+
+    for i in range(servers):
+        cwd = os.path.join(base, mc.DEFAULT_PATHS['servers'], 'server%d' % i)
+        os.makedirs(cwd)
+        with open(os.path.join(cwd, 'server.properties'), 'w') as fh:
+            fh.write('server-port=%d\nmax-players=20\nmotd=server %d\nserver-ip=0.0.0.0\n' % (25565 + i, i))
+        with open(os.path.join(cwd, 'server.config'), 'w') as fh:
+            fh.write('[minecraft]\nprofile = profile%d\n\n[java]\njava_xmx = 256\njava_xms = 256\n'
+                     'java_tweaks = \n\n[onreboot]\nstart = false\nrestore = false\n' % (i % 20))
+
+def eager(base, names):
+    """mc() as it was: every construction probed logs and loaded configs"""
+    for name in names:
+        instance = mc(name, getuser(), base)
+        instance._locate_log()
+        instance._load_config(generate_missing=True)
+
+def eager_cold(base, names):
+    conf_reader.invalidate()
+    eager(base, names)
+
+def lazy(base, names):
+    for name in names:
+        instance = mc(name, getuser(), base)
+        instance.env['cwd']
+
+def lazy_port(base, names):
+    for name in names:
+        mc(name, getuser(), base).port
+
+def status_fields(base, names):
+    for name in names:
+        instance = mc(name, getuser(), base)
+        (instance.port, instance.ip_address, instance.server_properties['motd'::''],
+         instance.server_properties['max-players'::''], instance.profile,
+         instance.server_config['java':'java_xmx':''], instance.eula, instance.server_type)
+
+def summaries(base, names):
+    mc._server_summaries(base, names)
+
+def timed(fn, repeat=3):
+    best = None
+    for i in range(repeat):
+        start = default_timer()
+        fn()
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+if __name__ == '__main__':
+    servers = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    base = tempfile.mkdtemp(prefix='mc_init_')
+    try:
+        build_servers(base, servers)
+        names = list(mc.list_servers(base))
+
+        cases = [
+            ('eager, cold parse cache', eager_cold),
+            ('eager, warm parse cache', eager),
+            ('lazy, name and env only', lazy),
+            ('lazy, server.properties', lazy_port),
+            ('mc, status fields', status_fields),
+            ('bulk _server_summaries', summaries),
+            ]
+
+        print '%d instances' % len(names)
+        baseline = None
+        for label, fn in cases:
+            elapsed = timed(lambda: fn(base, names))
+            baseline = baseline or elapsed
+            print '%-26s %8.3fs %7.1fx' % (label, elapsed, baseline / elapsed)
+    finally:
+        rmtree(base)
@@ -0,0 +1,85 @@
+#!/usr/bin/env python2.7
+"""Microbenchmarks of the os.read()-based procfs readers against the
+original quoted-printable implementations, run on the live /proc.
+
+usage: python tests/benchmark_procfs_reader.py [iterations]
+"""
+
+import os
+import sys
+from binascii import b2a_qp
+from timeit import repeat
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import procfs_reader
+from procfs_reader import pids, pid_cmdline, pid_fields, pid_batch, entries
+
+PROCFS = procfs_reader._procfs
+
+def legacy_pid_cmdline():
+    for pid in pids():
+        try:
+            with open(os.path.join(PROCFS, str(pid), 'cmdline'), 'rb') as fh:
+                cmdline = b2a_qp(fh.read())
+                cmdline = cmdline.replace('=00', ' ').replace('=\n', '').strip()
+                yield (pid, cmdline)
+        except IOError:
+            continue
+
+def legacy_entries(pid, page):
+    with open(os.path.join(PROCFS, str(pid), page)) as proc_status:
+        for line in proc_status:
+            split = b2a_qp(line).partition(':')
+            yield (split[0].strip(), split[2].strip())
+
+def legacy_vmrss(pid_list):
+    found = {}
+    for pid in pid_list:
+        try:
+            found[pid] = dict(legacy_entries(pid, 'status'))['VmRSS']
+        except (IOError, KeyError):
+            continue
+    return found
+
+def legacy_ppids(pid_list):
+    found = {}
+    for pid in pid_list:
+        try:
+            with open(os.path.join(PROCFS, str(pid), 'stat'), 'rb') as fh:
+                found[pid] = int(b2a_qp(fh.read()).rpartition(')')[2].split()[1])
+        except IOError:
+            continue
+    return found
+
+if __name__ == '__main__':
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pid_list = sorted(pids())
+
+    cases = [
+        ('cmdline, all pids',
+         lambda: dict(legacy_pid_cmdline()),
+         lambda: dict(pid_cmdline())),
+        ('status VmRSS, all pids',
+         lambda: legacy_vmrss(pid_list),
+         lambda: pid_batch(pid_list, status=('VmRSS',))),
+        ('stat ppid, all pids',
+         lambda: legacy_ppids(pid_list),
+         lambda: pid_batch(pid_list, stat=('ppid',))),
+        ('status page, single pid',
+         lambda: dict(legacy_entries(os.getpid(), 'status')),
+         lambda: dict(entries(os.getpid(), 'status'))),
+        ('VmRSS, single pid',
+         lambda: dict(legacy_entries(os.getpid(), 'status'))['VmRSS'],
+         lambda: pid_fields(os.getpid(), status=('VmRSS',))['VmRSS']),
+        ]
+
+    print '%d processes, best of 3 x %d iterations' % (len(pid_list), number)
+    print '%-26s %12s %12s %8s' % ('case', 'legacy', 'os.read', 'speedup')
+    for name, legacy, current in cases:
+        legacy_time = min(repeat(legacy, number=number, repeat=3)) / number
+        current_time = min(repeat(current, number=number, repeat=3)) / number
+        print '%-26s %10.1fus %10.1fus %7.1fx' % (name,
+                                                   legacy_time * 1e6,
+                                                   current_time * 1e6,
+                                                   legacy_time / current_time)
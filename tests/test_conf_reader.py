@@ -3,6 +3,7 @@
 import unittest
 import os
 
+import conf_reader
 from conf_reader import config_file
 
 class TestConfigFile(unittest.TestCase):
@@ -213,5 +214,79 @@ class TestConfigFile(unittest.TestCase):
         self.assertEqual(conf['server-ip'], '127.0.0.1')
         self.assertEqual(conf['server-ip'::'0.0.0.0'], '127.0.0.1')
 
+    def test_parse_cache(self):
+        path = self.CONFIG_FILES['sections']
+        with config_file(path) as conf:
+            conf.add_section('java')
+            conf['java':'java_xmx'] = '256'
+
+        before = conf_reader.cache_info()
+        first = config_file(path)
+        second = config_file(path)
+        after = conf_reader.cache_info()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertIs(first._sections, second._sections)
+
+        #modifying one instance copies its sections and leaves others intact
+        second['java':'java_xmx'] = '512'
+        self.assertIsNot(first._sections, second._sections)
+        self.assertEqual(first['java':'java_xmx'], '256')
+        self.assertEqual(config_file(path)['java':'java_xmx'], '256')
+
+        second.commit()
+        self.assertEqual(config_file(path)['java':'java_xmx'], '512')
+        self.assertEqual(first['java':'java_xmx'], '256')
+
+    def test_parse_cache_external_change(self):
+        path = self.CONFIG_FILES['sectionless']
+        with open(path, 'w') as fh:
+            fh.write('server-port=25565\n')
+        self.assertEqual(config_file(path)['server-port'], '25565')
+
+        #a replaced file has a new inode even if size and mtime match
+        st = os.stat(path)
+        with open(path + '.new', 'w') as fh:
+            fh.write('server-port=25566\n')
+        os.utime(path + '.new', (st.st_atime, st.st_mtime))
+        os.rename(path + '.new', path)
+
+        conf = config_file(path)
+        self.assertFalse(conf._use_sections)
+        self.assertEqual(conf['server-port'], '25566')
+
+    def test_atomic_commit(self):
+        path = self.CONFIG_FILES['sectionless']
+        with open(path, 'w') as fh:
+            fh.write('server-port=25565\n')
+        os.chmod(path, 0640)
+        inode = os.stat(path).st_ino
+
+        conf = config_file(path)
+        conf['server-port'] = '25566'
+        conf.commit(reject_changed=True)
+
+        st = os.stat(path)
+        self.assertNotEqual(st.st_ino, inode)
+        self.assertEqual(st.st_mode & 0777, 0640)
+        self.assertFalse(conf.changed_on_disk())
+        self.assertEqual(config_file(path)['server-port'], '25566')
+        self.assertEqual([f for f in os.listdir('.') if f.startswith('.%s.' % path)], [])
+
+    def test_reject_changed(self):
+        path = self.CONFIG_FILES['sectionless']
+        with open(path, 'w') as fh:
+            fh.write('server-port=25565\n')
+
+        conf = config_file(path)
+        conf['server-port'] = '25566'
+        with open(path, 'a') as fh:
+            fh.write('motd=changed underneath\n')
+        self.assertTrue(conf.changed_on_disk())
+
+        with self.assertRaises(RuntimeError):
+            conf.commit(reject_changed=True)
+        self.assertEqual(config_file(path)['motd'], 'changed underneath')
+
 if __name__ == "__main__":
     unittest.main()  
@@ -0,0 +1,142 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+import tempfile
+from shutil import rmtree
+
+import dedup_store
+
+class TestDedupStore(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.store = os.path.join(self.base, 'store')
+        self.tree = os.path.join(self.base, 'tree')
+        os.makedirs(os.path.join(self.tree, 'world', 'region'))
+        os.makedirs(os.path.join(self.tree, 'plugins'))
+
+        self.write('plugins/shared.jar', os.urandom(1000) * 700)
+        self.write('world/region/r.0.0.mca', os.urandom(3 * dedup_store.CHUNK_SIZE))
+        self.write('server.properties', 'motd=hello\n')
+        os.chmod(os.path.join(self.tree, 'server.properties'), 0640)
+        os.symlink('server.properties', os.path.join(self.tree, 'link'))
+
+    def tearDown(self):
+        rmtree(self.base)
+
+    def write(self, path, data):
+        with open(os.path.join(self.tree, path), 'wb') as fh:
+            fh.write(data)
+
+    def read(self, root, path):
+        with open(os.path.join(root, path), 'rb') as fh:
+            return fh.read()
+
+    def manifest(self, name):
+        return os.path.join(self.base, name + '.dedup')
+
+    def test_roundtrip(self):
+        stats = dedup_store.create(self.store, self.manifest('first'), self.tree)
+        self.assertEqual(stats['files'], 3)
+        self.assertEqual(stats['chunks'], stats['new_chunks'])
+
+        restored = os.path.join(self.base, 'restored')
+        os.makedirs(restored)
+        self.assertEqual(dedup_store.restore(self.store, self.manifest('first'), restored), 3)
+
+        for path in ('plugins/shared.jar', 'world/region/r.0.0.mca', 'server.properties'):
+            self.assertEqual(self.read(restored, path), self.read(self.tree, path))
+        self.assertEqual(os.stat(os.path.join(restored, 'server.properties')).st_mode & 0777, 0640)
+        self.assertEqual(os.readlink(os.path.join(restored, 'link')), 'server.properties')
+
+    def test_dedup_and_collect(self):
+        first = dedup_store.create(self.store, self.manifest('first'), self.tree)
+
+        #one chunk of the region changes; everything else is already stored
+        with open(os.path.join(self.tree, 'world/region/r.0.0.mca'), 'r+b') as fh:
+            fh.seek(dedup_store.CHUNK_SIZE)
+            fh.write('changed')
+        second = dedup_store.create(self.store, self.manifest('second'), self.tree)
+        self.assertEqual(second['chunks'], first['chunks'])
+        self.assertEqual(second['new_chunks'], 1)
+
+        stats = dedup_store.collect(self.store, [self.manifest('first'), self.manifest('second')])
+        self.assertEqual((stats['kept'], stats['removed']), (first['new_chunks'] + 1, 0))
+
+        os.remove(self.manifest('first'))
+        stats = dedup_store.collect(self.store, [self.manifest('second')])
+        self.assertEqual((stats['kept'], stats['removed']), (first['new_chunks'], 1))
+        self.assertGreater(stats['bytes'], 0)
+
+        restored = os.path.join(self.base, 'restored')
+        os.makedirs(restored)
+        dedup_store.restore(self.store, self.manifest('second'), restored)
+        self.assertEqual(self.read(restored, 'world/region/r.0.0.mca'),
+                         self.read(self.tree, 'world/region/r.0.0.mca'))
+
+    def chunk_files(self):
+        return [os.path.join(root, name) for root, dirs, files in os.walk(self.store)
+                for name in files if root != self.store]
+
+    def test_collect_during_create(self):
+        from threading import Thread
+
+        #an archive is being written while collect() is called
+        archiving = dedup_store.store_lock(self.store)
+        archiving.__enter__()
+        results = []
+        collector = Thread(target=lambda: results.append(
+            dedup_store.collect(self.store, [os.path.join(self.base, '*.dedup')])))
+        try:
+            collector.start()
+            collector.join(0.2)
+            self.assertTrue(collector.is_alive())
+            stats = dedup_store.create(self.store, self.manifest('first'), self.tree)
+        finally:
+            archiving.__exit__(None, None, None)
+        collector.join(5)
+
+        #the manifest written meanwhile was read under the lock: nothing removed
+        self.assertEqual((results[0]['kept'], results[0]['removed']), (stats['new_chunks'], 0))
+        restored = os.path.join(self.base, 'restored')
+        os.makedirs(restored)
+        self.assertEqual(dedup_store.restore(self.store, self.manifest('first'), restored), 3)
+
+    def test_verified_reads(self):
+        from zlib import compress
+
+        dedup_store.create(self.store, self.manifest('first'), self.tree)
+        self.assertEqual(os.stat(self.store).st_mode & 07777, 0755)
+
+        #a chunk rewritten in place no longer matches its digest
+        path = sorted(self.chunk_files())[0]
+        os.chmod(path, 0644)
+        with open(path, 'wb') as fh:
+            fh.write(compress('planted'))
+
+        restored = os.path.join(self.base, 'restored')
+        os.makedirs(restored)
+        with self.assertRaises(RuntimeError):
+            dedup_store.restore(self.store, self.manifest('first'), restored)
+
+    def test_foreign_chunks(self):
+        dedup_store.create(self.store, self.manifest('first'), self.tree)
+        path = sorted(self.chunk_files())[0]
+        try:
+            os.chown(path, os.getuid() + 1, os.getgid())
+        except OSError:
+            return
+
+        restored = os.path.join(self.base, 'restored')
+        os.makedirs(restored)
+        with self.assertRaises(RuntimeError):
+            dedup_store.restore(self.store, self.manifest('first'), restored)
+
+        #the next archive replaces the chunk with one of the store's owner
+        stats = dedup_store.create(self.store, self.manifest('second'), self.tree)
+        self.assertEqual(stats['new_chunks'], 1)
+        self.assertEqual(os.stat(path).st_uid, os.getuid())
+        self.assertEqual(dedup_store.restore(self.store, self.manifest('first'), restored), 3)
+
+if __name__ == "__main__":
+    unittest.main()
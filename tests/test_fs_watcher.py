@@ -0,0 +1,124 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+import tempfile
+from shutil import rmtree
+from time import sleep, time
+
+import fs_watcher
+from fs_watcher import listing, cache_info
+
+def wait_for(condition, timeout=3):
+    deadline = time() + timeout
+    while time() < deadline:
+        if condition():
+            return True
+        sleep(0.02)
+    return condition()
+
+class TestListing(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+
+    def tearDown(self):
+        rmtree(self.base)
+
+    def test_unwatched(self):
+        os.mkdir(os.path.join(self.base, 'one'))
+        with open(os.path.join(self.base, 'file'), 'w'):
+            pass
+        self.assertEqual(listing(self.base), (['one'], ['file']))
+
+        before = cache_info()['misses']
+        os.mkdir(os.path.join(self.base, 'two'))
+        self.assertEqual(sorted(listing(self.base)[0]), ['one', 'two'])
+        self.assertEqual(cache_info()['misses'] - before, 1)
+
+    def test_missing(self):
+        self.assertEqual(listing(os.path.join(self.base, 'absent')), ([], []))
+
+class WatcherTests(object):
+    USE_INOTIFY = True
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        for d in ('servers', 'archive'):
+            os.mkdir(os.path.join(self.base, d))
+        os.mkdir(os.path.join(self.base, 'servers', 'one'))
+
+        self.changed = []
+        fs_watcher.subscribe(self.changed.append)
+        self.watcher = fs_watcher.fs_watcher(self.base, interval=0.05, use_inotify=self.USE_INOTIFY)
+        self.watcher.start()
+
+    def tearDown(self):
+        self.watcher.stop()
+        fs_watcher.unsubscribe(self.changed.append)
+        rmtree(self.base)
+
+    def test_cached_listing(self):
+        servers = os.path.join(self.base, 'servers')
+        self.assertEqual(listing(servers)[0], ['one'])
+
+        before = cache_info()
+        self.assertEqual(listing(servers)[0], ['one'])
+        self.assertEqual(cache_info()['hits'] - before['hits'], 1)
+        self.assertEqual(cache_info()['misses'], before['misses'])
+
+        os.mkdir(os.path.join(servers, 'two'))
+        self.assertTrue(wait_for(lambda: sorted(listing(servers)[0]) == ['one', 'two']))
+
+        rmtree(os.path.join(servers, 'one'))
+        self.assertTrue(wait_for(lambda: listing(servers)[0] == ['two']))
+
+    def test_new_tree_and_subdirectory(self):
+        awd = os.path.join(self.base, 'archive', 'one')
+        os.mkdir(awd)
+        self.assertTrue(wait_for(lambda: awd in self.watcher._tracked))
+        self.assertEqual(listing(awd)[1], [])
+
+        with open(os.path.join(awd, 'one_2014-01-01.tgz'), 'w'):
+            pass
+        self.assertTrue(wait_for(lambda: listing(awd)[1] == ['one_2014-01-01.tgz']))
+
+        imports = os.path.join(self.base, 'import')
+        os.mkdir(imports)
+        self.assertTrue(wait_for(lambda: imports in self.watcher._tracked))
+
+    def test_subscribers(self):
+        sc = os.path.join(self.base, 'servers', 'one', 'server.config')
+        with open(sc, 'w') as fh:
+            fh.write('[java]\n')
+        self.assertTrue(wait_for(lambda: any(p in (sc, os.path.dirname(sc)) for p in self.changed)))
+
+    def test_chown(self):
+        one = os.path.join(self.base, 'servers', 'one')
+        self.assertTrue(wait_for(lambda: one in self.watcher._tracked))
+        try:
+            os.chown(one, os.getuid() + 1, os.getgid() + 1)
+        except OSError:
+            return
+        self.assertTrue(wait_for(lambda: one in self.changed))
+
+    def test_stop(self):
+        servers = os.path.join(self.base, 'servers')
+        listing(servers)
+        self.watcher.stop()
+        self.assertFalse(self.watcher._tracked)
+
+        os.mkdir(os.path.join(servers, 'two'))
+        self.assertEqual(sorted(listing(servers)[0]), ['one', 'two'])
+
+class TestInotifyWatcher(WatcherTests, unittest.TestCase):
+    def test_backend(self):
+        self.assertIn(self.watcher.backend, ('inotify', 'polling'))
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+    USE_INOTIFY = False
+
+    def test_backend(self):
+        self.assertEqual(self.watcher.backend, 'polling')
+
+if __name__ == "__main__":
+    unittest.main()
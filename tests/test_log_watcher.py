@@ -0,0 +1,120 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+import tempfile
+from getpass import getuser
+from shutil import rmtree
+from threading import Timer
+from time import time
+
+from log_watcher import log_watcher, message, SAVED, STOPPING
+from mineos import mc
+
+class TestLogWatcher(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.log = os.path.join(self.base, 'latest.log')
+        self.write('[12:00:00] [Server thread/INFO]: Saved the game\n')
+
+    def tearDown(self):
+        rmtree(self.base)
+
+    def write(self, text, mode='a'):
+        with open(self.log, mode) as fh:
+            fh.write(text)
+
+    def test_only_new_lines(self):
+        with log_watcher(self.log) as watcher:
+            self.assertEqual(watcher.lines(), [])
+            self.write('[12:00:01] first\n[12:00:02] sec')
+            self.assertEqual(watcher.lines(), ['[12:00:01] first'])
+            self.write('ond\n')
+            self.assertEqual(watcher.lines(), ['[12:00:02] second'])
+
+    def test_wait_for(self):
+        with log_watcher(self.log) as watcher:
+            self.assertIsNone(watcher.wait_for(SAVED, 0.1))
+
+            Timer(0.2, self.write, ['[12:00:05] [Server thread/INFO]: Saved the game\n']).start()
+            start = time()
+            self.assertIn('Saved the game', watcher.wait_for(SAVED, 5))
+            self.assertLess(time() - start, 1)
+
+    def test_server_lines_only(self):
+        for line in ('[12:00:00] [Server thread/INFO]: Saved the game',
+                     '[12:00:00 INFO]: Saved the world',
+                     '[12:00:00] [Server thread/INFO] [minecraft/MinecraftServer]: Saved the game',
+                     '2013-01-01 12:00:00 [INFO] CONSOLE: Save complete.'):
+            self.assertIn(message(line), SAVED)
+
+        for line in ('[12:00:00] [Server thread/INFO]: <griefer> Saved the game',
+                     '[12:00:00] [Server thread/INFO]: <griefer> ]: Saved the game',
+                     '[12:00:00] [Async Chat Thread - #0/INFO]: <griefer> Saved the game',
+                     '[12:00:00] [Server thread/INFO]: [griefer] Saved the game',
+                     '[12:00:00] [Server thread/INFO]: * griefer Saved the game',
+                     '[12:00:00] [Server thread/WARN]: Saved the game',
+                     '2013-01-01 12:00:00 [INFO] <griefer> Saved the world',
+                     'Saved the game'):
+            self.assertNotIn(message(line), SAVED)
+
+        with log_watcher(self.log) as watcher:
+            self.write('[12:00:07] [Server thread/INFO]: <griefer> ]: Saved the game\n')
+            self.assertIsNone(watcher.wait_for(SAVED, 0.1))
+
+    def test_rotation(self):
+        with log_watcher(self.log) as watcher:
+            os.rename(self.log, self.log + '.1')
+            self.write('[12:00:06] [Server thread/INFO]: Stopping server\n', 'w')
+            self.assertIn('Stopping server', watcher.wait_for(STOPPING, 1))
+
+    def test_missing_log(self):
+        with log_watcher(os.path.join(self.base, 'absent.log')) as watcher:
+            self.assertEqual(watcher.lines(), [])
+            self.assertIsNone(watcher.wait_for(SAVED, 0.1))
+
+class TestSaveConfirmation(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.instance = mc('one', getuser(), self.base)
+        os.makedirs(os.path.join(self.instance.env['cwd'], 'logs'))
+        self.log = os.path.join(self.instance.env['cwd'], 'logs', 'latest.log')
+        open(self.log, 'w').close()
+        self.stuffed = []
+
+    def tearDown(self):
+        mc.SAVE_DURATIONS.pop(self.instance.env['cwd'], None)
+        rmtree(self.base)
+
+    def console(self, reply):
+        def stuff(text):
+            self.stuffed.append(text)
+            if reply:
+                Timer(0.1, self.append, [reply]).start()
+        return stuff
+
+    def append(self, text):
+        with open(self.log, 'a') as fh:
+            fh.write(text)
+
+    def test_confirmed(self):
+        self.instance._command_stuff = self.console('[12:00:00] [Server thread/INFO]: Saved the game\n')
+        duration = self.instance._save_confirmed(timeout=5)
+        self.assertEqual(self.stuffed, ['save-all'])
+        self.assertLess(duration, 1)
+        self.assertEqual(self.instance.save_durations, [duration])
+
+    def test_unconfirmed(self):
+        self.instance._command_stuff = self.console(None)
+        self.assertIsNone(self.instance._save_confirmed(timeout=0.2))
+        self.assertEqual(self.instance.save_durations, [])
+
+        os.remove(self.log)
+        instance = mc('one', getuser(), self.base)
+        instance._command_stuff = self.console(None)
+        start = time()
+        self.assertIsNone(instance._stuff_and_wait('stop', STOPPING))
+        self.assertLess(time() - start, 0.1)
+
+if __name__ == "__main__":
+    unittest.main()
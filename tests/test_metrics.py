@@ -0,0 +1,128 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+import tempfile
+from shutil import rmtree
+
+from metrics import ring_buffer, resource_sampler, round_robin_archive
+
+class TestRingBuffer(unittest.TestCase):
+    def test_fill_and_wrap(self):
+        rb = ring_buffer(3)
+        self.assertEqual(len(rb), 0)
+        self.assertEqual(rb.values(), [])
+        with self.assertRaises(IndexError): rb.last()
+
+        rb.append(1)
+        rb.append(2)
+        self.assertEqual(rb.values(), [1, 2])
+        self.assertEqual(rb.last(), 2)
+
+        for i in (3, 4, 5):
+            rb.append(i)
+        self.assertEqual(len(rb), 3)
+        self.assertEqual(rb.values(), [3, 4, 5])
+        self.assertEqual(rb.last(), 5)
+
+class TestResourceSampler(unittest.TestCase):
+    def test_sample_process(self):
+        sampler = resource_sampler('/', interval=5, capacity=4)
+        pid = os.getpid()
+
+        sampler.sample_process('self', pid)
+        self.assertEqual(sampler.series(), {})
+        self.assertIsNone(sampler.latest('self', 'rss'))
+
+        sum(range(100000))
+        for i in range(6):
+            sampler.sample_process('self', pid)
+
+        series = sampler.series(['self', 'absent'])
+        self.assertEqual(series.keys(), ['self'])
+        self.assertEqual(set(series['self']), set(resource_sampler.SERIES))
+        self.assertEqual(len(series['self']['rss']), 4)
+        self.assertGreater(sampler.latest('self', 'rss'), 0)
+        self.assertGreaterEqual(sampler.latest('self', 'cpu'), 0)
+        self.assertGreaterEqual(sampler.latest('self', 'threads'), 1)
+
+    def test_missing_process(self):
+        sampler = resource_sampler('/')
+        sampler.sample_process('gone', 2**22 + 1)
+        sampler.sample_process('gone', 2**22 + 1)
+        self.assertEqual(sampler.series(), {})
+
+class TestRoundRobinArchive(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'one.rra')
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def test_update_and_fetch(self):
+        from time import time
+
+        now = int(time()) // 3600 * 3600
+        archive = round_robin_archive(self.path)
+        archive.update(now, rss=100, cpu=10)
+        archive.update(now + 5, rss=300, players=2)
+        archive.update(now + 65, rss=500, ping=float('nan'))
+        archive.close()
+
+        size = os.path.getsize(self.path)
+        archive = round_robin_archive(self.path)
+        self.assertEqual(os.path.getsize(self.path), size)
+        archive.close()
+
+        archive = round_robin_archive(self.path, readonly=True)
+        self.assertEqual(archive.fetch('rss', now, now + 70, 10),
+                         (10, [(now, 200.0), (now + 60, 500.0)]))
+        self.assertEqual(archive.fetch('rss', now, now + 70, 60),
+                         (60, [(now, 200.0), (now + 60, 500.0)]))
+        self.assertEqual(archive.fetch('rss', now, now + 70, 3600),
+                         (3600, [(now, 300.0)]))
+        self.assertEqual(archive.fetch('cpu', now, now + 70, 3600)[1], [(now, 10.0)])
+        self.assertEqual(archive.fetch('players', now, now + 70, 10)[1], [(now, 2.0)])
+        self.assertEqual(archive.fetch('ping', now, now + 70, 10)[1], [])
+        with self.assertRaises(ValueError): archive.fetch('bogus', now, now + 70)
+        archive.close()
+
+    def test_wraparound(self):
+        from time import time
+
+        step, rows = round_robin_archive.RESOLUTIONS[0]
+        now = int(time()) // step * step
+        archive = round_robin_archive(self.path)
+        archive.update(now - step * rows, rss=1)
+        archive.update(now, rss=2)
+        self.assertEqual(archive.fetch('rss', now - step * rows, now, step)[1], [(now, 2.0)])
+        archive.close()
+
+    def test_incompatible(self):
+        with open(self.path, 'wb') as fh:
+            fh.write('not an archive')
+        with self.assertRaises(ValueError):
+            round_robin_archive(self.path, readonly=True)
+        round_robin_archive(self.path).close()
+        round_robin_archive(self.path, readonly=True).close()
+
+    def test_sampler_record(self):
+        from time import time
+
+        now = int(time()) // 60 * 60
+        sampler = resource_sampler('/', archive_directory=self.directory)
+        sampler.record('one', now, players=5)
+        archive = round_robin_archive(resource_sampler.archive_path(self.directory, 'one'), readonly=True)
+        self.assertEqual(archive.fetch('players', now, now, 60)[1], [(now, 5.0)])
+        archive.close()
+
+        #servers that are no longer running release their open archive
+        self.assertIn('one', sampler._archives)
+        sampler.sample()
+        self.assertNotIn('one', sampler._archives)
+
+        self.assertIsNone(resource_sampler('/').record('one', now, players=5))
+
+if __name__ == "__main__":
+    unittest.main()
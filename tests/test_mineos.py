@@ -115,6 +115,24 @@ class TestMineOS(unittest.TestCase):
             instance = mc(server_name, **self.instance_arguments)
             self.assertIsNotNone(instance.server_name)
 
+    def test_index_servers_up(self):
+        jar = '/usr/bin/java -server -Xmx256M -Xms256M -jar /home/mc/servers/%s/minecraft_server.jar nogui'
+        pids = {
+            10: 'SCREEN -dmS mc-one %s' % (jar % 'one'),
+            11: jar % 'one',
+            20: 'SCREEN -dmS mc-one1 %s' % (jar % 'one1'),
+            21: jar % 'one1',
+            30: '/usr/bin/java -jar /opt/other.jar',
+            40: '/bin/bash'
+            }
+        parents = {11: 10, 21: 20, 30: 1, 40: 1}
+
+        index = mc._index_servers_up(pids, parents.get)
+        self.assertEqual(index, {
+            'mc-one': (10, 11, '/home/mc'),
+            'mc-one1': (20, 21, '/home/mc')
+            })
+
     def test_set_owner(self):
         mc('a', owner='fake')
         mc('b', owner=123)
@@ -142,6 +160,47 @@ class TestMineOS(unittest.TestCase):
         self.assertFalse(os.path.isfile(instance.env['sc']))
         self.assertFalse(os.path.isfile(instance.env['pc']))
         
+    def test_lazy_config(self):
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+        os.remove(instance.env['sc'])
+
+        instance = mc('one', **self.instance_arguments)
+        self.assertIsNone(instance._server_properties)
+        self.assertIsNone(instance._server_config)
+        self.assertIsNone(instance._profile_config)
+        self.assertIsNone(instance._server_type)
+        self.assertFalse(instance.up)
+
+        with self.assertRaises(KeyError):
+            instance.env['log']
+        self.assertEqual(instance.server_type, 'unknown')
+        self.assertTrue(instance.server_properties[:])
+        self.assertIsNone(instance._server_config)
+
+        #missing configs are only generated where servers are started
+        self.assertFalse(instance.server_config[:])
+        self.assertFalse(os.path.isfile(instance.env['sc']))
+        instance._load_config(generate_missing=True)
+        self.assertTrue(os.path.isfile(instance.env['sc']))
+
+        with open(os.path.join(instance.env['cwd'], 'server.log'), 'w'):
+            pass
+        instance = mc('one', **self.instance_arguments)
+        self.assertEqual(instance.env['log'], os.path.join(instance.env['cwd'], 'server.log'))
+        self.assertEqual(instance.server_type, 'legacy')
+
+    def test_upgrade_on_first_load(self):
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+        with instance.server_config as sc:
+            sc['java':'java_bin'] = '/usr/bin/java'
+            sc['java':'java_xmx'] = '768'
+
+        instance = mc('one', **self.instance_arguments)
+        self.assertFalse(instance.server_config.has_option('java', 'java_bin'))
+        self.assertEqual(instance.server_config['java':'java_xmx'], '768')
+
     def test_sp_defaults(self):
         from conf_reader import config_file
         instance = mc('one', **self.instance_arguments)
@@ -222,6 +281,125 @@ class TestMineOS(unittest.TestCase):
         instance._load_config()
         self.assertEqual(instance.server_config['java':'java_xmx'], '1024')
 
+    def test_ping_many(self):
+        one = mc('one', **self.instance_arguments)
+        one.create()
+        missing = mc('two', **self.instance_arguments)
+
+        pings = mc.ping_many([one, missing])
+        self.assertEqual(pings.keys(), ['one'])
+        self.assertEqual(pings['one'].players_online, '0')
+        self.assertEqual(one.ping, pings['one'])
+
+        with self.assertRaises(RuntimeWarning):
+            missing.ping
+
+    def test_server_summaries(self):
+        one = mc('one', **self.instance_arguments)
+        one.create(sp={'motd': 'summarized', 'max-players': '8'})
+        mc('two', **self.instance_arguments).create()
+
+        summaries = mc._server_summaries(one.base)
+        self.assertIn('one', summaries)
+        self.assertIn('two', summaries)
+
+        summary = summaries['one']
+        self.assertEqual(summary, one.summary)
+        self.assertEqual(summary.owner, one.owner.pw_name)
+        self.assertEqual(summary.cwd, one.env['cwd'])
+        self.assertEqual(summary.profile, one.profile)
+        self.assertEqual(summary.up, one.up)
+        self.assertEqual(summary.port, one.port)
+        self.assertEqual(summary.ip_address, one.ip_address)
+        self.assertEqual(summary.query_port, one.query_port)
+        self.assertEqual(summary.motd, 'summarized')
+        self.assertEqual(summary.max_players, '8')
+        self.assertEqual(summary.java_xmx, int(one.server_config['java':'java_xmx']))
+        self.assertEqual(summary.eula, one.eula)
+        self.assertEqual(summary.server_type, one.server_type)
+        self.assertEqual(summary.instance().sp, one.sp)
+
+        self.assertEqual(mc._server_summaries(one.base, ['two', 'three', '../one']).keys(), ['two'])
+        self.assertEqual(mc.ping_many([summary]), mc.ping_many([one]))
+
+    def test_server_schedules(self):
+        from scheduler import stagger_offset
+
+        instance = mc('one', **self.instance_arguments)
+        instance.create(sc={'crontabs': {'backup_interval': '60', 'archive_interval': 'skip'}})
+        mc('two', **self.instance_arguments).create()
+
+        schedules = mc._server_schedules(instance.base)
+        self.assertEqual(schedules['one'], {'backup': 60})
+        self.assertNotIn('two', schedules)
+
+        minutes = [p.minute for p in mc._plan_day(instance.base) if p.server_name == 'one']
+        self.assertEqual(minutes, range(stagger_offset('one', 60), 1440, 60))
+
+    def test_query_port(self):
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+        self.assertIsNone(instance.query_port)
+
+        with instance.server_properties as sp:
+            sp['enable-query'] = 'true'
+        self.assertEqual(instance.query_port, instance.port)
+
+        with instance.server_properties as sp:
+            sp['query.port'] = '25575'
+        self.assertEqual(instance.query_port, 25575)
+
+        self.assertEqual(mc.query_many([instance]), {})
+        self.assertIsNone(instance.query)
+
+    def test_modify_config_many(self):
+        import json
+
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+
+        changes = [['motd', 'batched'],
+                   ['max-players', 8],
+                   {'option': 'java_xmx', 'value': 1024, 'section': 'java'},
+                   ['start', True, 'onreboot']]
+        instance.modify_config_many(json.dumps(changes))
+
+        instance = mc('one', **self.instance_arguments)
+        self.assertEqual(instance.server_properties['motd'], 'batched')
+        self.assertEqual(instance.server_properties['max-players'], '8')
+        self.assertEqual(instance.server_config['java':'java_xmx'], '1024')
+        self.assertTrue(instance.server_config.getboolean('onreboot', 'start'))
+
+        #an invalid entry leaves both files untouched
+        with self.assertRaises(RuntimeError):
+            instance.modify_config_many([['motd', 'partial'], ['option', 'value', 'nosuchsection']])
+        with self.assertRaises(RuntimeError):
+            instance.modify_config_many('not json')
+        self.assertEqual(mc('one', **self.instance_arguments).server_properties['motd'], 'batched')
+
+        #so does a file changed since it was loaded
+        instance = mc('one', **self.instance_arguments)
+        instance.server_properties
+        with open(instance.env['sp'], 'a') as fh:
+            fh.write('pvp=false\n')
+        with self.assertRaises(RuntimeError):
+            instance.modify_config_many([['motd', 'stale']])
+        self.assertEqual(mc('one', **self.instance_arguments).server_properties['motd'], 'batched')
+
+        #and one changed since the client read its versions, by another process
+        versions = json.dumps(mc('one', **self.instance_arguments).config_versions)
+        time.sleep(0.01)
+        mc('one', **self.instance_arguments).modify_config('java_xmx', '512', 'java')
+        instance = mc('one', **self.instance_arguments)
+        with self.assertRaises(RuntimeError):
+            instance.modify_config_many([['motd', 'stale'], ['java_xmx', '2048', 'java']], versions)
+        instance = mc('one', **self.instance_arguments)
+        self.assertEqual(instance.server_properties['motd'], 'batched')
+        self.assertEqual(instance.server_config['java':'java_xmx'], '512')
+
+        instance.modify_config_many([['motd', 'fresh']], json.dumps(instance.config_versions))
+        self.assertEqual(mc('one', **self.instance_arguments).server_properties['motd'], 'fresh')
+
     def test_start(self):
         instance = mc('one', **self.instance_arguments)
         instance.create()
@@ -236,18 +414,246 @@ class TestMineOS(unittest.TestCase):
         self.assertIsNone(instance.java_pid)
         self.assertIsNone(instance.screen_pid)
 
+    def test_runtime_state(self):
+        from procfs_reader import pid_starttime
+
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+
+        pid = os.getpid()
+        os.makedirs(os.path.dirname(instance.env['runtime']))
+        with open(instance.env['runtime'], 'w') as runtime:
+            runtime.write('screen_pid=%s\nscreen_start=%s\n' % (pid, pid_starttime(pid)))
+            runtime.write('java_pid=%s\njava_start=%s\n' % (pid, pid_starttime(pid)))
+
+        self.assertTrue(instance.up)
+        self.assertEqual(instance.java_pid, pid)
+        self.assertEqual(instance.screen_pid, pid)
+
+        with open(instance.env['runtime'], 'w') as runtime:
+            runtime.write('screen_pid=%s\nscreen_start=1\n' % pid)
+            runtime.write('java_pid=%s\njava_start=1\n' % pid)
+
+        #the state file stays out of the server directory
+        self.assertFalse(instance.env['runtime'].startswith(instance.env['cwd']))
+
+        #stale state is dropped once the scan finds no server
+        self.assertFalse(instance.up)
+        self.assertFalse(os.path.exists(instance.env['runtime']))
+        self.assertIsNone(instance.java_pid)
+
     def test_archive(self):
         instance = mc('one', **self.instance_arguments)
         instance.create()
         instance.archive()
         self.assertTrue(os.path.isfile(instance._previous_arguments['archive_filename']))
 
+    def test_import_compressed(self):
+        from distutils.spawn import find_executable
+        from shutil import copy
+
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+        import_path = os.path.join(instance.base, mc.DEFAULT_PATHS['import'])
+        if not os.path.isdir(import_path):
+            os.makedirs(import_path)
+
+        for codec in ('gzip', 'zstd', 'lz4'):
+            program = mc.ARCHIVE_CODECS[codec].program
+            if program and not find_executable(program):
+                continue
+
+            instance.modify_config('archive_codec', codec, 'crontabs')
+            instance.archive()
+            copy(instance._previous_arguments['archive_filename'], import_path)
+
+            imported = mc('imported_%s' % codec, **self.instance_arguments)
+            imported.import_server(import_path,
+                                   os.path.basename(instance._previous_arguments['archive_filename']))
+            self.assertTrue(os.path.isfile(imported.env['sp']))
+
+    def test_watched_listings(self):
+        import fs_watcher
+
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+        awd = os.path.normpath(instance.env['awd'])
+        fs_watcher._watch(awd)
+        try:
+            #changes made through mc are visible without waiting for the watcher
+            self.assertEqual(list(instance.list_archives()), [])
+            instance.archive()
+            archives = [a.filename for a in instance.list_archives()]
+            self.assertEqual(len(archives), 1)
+
+            servers = os.path.dirname(os.path.normpath(instance.env['cwd']))
+            fs_watcher._watch(servers)
+            self.assertEqual(fs_watcher.listing(servers)[0], ['one'])
+            rmtree(instance.env['cwd'])
+            fs_watcher.invalidate(instance.env['cwd'])
+            self.assertEqual(fs_watcher.listing(servers)[0], [])
+
+            instance.restore_archive(archives[0])
+            self.assertEqual(fs_watcher.listing(servers)[0], ['one'])
+            self.assertIn('one', mc.list_servers(instance.base))
+
+            instance.prune_archives(archives[0])
+            self.assertEqual(list(instance.list_archives()), [])
+        finally:
+            fs_watcher._unwatch(awd)
+            fs_watcher._unwatch(servers)
+
+    def test_archive_codecs(self):
+        from distutils.spawn import find_executable
+
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+        self.assertEqual(instance.archive_codec, 'gzip')
+
+        for codec in ('none', 'zstd', 'lz4'):
+            program = mc.ARCHIVE_CODECS[codec].program
+            if program and not find_executable(program):
+                continue
+
+            instance.modify_config('archive_codec', codec, 'crontabs')
+            instance.archive()
+            filename = os.path.basename(instance._previous_arguments['archive_filename'])
+            self.assertTrue(filename.endswith(mc.ARCHIVE_CODECS[codec].extension))
+            self.assertIn((filename, codec), [(a.filename, a.codec) for a in instance.list_archives()])
+
+            os.remove(instance.env['sp'])
+            instance.restore_archive(filename)
+            self.assertTrue(os.path.isfile(instance.env['sp']))
+            time.sleep(1)
+
+        self.assertEqual(mc._archive_codec_of('server-one_2014-01-01_00:00:00.tar.gz'), 'gzip')
+        self.assertIsNone(mc._archive_codec_of('notes.txt'))
+
+        instance.modify_config('archive_codec', 'rar', 'crontabs')
+        with self.assertRaises(RuntimeError):
+            instance.command_archive
+
+    def test_dedup_archives(self):
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+        instance.modify_config('archive_codec', 'dedup', 'crontabs')
+
+        instance.archive()
+        time.sleep(1)
+        with open(os.path.join(instance.env['cwd'], 'world.dat'), 'wb') as fh:
+            fh.write(os.urandom(4096))
+        instance.archive()
+
+        archives = sorted(instance.list_archives(), key=lambda a: a.filename)
+        self.assertEqual([a.codec for a in archives], ['dedup', 'dedup'])
+        self.assertEqual(archives[1].size - archives[0].size, 4096)
+        self.assertGreater(archives[1].size, os.path.getsize(os.path.join(archives[1].path, archives[1].filename)))
+
+        rmtree(instance.env['cwd'])
+        instance.restore_archive(archives[1].filename)
+        self.assertTrue(os.path.isfile(os.path.join(instance.env['cwd'], 'world.dat')))
+        self.assertEqual(instance.server_config['crontabs':'archive_codec'], 'dedup')
+
+        with self.assertRaises(RuntimeError):
+            instance.restore_archive('server-one_missing.dedup')
+
+        chunks = lambda: sum(len(f) for r, d, f in os.walk(instance.env['store']) if r != instance.env['store'])
+        before = chunks()
+        instance.prune_archives(archives[1].filename)
+        self.assertEqual(chunks(), before - 1)
+
+    def test_region_backups(self):
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+        self.assertEqual(instance.backup_engine, 'rdiff')
+        instance.modify_config('backup_engine', 'region', 'crontabs')
+
+        instance.backup()
+        snapshots = list(instance.list_snapshots())
+        self.assertEqual(len(snapshots), 1)
+        self.assertFalse(os.path.exists(os.path.join(instance.env['bwd'], 'rdiff-backup-data')))
+
+        rmtree(instance.env['cwd'])
+        self.assertIn('one', mc.list_servers(instance.base))
+        instance = mc('one', **self.instance_arguments)
+        instance.restore()
+        self.assertEqual(instance.server_config['crontabs':'backup_engine'], 'region')
+
+        with self.assertRaises(RuntimeError):
+            instance.restore('1999-01-01_00:00:00')
+
+        with open(os.path.join(instance.env['cwd'], 'eula.txt'), 'w') as fh:
+            fh.write('eula=true\n')
+        instance.backup()
+        instance.backup()
+        increments = list(instance.list_increment_sizes())
+        self.assertEqual([i.step for i in increments], ['0B', '1B', '2B'])
+        self.assertTrue(increments[-1].cumulative_size.endswith('KB'))
+
+        instance.restore('2B')
+        self.assertFalse(os.path.exists(os.path.join(instance.env['cwd'], 'eula.txt')))
+        with self.assertRaises(RuntimeError):
+            instance.restore('3B')
+
+        instance.prune('1B')
+        self.assertEqual(len(list(instance.list_snapshots())), 2)
+        instance.restore('1B')
+        self.assertTrue(os.path.isfile(os.path.join(instance.env['cwd'], 'eula.txt')))
+        with self.assertRaises(RuntimeError):
+            instance.prune('2014-01-01')
+
+        instance.modify_config('backup_engine', 'tape', 'crontabs')
+        with self.assertRaises(RuntimeError):
+            instance.command_backup
+
+    def test_maintenance_io(self):
+        from subprocess import CalledProcessError
+        from scheduler import scheduler
+
+        instance = mc('one', **self.instance_arguments)
+        instance.create()
+
+        if mc.BINARY_PATHS['ionice']:
+            self.assertEqual(instance.ionice_arguments[1:], ['-c', '2', '-n', '7'])
+
+        def fill():
+            return instance._command_direct('dd if=/dev/zero of=filler bs=65536 count=64 conv=fsync',
+                                            instance.env['cwd'], maintenance=True)
+
+        jobs = scheduler()
+        written = jobs.submit('one', 'fill', fill)
+        self.assertTrue(jobs.wait(10))
+        self.assertEqual(written.state, 'finished')
+        self.assertIn('records out', written.output)
+        self.assertGreaterEqual(written.write_bytes, 65536 * 64)
+
+        with self.assertRaises(CalledProcessError):
+            instance._command_direct('ls no-such-file', instance.env['cwd'], maintenance=True)
+
     def test_backup(self):
         instance = mc('one', **self.instance_arguments)
         instance.create()
         instance.backup()
         self.assertTrue(os.path.exists(os.path.join(instance.env['bwd'], 'rdiff-backup-data')))
 
+    def test_save_on_after_failure(self):
+        class running(mc):
+            up = True
+
+        instance = running('one', **self.instance_arguments)
+        instance.create()
+        stuffed = []
+        instance._command_stuff = stuffed.append
+        def unconfirmed(timeout=None):
+            raise RuntimeError('save failed')
+        instance._save_confirmed = unconfirmed
+
+        for method in (instance.backup, instance.archive):
+            del stuffed[:]
+            with self.assertRaises(RuntimeError):
+                method()
+            self.assertEqual(stuffed, ['save-off', 'save-on'])
+
     def test_restore(self):
         instance = mc('one', **self.instance_arguments)
         instance.create()
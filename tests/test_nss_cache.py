@@ -0,0 +1,76 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+import pwd
+import grp
+
+import nss_cache
+
+class TestNSSCache(unittest.TestCase):
+    def setUp(self):
+        nss_cache.invalidate()
+        self.ttl = (nss_cache.TTL, nss_cache.NEGATIVE_TTL)
+        self.user = pwd.getpwuid(os.getuid())
+        self.before = nss_cache.cache_info()
+
+    def counted(self, key):
+        return nss_cache.cache_info()[key] - self.before[key]
+
+    def tearDown(self):
+        nss_cache.TTL, nss_cache.NEGATIVE_TTL = self.ttl
+        nss_cache.invalidate()
+
+    def test_lookups(self):
+        self.assertEqual(nss_cache.getpwuid(self.user.pw_uid), self.user)
+        self.assertEqual(nss_cache.getpwnam(self.user.pw_name), self.user)
+        self.assertEqual(nss_cache.getgrgid(self.user.pw_gid), grp.getgrgid(self.user.pw_gid))
+        self.assertEqual(nss_cache.getgrnam(grp.getgrgid(self.user.pw_gid).gr_name).gr_gid,
+                         self.user.pw_gid)
+
+        self.assertEqual(self.counted('misses'), 2)
+        self.assertEqual(self.counted('hits'), 2) #reverse lookups answered by the same entries
+        self.assertGreaterEqual(nss_cache.cache_info()['saved_seconds'], 0)
+
+    def test_negative(self):
+        for i in range(3):
+            with self.assertRaises(KeyError):
+                nss_cache.getpwnam('no-such-user-mineos')
+
+        self.assertEqual(self.counted('misses'), 1)
+        self.assertEqual(self.counted('negative_hits'), 2)
+
+    def test_expiry(self):
+        nss_cache.TTL = 0
+        nss_cache.getpwuid(self.user.pw_uid)
+        nss_cache.getpwuid(self.user.pw_uid)
+        self.assertEqual(self.counted('misses'), 2)
+
+    def test_user_gids(self):
+        expected = set(g.gr_gid for g in grp.getgrall() if self.user.pw_name in g.gr_mem)
+        expected.add(self.user.pw_gid)
+        self.assertEqual(nss_cache.user_gids(self.user.pw_name), expected)
+        self.assertEqual(len(nss_cache.getgrall()), len(grp.getgrall()))
+        self.assertEqual(self.counted('misses'), 2) #getgrall and getpwnam
+
+        with self.assertRaises(KeyError):
+            nss_cache.user_gids('no-such-user-mineos')
+
+    def test_is_member(self):
+        self.assertTrue(nss_cache.is_member(self.user.pw_name, self.user.pw_gid))
+
+        #a network group that getgrall() does not enumerate
+        unlisted = grp.struct_group(('unlisted', 'x', 65432, [self.user.pw_name]))
+        nss_cache.getgrall()
+        with nss_cache._lock:
+            nss_cache._store('grgid', unlisted.gr_gid, unlisted, nss_cache.TTL)
+        self.assertTrue(nss_cache.is_member(self.user.pw_name, unlisted.gr_gid))
+        with nss_cache._lock:
+            nss_cache._store('grgid', 65433, KeyError(65433), nss_cache.NEGATIVE_TTL)
+        self.assertFalse(nss_cache.is_member(self.user.pw_name, 65433))
+
+        with self.assertRaises(KeyError):
+            nss_cache.is_member('no-such-user-mineos', self.user.pw_gid)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import socket
+import threading
+from time import time
+
+from ping_engine import exchange, legacy_exchange, modern_exchange, run
+from ping_engine import pack_varint, unpack_varint, pack_packet, unpack_packet, chat_text
+
+def kick_packet(text):
+    import struct
+    payload = text.encode('utf-16be')
+    return '\xff' + struct.pack('>H', len(text)) + payload
+
+class fake_server(object):
+    """Listens on localhost; answers every connection with `reply`
+    or, when reply is None, accepts and never says anything."""
+    def __init__(self, reply=None, close=True):
+        self.reply = reply
+        self.close = close
+        self.received = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(5)
+        self.port = self.sock.getsockname()[1]
+        self.held = []
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            self.held.append(conn)
+            if self.reply is not None:
+                self.received.append(conn.recv(1024))
+                conn.sendall(self.reply)
+                if self.close:
+                    conn.close()
+
+    def shutdown(self):
+        self.sock.close()
+        for conn in self.held:
+            conn.close()
+
+class fake_modern_server(fake_server):
+    """Answers the 1.7+ handshake, status request and ping like a
+    current server, or with a legacy kick if a 0xFE ping arrives."""
+    STATUS = {
+        'version': {'name': '1.8.9', 'protocol': 47},
+        'players': {'max': 20, 'online': 3},
+        'description': {'text': 'A ', 'extra': [{'text': 'Minecraft'}, ' Server']},
+        }
+
+    def __init__(self, legacy_reply=None):
+        self.legacy_reply = legacy_reply
+        super(fake_modern_server, self).__init__(reply='')
+
+    def serve(self):
+        import json
+
+        while True:
+            try:
+                conn, addr = self.sock.accept()
+            except socket.error:
+                return
+            self.held.append(conn)
+            data = ''
+            while True:
+                chunk = conn.recv(1024)
+                if not chunk:
+                    break
+                data += chunk
+                if data[:1] == '\xfe':
+                    self.received.append('legacy')
+                    if self.legacy_reply:
+                        conn.sendall(self.legacy_reply)
+                    conn.close()
+                    break
+
+                packet = unpack_packet(data)
+                while packet:
+                    packet_id, payload, data = packet
+                    self.received.append(packet_id)
+                    if packet_id == 0x00 and payload == '':
+                        body = json.dumps(self.STATUS)
+                        conn.sendall(pack_packet(0x00, pack_varint(len(body)) + body))
+                    elif packet_id == 0x01:
+                        conn.sendall(pack_packet(0x01, payload))
+                    packet = unpack_packet(data)
+
+class TestVarInt(unittest.TestCase):
+    def test_round_trip(self):
+        for value, encoded in [(0, '\x00'), (1, '\x01'), (127, '\x7f'), (128, '\x80\x01'),
+                               (25565, '\xdd\xc7\x01'), (2147483647, '\xff\xff\xff\xff\x07'),
+                               (-1, '\xff\xff\xff\xff\x0f')]:
+            self.assertEqual(pack_varint(value), encoded)
+            self.assertEqual(unpack_varint(encoded + 'x'), (value, len(encoded)))
+
+        with self.assertRaises(IndexError):
+            unpack_varint('\x80')
+        with self.assertRaises(ValueError):
+            unpack_varint('\xff' * 6)
+
+    def test_packets(self):
+        packet = pack_packet(0x01, 'payload')
+        self.assertEqual(unpack_packet(packet + 'next'), (0x01, 'payload', 'next'))
+        self.assertIsNone(unpack_packet(packet[:-1]))
+        self.assertIsNone(unpack_packet(''))
+
+    def test_chat_text(self):
+        self.assertEqual(chat_text(u'plain'), u'plain')
+        self.assertEqual(chat_text(fake_modern_server.STATUS['description']), u'A Minecraft Server')
+        self.assertEqual(chat_text(None), u'')
+
+class TestPingEngine(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+
+    def serve(self, *args, **kwargs):
+        server = fake_server(*args, **kwargs)
+        self.servers.append(server)
+        return server
+
+    def unused_port(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    def test_legacy_exchange(self):
+        reply = kick_packet(u'\xa71\x00127\x001.7.4\x00A Minecraft Server\x000\x0020')
+        answering = self.serve(reply)
+        still_open = self.serve(reply, close=False)
+
+        first = legacy_exchange('127.0.0.1', answering.port, '\xfe\x01')
+        second = legacy_exchange('127.0.0.1', still_open.port, '\xfe\x01')
+        run([first, second], timeout=2)
+
+        for ex in (first, second):
+            self.assertTrue(ex.complete)
+            self.assertEqual(ex.response, reply)
+        self.assertEqual(answering.received, ['\xfe\x01'])
+
+    def test_single_deadline(self):
+        reply = kick_packet(u'A Minecraft Server\xa70\xa720')
+        exchanges = [legacy_exchange('127.0.0.1', self.serve().port, '\xfe\x01') for i in range(5)]
+        exchanges.append(legacy_exchange('127.0.0.1', self.unused_port(), '\xfe\x01'))
+        exchanges.append(legacy_exchange('127.0.0.1', self.serve(reply).port, '\xfe\x01'))
+
+        start = time()
+        run(exchanges, timeout=0.5)
+        self.assertLess(time() - start, 1.0)
+
+        for ex in exchanges[:5]:
+            self.assertFalse(ex.complete)
+            self.assertIsNone(ex.response)
+        self.assertFalse(exchanges[5].complete)
+        self.assertTrue(exchanges[6].complete)
+        self.assertEqual(exchanges[6].response, reply)
+
+    def test_modern_exchange(self):
+        server = fake_modern_server()
+        self.servers.append(server)
+
+        ex = modern_exchange('127.0.0.1', server.port)
+        run([ex], timeout=2)
+
+        self.assertTrue(ex.complete)
+        self.assertEqual(ex.status, fake_modern_server.STATUS)
+        self.assertGreaterEqual(ex.latency, 0)
+        self.assertEqual(server.received, [0x00, 0x00, 0x01])
+
+    def test_modern_against_legacy_server(self):
+        ex = modern_exchange('127.0.0.1', self.serve(kick_packet(u'Old\xa70\xa720')).port)
+        run([ex], timeout=2)
+        self.assertFalse(ex.complete)
+        self.assertIsNone(ex.status)
+
+    def test_unresolvable(self):
+        ex = exchange(None, 25565)
+        self.assertEqual(run([ex], timeout=0.5), [ex])
+        self.assertFalse(ex.complete)
+
+class stub_instance(object):
+    """Just enough of mineos.server_summary for mc.ping_many on a live server"""
+    server_type = 'vanilla'
+    server_milestone_long = '1.6.2'
+    server_list_packet = '\xfe\x01'
+    up = True
+    ip_address = '127.0.0.1'
+    motd = ''
+    max_players = '20'
+
+    def __init__(self, server_name, port):
+        self.server_name = server_name
+        self.port = port
+        self.cwd = '/nonexistent/servers/%s' % server_name
+
+class TestPingMany(unittest.TestCase):
+    def setUp(self):
+        from mineos import mc
+        self.mc = mc
+        self.protocols = dict(mc.PING_PROTOCOLS)
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+        self.mc.PING_PROTOCOLS.clear()
+        self.mc.PING_PROTOCOLS.update(self.protocols)
+
+    serve = TestPingEngine.__dict__['serve']
+
+    def test_protocol_fallback(self):
+        modern = fake_modern_server()
+        legacy = self.serve(kick_packet(u'Old Server\xa72\xa710'))
+        hung = self.serve()
+        self.servers.append(modern)
+        instances = [stub_instance('modern', modern.port),
+                     stub_instance('legacy', legacy.port),
+                     stub_instance('hung', hung.port)]
+
+        start = time()
+        pings = self.mc.ping_many(instances, timeout=1)
+        self.assertLess(time() - start, 1.5)
+
+        self.assertEqual(pings['modern'][:5], (u'47', u'1.8.9', u'A Minecraft Server', u'3', u'20'))
+        self.assertGreaterEqual(pings['modern'].latency, 0)
+        self.assertEqual(pings['legacy'][:5], (None, '1.6.2', u'Old Server', u'2', u'10'))
+        self.assertGreaterEqual(pings['legacy'].latency, 0)
+        self.assertEqual(pings['hung'].players_online, '-1')
+        self.assertIsNone(pings['hung'].latency)
+
+        self.assertEqual(self.mc._ping_protocol(instances[0].cwd), 'modern')
+        self.assertEqual(self.mc._ping_protocol(instances[1].cwd), 'legacy')
+        self.assertNotIn(instances[2].cwd, self.mc.PING_PROTOCOLS)
+
+        #remembered servers go straight to the protocol that worked
+        del modern.received[:], legacy.received[:]
+        pings = self.mc.ping_many(instances[:2], timeout=1)
+        self.assertEqual(pings['legacy'].motd, u'Old Server')
+        self.assertEqual(legacy.received, ['\xfe\x01'])
+        self.assertEqual(modern.received, [0x00, 0x00, 0x01])
+
+        #...and forget the legacy protocol once it stops answering
+        legacy.reply = None
+        self.mc.ping_many(instances[1:2], timeout=0.5)
+        self.assertNotIn(instances[1].cwd, self.mc.PING_PROTOCOLS)
+
+    def test_legacy_expires(self):
+        modern = fake_modern_server()
+        self.servers.append(modern)
+        instance = stub_instance('upgraded', modern.port)
+
+        #remembered from before the server was upgraded to 1.7+
+        self.mc.PING_PROTOCOLS[instance.cwd] = ('legacy', time() - self.mc.PING_LEGACY_TTL - 1)
+        self.assertIsNone(self.mc._ping_protocol(instance.cwd))
+
+        pings = self.mc.ping_many([instance], timeout=1)
+        self.assertEqual(pings['upgraded'].server_version, u'1.8.9')
+        self.assertEqual(self.mc._ping_protocol(instance.cwd), 'modern')
+
+if __name__ == "__main__":
+    unittest.main()
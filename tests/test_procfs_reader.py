@@ -0,0 +1,75 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+
+from procfs_reader import pid_snapshot, pid_fields, pid_batch, entries
+
+class TestPidSnapshot(unittest.TestCase):
+    def test_snapshot_reuse(self):
+        snapshot = pid_snapshot(ttl=60)
+
+        first = snapshot.cmdlines()
+        self.assertIn(os.getpid(), first)
+        self.assertIs(snapshot.cmdlines(), first)
+        self.assertEqual(snapshot.misses, 1)
+        self.assertEqual(snapshot.hits, 1)
+
+        snapshot.invalidate()
+        self.assertIsNot(snapshot.cmdlines(), first)
+        self.assertEqual(snapshot.misses, 2)
+
+    def test_snapshot_expiry(self):
+        snapshot = pid_snapshot(ttl=0)
+        snapshot.cmdlines()
+        snapshot.cmdlines()
+        self.assertEqual(snapshot.misses, 2)
+        self.assertEqual(snapshot.hits, 0)
+
+    def test_derived(self):
+        snapshot = pid_snapshot(ttl=60)
+        calls = []
+
+        def count(pids):
+            calls.append(1)
+            return len(pids)
+
+        self.assertEqual(snapshot.derived('count', count), len(snapshot.cmdlines()))
+        snapshot.derived('count', count)
+        self.assertEqual(len(calls), 1)
+
+        snapshot.invalidate()
+        snapshot.derived('count', count)
+        self.assertEqual(len(calls), 2)
+
+    def test_stats(self):
+        snapshot = pid_snapshot(ttl=5)
+        self.assertIsNone(snapshot.stats['age'])
+        snapshot.cmdlines()
+        stats = snapshot.stats
+        self.assertEqual(stats['ttl'], 5)
+        self.assertEqual(stats['misses'], 1)
+        self.assertGreaterEqual(stats['age'], 0)
+
+class TestPidFields(unittest.TestCase):
+    def test_pid_fields(self):
+        pid = os.getpid()
+        fields = pid_fields(pid, cmdline=True, stat=('ppid', 'state'), status=('Name', 'VmRSS'))
+
+        self.assertEqual(set(fields), set(['cmdline', 'ppid', 'state', 'Name', 'VmRSS']))
+        self.assertEqual(fields['ppid'], os.getppid())
+        self.assertNotIn('\x00', fields['cmdline'])
+        self.assertTrue(fields['VmRSS'].endswith('kB'))
+        self.assertEqual(fields['Name'], dict(entries(pid, 'status'))['Name'])
+
+    def test_missing_pid(self):
+        with self.assertRaises(IOError):
+            pid_fields(2**22 + 1, stat=('ppid',))
+
+    def test_pid_batch(self):
+        pid = os.getpid()
+        batch = pid_batch([pid, 2**22 + 1], stat=('ppid',))
+        self.assertEqual(batch, {pid: {'ppid': os.getppid()}})
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import socket
+import struct
+import threading
+from time import time
+
+from query_engine import query_client, session_id, parse_stat
+
+class fake_query_server(object):
+    """Answers GS4 handshakes and full stat requests on localhost,
+    honoring only the most recently issued challenge token."""
+    INFO = [('hostname', 'A Minecraft Server'), ('gametype', 'SMP'), ('game_id', 'MINECRAFT'),
+            ('version', '1.8.9'), ('plugins', ''), ('map', 'world'), ('numplayers', '2'),
+            ('maxplayers', '20'), ('hostport', '25565'), ('hostip', '127.0.0.1')]
+    PLAYERS = ['alice', 'bob']
+
+    def __init__(self, silent=False):
+        self.silent = silent
+        self.token = 9513307
+        self.requests = []
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(('127.0.0.1', 0))
+        self.address = self.sock.getsockname()
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                data, addr = self.sock.recvfrom(1024)
+            except socket.error:
+                return
+            if self.silent or data[:2] != '\xfe\xfd':
+                continue
+
+            packet_type, session = struct.unpack('>BI', data[2:7])
+            self.requests.append(packet_type)
+            if packet_type == 0x09:
+                reply = struct.pack('>BI', 0x09, session) + '%d\x00' % self.token
+            elif struct.unpack('>i', data[7:11])[0] == self.token:
+                reply = struct.pack('>BI', 0x00, session) + 'splitnum\x00\x80\x00' + \
+                        ''.join('%s\x00%s\x00' % kv for kv in self.INFO) + \
+                        '\x00\x01player_\x00\x00' + ''.join('%s\x00' % p for p in self.PLAYERS) + '\x00'
+            else:
+                continue
+            self.sock.sendto(reply, addr)
+
+    def shutdown(self):
+        self.sock.close()
+
+class TestQueryEngine(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+
+    def serve(self, **kwargs):
+        server = fake_query_server(**kwargs)
+        self.servers.append(server)
+        return server
+
+    def test_session_id(self):
+        ids = set(session_id(n) for n in range(65536))
+        self.assertEqual(len(ids), 65536)
+        self.assertTrue(all(i & 0x0F0F0F0F == i for i in ids))
+
+    def test_parse_stat(self):
+        info, players = parse_stat('splitnum\x00\x80\x00hostname\x00Srv\x00numplayers\x000\x00'
+                                   '\x00\x01player_\x00\x00\x00')
+        self.assertEqual(info, {u'hostname': u'Srv', u'numplayers': u'0'})
+        self.assertEqual(players, [])
+
+    def test_query_many(self):
+        client = query_client()
+        first, second = self.serve(), self.serve()
+        silent = self.serve(silent=True)
+
+        start = time()
+        results = client.query({'first': first.address,
+                                'second': second.address,
+                                'silent': silent.address}, timeout=0.5)
+        self.assertLess(time() - start, 1.0)
+
+        self.assertEqual(sorted(results), ['first', 'second'])
+        self.assertEqual(results['first']['players'], fake_query_server.PLAYERS)
+        self.assertEqual(results['first']['info'], dict(fake_query_server.INFO))
+        self.assertEqual(first.requests, [0x09, 0x00])
+
+    def test_token_cache(self):
+        client = query_client()
+        server = self.serve()
+
+        client.query({'one': server.address}, timeout=0.5)
+        self.assertIn('one', client.query({'one': server.address}, timeout=0.5))
+        self.assertEqual(server.requests, [0x09, 0x00, 0x00])
+
+        #a rotated token is detected and renewed within the same call
+        server.token = -42
+        self.assertIn('one', client.query({'one': server.address}, timeout=0.5))
+        self.assertEqual(server.requests[3:], [0x00, 0x09, 0x00])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+import struct
+import tempfile
+import zlib
+from shutil import rmtree
+
+import region_backup
+from region_backup import SECTOR, HEADER
+
+def write_region(path, chunks):
+    """Writes a region file from {index: (timestamp, payload)}, leaving
+    a free sector between chunks as minecraft does after relocations"""
+    locations = [0] * 1024
+    timestamps = [0] * 1024
+    body = []
+    sector = HEADER // SECTOR
+    for index in sorted(chunks):
+        timestamp, payload = chunks[index]
+        record = struct.pack('>IB', len(payload) + 1, 2) + payload
+        count = (len(record) + SECTOR - 1) // SECTOR
+        body.append(record + '\x00' * ((count + 1) * SECTOR - len(record)))
+        locations[index] = (sector << 8) | count
+        timestamps[index] = timestamp
+        sector += count + 1
+
+    with open(path, 'wb') as fh:
+        fh.write(struct.pack('>1024I', *locations))
+        fh.write(struct.pack('>1024I', *timestamps))
+        fh.write(''.join(body))
+
+def read_region(path):
+    """Returns {index: (timestamp, payload)} of a region file"""
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    locations = struct.unpack('>1024I', data[:SECTOR])
+    timestamps = struct.unpack('>1024I', data[SECTOR:HEADER])
+
+    chunks = {}
+    for index, location in enumerate(locations):
+        if location:
+            offset = (location >> 8) * SECTOR
+            length = struct.unpack('>I', data[offset:offset + 4])[0]
+            chunks[index] = (timestamps[index], data[offset + 5:offset + 4 + length])
+    return chunks
+
+class TestRegionBackup(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.source = os.path.join(self.base, 'server')
+        self.snapshots = os.path.join(self.base, 'snapshots')
+        self.region = os.path.join(self.source, 'world', 'region', 'r.0.0.mca')
+        os.makedirs(os.path.dirname(self.region))
+
+        self.chunks = dict((i, (1400000000 + i, zlib.compress(os.urandom(2000 + i * 100))))
+                           for i in range(0, 1024, 16))
+        write_region(self.region, self.chunks)
+        with open(os.path.join(self.source, 'server.properties'), 'w') as fh:
+            fh.write('motd=hello\n')
+
+    def tearDown(self):
+        rmtree(self.base)
+
+    def restored(self, snapshot=None):
+        destination = tempfile.mkdtemp(dir=self.base)
+        region_backup.restore(self.snapshots, destination, snapshot)
+        return destination
+
+    def test_only_changed_chunks(self):
+        first, stats = region_backup.backup(self.snapshots, self.source)
+        self.assertEqual(stats['chunks_copied'], len(self.chunks))
+        self.assertEqual(stats['files_copied'], 2)
+
+        unchanged, stats = region_backup.backup(self.snapshots, self.source)
+        self.assertEqual((stats['chunks_copied'], stats['files_copied'], stats['bytes_copied']), (0, 0, 0))
+        self.assertEqual(stats['chunks_kept'], len(self.chunks))
+
+        self.chunks[32] = (1500000000, zlib.compress(os.urandom(9000)))
+        write_region(self.region, self.chunks)
+        changed, stats = region_backup.backup(self.snapshots, self.source)
+        self.assertEqual(stats['chunks_copied'], 1)
+        self.assertEqual(stats['chunks_kept'], len(self.chunks) - 1)
+        self.assertLess(stats['bytes_copied'], 10000)
+
+        self.assertEqual(region_backup.snapshots(self.snapshots), sorted([first, unchanged, changed]))
+        self.assertEqual(read_region(os.path.join(self.restored(), 'world', 'region', 'r.0.0.mca')),
+                         self.chunks)
+
+    def test_rewritten_chunk_same_timestamp(self):
+        region_backup.backup(self.snapshots, self.source)
+
+        #same timestamp and sector count, different length
+        self.chunks[16] = (self.chunks[16][0], zlib.compress(os.urandom(2500)))
+        write_region(self.region, self.chunks)
+        os.utime(self.region, (1500000000, 1500000000))
+        snapshot, stats = region_backup.backup(self.snapshots, self.source)
+        self.assertEqual(stats['chunks_copied'], 1)
+        self.assertEqual(read_region(os.path.join(self.restored(), 'world', 'region', 'r.0.0.mca')),
+                         self.chunks)
+
+    def test_restore_earlier(self):
+        first, stats = region_backup.backup(self.snapshots, self.source)
+        original = dict(self.chunks)
+
+        self.chunks[0] = (1500000000, zlib.compress('changed'))
+        write_region(self.region, self.chunks)
+        with open(os.path.join(self.source, 'server.properties'), 'w') as fh:
+            fh.write('motd=changed, and longer\n')
+        region_backup.backup(self.snapshots, self.source)
+
+        destination = self.restored(first)
+        self.assertEqual(read_region(os.path.join(destination, 'world', 'region', 'r.0.0.mca')), original)
+        with open(os.path.join(destination, 'server.properties')) as fh:
+            self.assertEqual(fh.read(), 'motd=hello\n')
+
+        with self.assertRaises(RuntimeError):
+            self.restored('1999-01-01_00:00:00')
+
+    def test_restore_removes_others(self):
+        region_backup.backup(self.snapshots, self.source)
+
+        destination = self.restored()
+        os.makedirs(os.path.join(destination, 'world', 'DIM-1', 'region'))
+        os.symlink('server.properties', os.path.join(destination, 'world', 'region', 'r.9.9.mca'))
+        with open(os.path.join(destination, 'banned-players.txt'), 'w') as fh:
+            fh.write('griefer\n')
+
+        region_backup.restore(self.snapshots, destination)
+        self.assertEqual(sorted(os.listdir(destination)), ['server.properties', 'world'])
+        self.assertEqual(os.listdir(os.path.join(destination, 'world')), ['region'])
+        self.assertEqual(os.listdir(os.path.join(destination, 'world', 'region')), ['r.0.0.mca'])
+
+    def test_prune(self):
+        expected = {}
+        for i in range(4):
+            self.chunks[16 * i] = (1500000000 + i, zlib.compress(os.urandom(3000)))
+            write_region(self.region, self.chunks)
+            snapshot, stats = region_backup.backup(self.snapshots, self.source)
+            expected[snapshot] = dict(self.chunks)
+
+        with self.assertRaises(RuntimeError):
+            region_backup.prune(self.snapshots, 0)
+        self.assertEqual(region_backup.prune(self.snapshots, 5), [])
+
+        available = region_backup.snapshots(self.snapshots)
+        self.assertEqual(region_backup.prune(self.snapshots, 2), available[:2])
+        self.assertEqual(region_backup.snapshots(self.snapshots), available[2:])
+        self.assertEqual(sorted(os.listdir(self.snapshots)), available[2:])
+
+        for snapshot in available[2:]:
+            destination = self.restored(snapshot)
+            self.assertEqual(read_region(os.path.join(destination, 'world', 'region', 'r.0.0.mca')),
+                             expected[snapshot])
+            with open(os.path.join(destination, 'server.properties')) as fh:
+                self.assertEqual(fh.read(), 'motd=hello\n')
+
+        snapshot, stats = region_backup.backup(self.snapshots, self.source)
+        self.assertEqual((stats['files_copied'], stats['chunks_copied']), (0, 0))
+
+    def test_invalid_region(self):
+        with open(os.path.join(self.source, 'world', 'region', 'r.1.0.mca'), 'wb') as fh:
+            fh.write('\xff' * 100)
+        snapshot, stats = region_backup.backup(self.snapshots, self.source)
+        self.assertEqual(stats['files_copied'], 3)
+
+        with open(os.path.join(self.restored(), 'world', 'region', 'r.1.0.mca'), 'rb') as fh:
+            self.assertEqual(fh.read(), '\xff' * 100)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+import tempfile
+from shutil import rmtree
+from threading import Event, Lock
+from time import sleep
+
+from scheduler import scheduler, plan_day, upcoming, stagger_offset, io_slots
+
+class recorder(object):
+    """Job functions that record their concurrency and block until released"""
+    def __init__(self):
+        self.release = Event()
+        self.order = []
+        self.running = {}
+        self.peak = {}
+        self._lock = Lock()
+
+    def __call__(self, name, kind='io', fail=False):
+        def fn():
+            with self._lock:
+                self.order.append(name)
+                self.running[kind] = self.running.get(kind, 0) + 1
+                total = sum(self.running.values())
+                self.peak[kind] = max(self.peak.get(kind, 0), self.running[kind])
+                self.peak['total'] = max(self.peak.get('total', 0), total)
+            self.release.wait(5)
+            with self._lock:
+                self.running[kind] -= 1
+            if fail:
+                raise RuntimeError('%s failed' % name)
+        return fn
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.jobs = recorder()
+        self.scheduler = scheduler(workers=3, cpu_jobs=1, io_jobs=2)
+
+    def tearDown(self):
+        self.jobs.release.set()
+        self.scheduler.stop()
+        self.scheduler.wait(5)
+
+    def test_limits(self):
+        for i in range(4):
+            self.scheduler.submit('io%d' % i, 'backup', self.jobs('io%d' % i, 'io'), 'io')
+            self.scheduler.submit('cpu%d' % i, 'archive', self.jobs('cpu%d' % i, 'cpu'), 'cpu')
+
+        sleep(0.1)
+        status = self.scheduler.status()
+        self.assertEqual(len(status['running']), 3)
+        self.assertEqual(len(status['queued']), 5)
+        self.assertEqual(status['limits'], {'workers': 3, 'cpu': 1, 'io': 2})
+
+        self.jobs.release.set()
+        self.assertTrue(self.scheduler.wait(5))
+        self.assertEqual(self.jobs.peak['io'], 2)
+        self.assertEqual(self.jobs.peak['cpu'], 1)
+        self.assertEqual(self.jobs.peak['total'], 3)
+        self.assertEqual(len(self.scheduler.status()['finished']), 8)
+
+    def test_per_server_order(self):
+        self.scheduler.submit('one', 'restart', self.jobs('restart'), 'io')
+        self.scheduler.submit('one', 'backup', self.jobs('backup'), 'io')
+        self.scheduler.submit('one', 'archive', self.jobs('archive'), 'io')
+
+        sleep(0.1)
+        self.assertEqual(self.jobs.order, ['restart'])
+        self.assertEqual([j['action'] for j in self.scheduler.status()['queued']], ['backup', 'archive'])
+
+        self.jobs.release.set()
+        self.assertTrue(self.scheduler.wait(5))
+        self.assertEqual(self.jobs.order, ['restart', 'backup', 'archive'])
+        self.assertEqual(self.jobs.peak['total'], 1)
+
+    def test_no_duplicate_ticks(self):
+        first = self.scheduler.submit('one', 'backup', self.jobs('first'))
+        sleep(0.1)
+        self.assertIsNone(self.scheduler.submit('one', 'backup', self.jobs('second')))
+        self.assertIsNotNone(self.scheduler.submit('two', 'backup', self.jobs('other')))
+
+        self.jobs.release.set()
+        self.assertTrue(self.scheduler.wait(5))
+        self.assertEqual(first.state, 'finished')
+        self.assertIsNotNone(self.scheduler.submit('one', 'backup', self.jobs('third')))
+
+    def test_failures_and_filter(self):
+        self.jobs.release.set()
+        self.scheduler.submit('one', 'backup', self.jobs('one', fail=True))
+        self.scheduler.submit('two', 'backup', self.jobs('two'))
+        self.assertTrue(self.scheduler.wait(5))
+
+        finished = self.scheduler.status(['one'])['finished']
+        self.assertEqual(len(finished), 1)
+        self.assertEqual(finished[0]['state'], 'failed')
+        self.assertEqual(finished[0]['error'], 'RuntimeError: one failed')
+
+        with self.assertRaises(ValueError):
+            self.scheduler.submit('one', 'backup', self.jobs('one'), 'gpu')
+
+    def test_stop(self):
+        self.scheduler.submit('one', 'backup', self.jobs('running'))
+        self.scheduler.submit('one', 'archive', self.jobs('cancelled'))
+        sleep(0.1)
+        self.scheduler.stop()
+
+        self.assertIsNone(self.scheduler.submit('two', 'backup', self.jobs('refused')))
+        self.jobs.release.set()
+        self.assertTrue(self.scheduler.wait(5))
+        self.assertEqual(self.jobs.order, ['running'])
+        self.assertEqual(sorted(j['state'] for j in self.scheduler.status()['finished']),
+                         ['cancelled', 'finished'])
+
+class TestIOSlots(unittest.TestCase):
+    def test_reentrant(self):
+        from threading import Thread
+
+        slots = io_slots(1)
+        entered = Event()
+
+        def other():
+            with slots:
+                entered.set()
+
+        with slots:
+            #the holder enters again without a second slot...
+            with slots:
+                pass
+            thread = Thread(target=other)
+            thread.start()
+            #...while another thread waits for the only one
+            self.assertFalse(entered.wait(0.2))
+        thread.join(2)
+        self.assertTrue(entered.is_set())
+
+class TestJobRecords(unittest.TestCase):
+    def setUp(self):
+        self.records = tempfile.mkdtemp()
+        self.jobs = recorder()
+
+    def tearDown(self):
+        self.jobs.release.set()
+        self.first.wait(5)
+        rmtree(self.records)
+
+    def test_outlive_restart(self):
+        from subprocess import CalledProcessError
+
+        def failing():
+            raise CalledProcessError(2, 'rdiff-backup', 'no space left')
+
+        first = self.first = scheduler(history=4, record_directory=self.records)
+        done = first.submit('one', 'backup', lambda: 'backup complete', user='alice')
+        failed = first.submit('two', 'backup', failing)
+        self.assertTrue(first.wait(5))
+        interrupted = first.submit('one', 'archive', self.jobs('archive'))
+        queued = first.submit('one', 'restore', self.jobs('restore'))
+        sleep(0.1)
+
+        #a new process finds the jobs the old one never finished
+        second = scheduler(history=4, record_directory=self.records)
+        self.assertEqual(second.get(done.id)['output'], 'backup complete')
+        self.assertEqual(second.get(done.id)['returncode'], 0)
+        self.assertEqual(second.get(done.id)['user'], 'alice')
+        self.assertEqual(second.get(failed.id)['returncode'], 2)
+        self.assertEqual(second.get(failed.id)['output'], 'no space left')
+        self.assertEqual(second.get(interrupted.id)['state'], 'interrupted')
+        self.assertEqual(second.get(queued.id)['state'], 'interrupted')
+        self.assertEqual(second.status(['three'], user='alice')['finished'][0]['id'], done.id)
+
+        #only the newest history records are kept, and ids never repeat
+        self.assertGreater(second.submit('one', 'backup', lambda: None).id, queued.id)
+        self.assertTrue(second.wait(5))
+        self.assertEqual(len(os.listdir(self.records)), 4)
+        self.assertIsNone(second.get(done.id))
+
+    def test_records_written_outside_lock(self):
+        first = self.first = scheduler(record_directory=self.records)
+
+        #a flush stuck on a slow disk holds up neither submissions nor status
+        first._record_lock.acquire()
+        try:
+            submitted = first.submit('one', 'backup', lambda: 'done')
+            self.assertTrue(first.wait(5))
+            self.assertEqual(first.status(['one'])['finished'][0]['id'], submitted.id)
+            self.assertEqual(os.listdir(self.records), [])
+        finally:
+            first._record_lock.release()
+
+        first._flush()
+        self.assertEqual(os.listdir(self.records), ['%d.json' % submitted.id])
+        self.assertEqual(scheduler(record_directory=self.records).get(submitted.id)['state'], 'finished')
+
+class TestPlanner(unittest.TestCase):
+    def test_stagger(self):
+        schedules = dict(('server%d' % i, {'backup': 1440, 'restart': 1440}) for i in range(20))
+        plan = plan_day(schedules)
+        self.assertEqual(len(plan), 40)
+        self.assertGreater(len(set(p.minute for p in plan)), 10)
+        for p in plan:
+            self.assertEqual(p.minute, stagger_offset(p.server_name, 1440))
+        self.assertEqual(plan, plan_day(schedules))
+
+        plan = plan_day({'one': {'backup': 60, 'restart': -1}})
+        self.assertEqual([p.minute for p in plan], range(stagger_offset('one', 60), 1440, 60))
+
+        #0 and intervals longer than a day mean once a day, staggered
+        plan = plan_day({'one': {'archive': 0, 'backup': 4000}})
+        self.assertEqual([(p.action, p.minute) for p in plan],
+                         [('backup', stagger_offset('one', 1440)), ('archive', stagger_offset('one', 1440))])
+
+    def test_io_budget(self):
+        schedules = dict(('server%d' % i, {'backup': 1440, 'archive': 1440, 'restart': 1440})
+                         for i in range(50))
+        plan = plan_day(schedules, io_budget=4, window=15)
+
+        load = {}
+        for p in plan:
+            self.assertGreaterEqual(p.minute, p.nominal)
+            if p.action == 'restart':
+                self.assertEqual(p.minute, p.nominal)
+            else:
+                load[p.minute // 15] = load.get(p.minute // 15, 0) + 1
+        self.assertLessEqual(max(load.values()), 4)
+        self.assertEqual(sum(load.values()), 100)
+
+        #the last window of the day absorbs what cannot be deferred further
+        plan = plan_day(dict(('late%d' % i, {'backup': 1}) for i in range(2)), io_budget=4, window=15)
+        self.assertEqual(len(plan), 2880)
+        self.assertEqual(max(p.minute for p in plan), 1439)
+
+    def test_upcoming(self):
+        from datetime import datetime
+        from time import mktime
+
+        noon = mktime(datetime(2014, 1, 1, 12, 0).timetuple())
+        plan = plan_day({'one': {'backup': 360}, 'two': {'restart': 720}})
+        planned = upcoming(plan, now=noon, hours=24, window=15)
+
+        self.assertEqual(len(planned['jobs']), 6)
+        self.assertTrue(all(noon - 60 < j['time'] < noon + 86400 for j in planned['jobs']))
+        self.assertEqual(sorted(j['time'] for j in planned['jobs']), [j['time'] for j in planned['jobs']])
+        self.assertEqual(sum(w['io_jobs'] for w in planned['load']), 4)
+
+        self.assertEqual(len(upcoming(plan, now=noon, hours=6)['jobs']), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import os
+import tempfile
+from getpass import getuser
+from shutil import rmtree
+
+from server_registry import server_registry
+from mineos import mc
+
+class TestServerRegistry(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        for d in ('servers', 'backup'):
+            os.mkdir(os.path.join(self.base, d))
+        os.mkdir(os.path.join(self.base, 'servers', 'one'))
+        os.mkdir(os.path.join(self.base, 'backup', 'one'))
+        os.mkdir(os.path.join(self.base, 'backup', 'two'))
+        with open(os.path.join(self.base, 'servers', 'stray.txt'), 'w'):
+            pass
+
+    def tearDown(self):
+        rmtree(self.base)
+
+    def age_trees(self):
+        """Backdates the trees so the registry does not consider them racy"""
+        for d in ('servers', 'backup'):
+            os.utime(os.path.join(self.base, d), (1, 1))
+
+    def test_membership(self):
+        registry = server_registry(self.base)
+        self.assertIn('one', registry)
+        self.assertIn('two', registry)
+        self.assertNotIn('stray.txt', registry)
+        self.assertNotIn('three', registry)
+        self.assertEqual(sorted(registry.names()), ['one', 'two'])
+
+    def test_no_rescan_until_changed(self):
+        self.age_trees()
+        registry = server_registry(self.base)
+        registry.names()
+        scans = registry.scans
+        for i in range(10):
+            self.assertIn('one', registry)
+        self.assertEqual(registry.scans, scans)
+
+        os.mkdir(os.path.join(self.base, 'servers', 'three'))
+        self.assertIn('three', registry)
+        self.assertEqual(registry.scans, scans + 1)
+
+        rmtree(os.path.join(self.base, 'backup', 'two'))
+        self.assertNotIn('two', registry)
+
+    def test_invalidate(self):
+        self.age_trees()
+        registry = server_registry(self.base)
+        registry.names()
+        scans = registry.scans
+
+        registry.invalidate(os.path.join(self.base, 'archive', 'one'))
+        registry.names()
+        self.assertEqual(registry.scans, scans)
+
+        registry.invalidate(os.path.join(self.base, 'servers', 'one'))
+        registry.names()
+        self.assertEqual(registry.scans, scans + 1)
+
+    def test_ownership(self):
+        from pwd import getpwuid
+
+        registry = server_registry(self.base)
+        own = registry.ownership('one')
+        self.assertEqual([o.path for o in own],
+                         [os.path.join(self.base, 'servers', 'one'),
+                          os.path.join(self.base, 'backup', 'one')])
+        self.assertEqual(own[0].uid, os.getuid())
+        self.assertEqual(own[0].owner, getpwuid(os.getuid()).pw_name)
+        self.assertEqual(registry.ownership('three'), ())
+
+        owners = registry.owners()
+        self.assertEqual(sorted(owners), ['one', 'two'])
+        self.assertEqual(owners['one'], own)
+        self.assertEqual(owners['two'][0].path, os.path.join(self.base, 'backup', 'two'))
+
+    def test_chown_server_directory(self):
+        self.age_trees()
+        registry = server_registry(self.base)
+        registry.names()
+        scans = registry.scans
+
+        #a chown changes neither tree's mtime, only the server directory's
+        path = os.path.join(self.base, 'servers', 'one')
+        uid, gid = os.getuid() + 1, os.getgid() + 1
+        try:
+            os.chown(path, uid, gid)
+        except OSError:
+            return
+
+        self.assertEqual(registry.ownership('one')[0].uid, os.getuid())
+        self.assertEqual(registry.scans, scans)
+
+        registry.invalidate(path)
+        own = registry.ownership('one')
+        self.assertEqual((own[0].uid, own[0].gid), (uid, gid))
+        self.assertEqual(own[1].uid, os.getuid())
+        self.assertEqual(registry.scans, scans + 1)
+
+    def test_mc_integration(self):
+        self.assertIs(mc._server_registry(self.base), mc._server_registry(self.base + os.sep))
+        self.assertEqual(sorted(mc.list_servers(self.base)), ['one', 'two'])
+        self.assertEqual(mc.has_server_rights(getuser(), 'one', self.base), getuser())
+        self.assertFalse(mc.has_server_rights(getuser(), 'three', self.base))
+        self.assertEqual(sorted(mc._servers_with_rights(getuser(), self.base)), ['one', 'two'])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python2.7
+
+import unittest
+import tempfile
+from shutil import rmtree
+from getpass import getuser
+from time import time
+
+from mineos import mc
+from status_collector import status_collector, server_status
+
+class TestStatusCollector(unittest.TestCase):
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        for name in ('one', 'two'):
+            mc(name, getuser(), self.base).create()
+
+    def tearDown(self):
+        rmtree(self.base)
+
+    def test_server_status(self):
+        start = time()
+        statuses = server_status([mc('one', getuser(), self.base)])
+
+        self.assertEqual(statuses.keys(), ['one'])
+        srv = statuses['one']
+        self.assertFalse(srv['up'])
+        self.assertEqual(srv['players_online'], '0')
+        self.assertIsNone(srv['latency'])
+        self.assertEqual(set(srv['timestamps']), set(srv) - set(['timestamps']))
+        self.assertTrue(all(t >= start for t in srv['timestamps'].itervalues()))
+
+    def test_snapshot(self):
+        collector = status_collector(self.base)
+        self.assertIsNone(collector.stats['collected'])
+
+        servers = collector.servers()
+        self.assertEqual([s['server_name'] for s in servers], ['one', 'two'])
+        collected = collector.stats['collected']
+        self.assertEqual(collector.stats['servers'], 2)
+
+        #readers share the snapshot instead of collecting again
+        self.assertEqual(collector.servers(['two', 'absent']), [servers[1]])
+        self.assertEqual(collector.stats['collected'], collected)
+
+        servers[0]['up'] = True
+        self.assertFalse(collector.servers(['one'])[0]['up'])
+
+        collector.collect()
+        self.assertGreaterEqual(collector.stats['collected'], collected)
+
+    def test_host(self):
+        collector = status_collector(self.base)
+        host = collector.host()
+        self.assertEqual(set(host), set(['uptime', 'memfree', 'df', 'git_hash', 'timestamps']))
+        self.assertIsInstance(host['uptime'], int)
+        self.assertEqual(set(host['timestamps']), set(host) - set(['timestamps']))
+
+if __name__ == "__main__":
+    unittest.main()
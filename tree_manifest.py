@@ -0,0 +1,140 @@
+"""
+    Tree manifests shared by dedup_store and region_backup: walking a
+    server directory into entries, the versioned, gzipped json manifest
+    that records them and rebuilding a tree from those entries.
+
+    Both modules are run by mineos as scripts rather than imported, so
+    that reading the live server and writing a restored tree happen as
+    the user mineos chooses for the command (the server's owner, or the
+    owner of the shared store) instead of as the web ui's user.
+"""
+
+__author__ = "William Dizon"
+__license__ = "GNU GPL v3.0"
+__version__ = "0.6.0"
+__email__ = "wdchromium@gmail.com"
+
+import os
+import stat
+
+def walk(source):
+    """Yields (path, entry) for every directory, symlink and regular
+    file under source, in sorted order.  entry holds the relative path,
+    mode and mtime; the type of directories and symlinks (and a symlink's
+    target); and the size of regular files, whose type is left to the
+    caller.  Other kinds of files are skipped."""
+    for root, dirs, files in os.walk(source):
+        dirs.sort()
+        for name in dirs + sorted(files):
+            path = os.path.join(root, name)
+            st = os.lstat(path)
+            entry = {
+                'path': os.path.relpath(path, source),
+                'mode': stat.S_IMODE(st.st_mode),
+                'mtime': st.st_mtime,
+                }
+
+            if stat.S_ISLNK(st.st_mode):
+                entry.update(type='symlink', target=os.readlink(path))
+            elif stat.S_ISDIR(st.st_mode):
+                entry['type'] = 'dir'
+            elif stat.S_ISREG(st.st_mode):
+                entry['size'] = st.st_size
+            else:
+                continue
+            yield path, entry
+
+def write_manifest(path, version, **fields):
+    """Writes fields and the manifest version as gzipped json, through a
+    partial file renamed into place"""
+    import gzip
+    import json
+
+    fields['version'] = version
+    partial = os.path.join(os.path.dirname(path), '.%s.partial' % os.path.basename(path))
+    with gzip.open(partial, 'wb') as fh:
+        json.dump(fields, fh)
+    os.rename(partial, path)
+
+def read_manifest(path, version):
+    """Returns the manifest at path, which must be of the given version"""
+    import gzip
+    import json
+
+    with gzip.open(path, 'rb') as fh:
+        manifest = json.load(fh)
+
+    if manifest.get('version') != version:
+        raise RuntimeError('Unsupported manifest version in %s' % path)
+    return manifest
+
+def check_paths(entries):
+    """Raises RuntimeError if any entry would be written outside of the
+    tree it is restored into"""
+    if any(os.path.isabs(e['path']) or '..' in e['path'].split(os.sep) for e in entries):
+        raise RuntimeError('Manifest contains files with absolute path or ../')
+
+def _kind(st):
+    if stat.S_ISLNK(st.st_mode):
+        return 'symlink'
+    elif stat.S_ISDIR(st.st_mode):
+        return 'dir'
+    elif stat.S_ISREG(st.st_mode):
+        return 'file'
+
+def _remove_others(destination, entries):
+    """Removes whatever under destination the entries do not name, or
+    name as another kind of file"""
+    from shutil import rmtree
+
+    kinds = dict((e['path'], e['type'] if e['type'] in ('dir', 'symlink') else 'file')
+                 for e in entries)
+
+    for root, dirs, files in os.walk(destination):
+        for name in dirs + files:
+            path = os.path.join(root, name)
+            kind = _kind(os.lstat(path))
+            if kinds.get(os.path.relpath(path, destination)) == kind:
+                continue
+
+            if kind == 'dir':
+                rmtree(path)
+                dirs.remove(name)
+            else:
+                os.remove(path)
+
+def restore_tree(destination, entries, write_file, remove_others=False):
+    """Rebuilds entries at destination: directories and symlinks from
+    the entries themselves, other files by write_file(entry, path).
+    Modes are applied as each is written and mtimes once the tree is
+    complete.  Symlinks in the way of directories or files are replaced
+    rather than followed.  With remove_others, anything already under
+    destination that the entries do not name is removed first.
+    Returns the number of files written."""
+    check_paths(entries)
+    if remove_others and os.path.isdir(destination):
+        _remove_others(destination, entries)
+
+    written = 0
+    for entry in entries:
+        path = os.path.join(destination, entry['path'])
+        if entry['type'] == 'symlink' or os.path.islink(path):
+            if os.path.lexists(path):
+                os.remove(path)
+
+        if entry['type'] == 'dir':
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        elif entry['type'] == 'symlink':
+            os.symlink(entry['target'], path)
+            continue
+        else:
+            write_file(entry, path)
+            written += 1
+        os.chmod(path, entry['mode'])
+
+    for entry in reversed(entries):
+        if entry['type'] != 'symlink':
+            os.utime(os.path.join(destination, entry['path']), (entry['mtime'], entry['mtime']))
+
+    return written